@@ -5,7 +5,7 @@ from .models import Dataset, DatasetItem
 
 @admin.register(Dataset)
 class DatasetAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "created_at")
+    list_display = ("id", "name", "items_count", "created_at")
     search_fields = ("name",)
 
 
@@ -0,0 +1,260 @@
+"""Dataset archives streamed straight from the dataset files.
+
+``GET /api/datasets/<id>/archive.zip`` (or ``.tar``) packs the items matching the
+``dataset_items_list`` filters - images, caption sidecars and masks under
+their dataset-relative paths - into a ZIP or tar that is produced while it
+is sent: nothing is written to disk and only one read buffer is held.
+
+* ``tar`` - the layout is computed up front from the file sizes (PAX
+  headers, 512-byte padding), so the response has a ``Content-Length``
+  and an ``ETag`` over the member list, and ``Range`` requests (with
+  ``If-Range``) resume an interrupted download at any byte.
+* ``zip`` - written through :mod:`zipfile` into a drained buffer, with
+  data descriptors and ZIP64 as needed.  JPEG, WebP and PNG members are
+  already compressed and are STORED; only captions are deflated.  The
+  compressed sizes are not known in advance, so there is no
+  ``Content-Length`` and no ``Range``.
+
+Captions come from the database (see ``captions.py``), so edits not yet
+written back to the sidecar are included.  Compact masks (``masks.py``)
+are rendered to PNG one at a time as they are sent, sized from the stored
+``mask_png_size``.  A file that changes size
+while the archive is sent is cut or zero-padded to the planned size,
+keeping the tar layout intact.
+"""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import json
+import logging
+import os
+import re
+import tarfile
+import time
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+
+from . import masks as compact_masks
+from .captions import item_caption, sidecar_text
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMATS = ("zip", "tar")
+CONTENT_TYPES = {"zip": "application/zip", "tar": "application/x-tar"}
+STORED_EXTS = {".jpg", ".jpeg", ".webp", ".png"}
+TAR_BLOCK = tarfile.BLOCKSIZE
+ZIP_EPOCH = 315532800  # 1980-01-01, the earliest ZIP timestamp
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+@dataclass(frozen=True)
+class Member:
+    """One archive entry: a file on disk (``path``), generated ``data`` or a
+    compact mask (``rle``) rendered to PNG when it is sent."""
+
+    name: str
+    size: int
+    mtime: int
+    path: str | None = None
+    data: bytes | None = None
+    rle: bytes | None = None
+
+
+def _file_member(root: Path, rel_path: str) -> Member | None:
+    path = root / rel_path
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return Member(rel_path, st.st_size, int(st.st_mtime), path=str(path))
+
+
+def plan_members(dataset, qs, captions: bool = True, masks: bool = True) -> list[Member]:
+    """Archive entries for the items of ``qs``, in its order.
+
+    Items whose image is missing on disk are left out.
+    """
+
+    root = Path(dataset.root_dir)
+    members: list[Member] = []
+    for item in qs.iterator(chunk_size=2000):
+        image = _file_member(root, item.image_path)
+        if image is None:
+            continue
+        members.append(image)
+        if captions:
+            meta = item_caption(item, root)
+            if meta["title"] or meta["caption"] or meta["tags"]:
+                name = item.caption_path or os.path.splitext(item.image_path)[0] + ".json"
+                data = sidecar_text(name, meta["title"], meta["caption"], meta["tags"]).encode(
+                    "utf-8"
+                )
+                members.append(Member(name, len(data), image.mtime, data=data))
+        if masks and item.mask_rle:
+            rle = bytes(item.mask_rle)
+            # Rows compacted before the PNG size was stored: measure once.
+            size = item.mask_png_size or len(compact_masks.to_png(rle))
+            members.append(Member(item.mask_path, size, image.mtime, rle=rle))
+        elif masks and item.mask_path:
+            mask = _file_member(root, item.mask_path)
+            if mask is not None:
+                members.append(mask)
+    return members
+
+
+def archive_etag(members: list[Member], fmt: str) -> str:
+    h = hashlib.sha256(fmt.encode())
+    for m in members:
+        content = m.data if m.data is not None else m.rle
+        digest = hashlib.sha256(content).hexdigest() if content is not None else ""
+        h.update(json.dumps([m.name, m.size, m.mtime, digest]).encode("utf-8"))
+    return f'"{h.hexdigest()[:32]}"'
+
+
+def _read(member: Member, skip: int = 0, length: int | None = None):
+    """Bytes ``skip:skip+length`` of a member, padded/cut to its planned size."""
+
+    end = member.size if length is None else skip + length
+    chunk_size = settings.FILE_CHUNK_SIZE
+    position = skip
+    if member.data is not None or member.rle is not None:
+        data = member.data if member.data is not None else compact_masks.to_png(member.rle)
+        data = data[skip:end]
+        position += len(data)
+        yield data
+    else:
+        try:
+            with open(member.path, "rb") as f:
+                f.seek(skip)
+                while position < end:
+                    data = f.read(min(chunk_size, end - position))
+                    if not data:
+                        break
+                    position += len(data)
+                    yield data
+        except OSError:
+            pass
+    if position < end:
+        logger.warning("archive member %s shrank while streaming", member.name)
+        while position < end:
+            pad = min(chunk_size, end - position)
+            position += pad
+            yield bytes(pad)
+
+
+# === tar ===
+
+
+def _tar_header(member: Member) -> bytes:
+    info = tarfile.TarInfo(member.name)
+    info.size = member.size
+    info.mtime = member.mtime
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+class TarLayout:
+    """Byte layout of a tar of ``members``: headers, data and padding."""
+
+    def __init__(self, members: list[Member]):
+        # (length, bytes or Member)
+        self.segments: list[tuple[int, object]] = []
+        for member in members:
+            header = _tar_header(member)
+            self.segments.append((len(header), header))
+            if member.size:
+                self.segments.append((member.size, member))
+            pad = -member.size % TAR_BLOCK
+            if pad:
+                self.segments.append((pad, bytes(pad)))
+        self.segments.append((2 * TAR_BLOCK, bytes(2 * TAR_BLOCK)))
+        self.starts: list[int] = []
+        total = 0
+        for length, _source in self.segments:
+            self.starts.append(total)
+            total += length
+        self.size = total
+
+    def iter_bytes(self, start: int = 0, end: int | None = None):
+        """Yield bytes ``start..end`` (inclusive) of the archive."""
+
+        end = self.size - 1 if end is None else end
+        index = bisect.bisect_right(self.starts, start) - 1
+        position = start
+        while position <= end and index < len(self.segments):
+            length, source = self.segments[index]
+            offset = position - self.starts[index]
+            count = min(length - offset, end + 1 - position)
+            if isinstance(source, Member):
+                yield from _read(source, offset, count)
+            else:
+                yield source[offset : offset + count]
+            position += count
+            index += 1
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """``(start, end)`` of a single ``bytes=`` range; ``None`` for the whole body.
+
+    Raises ``ValueError`` for an unsatisfiable range.
+    """
+
+    match = _RANGE.match((header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+# === zip ===
+
+
+class _Sink:
+    """Write-only file object whose contents are taken by :meth:`drain`."""
+
+    def __init__(self):
+        self.parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self):
+        parts, self.parts = self.parts, []
+        if parts:
+            yield b"".join(parts)
+
+
+def iter_zip(members: list[Member]):
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True, compresslevel=6) as zf:
+        for member in members:
+            info = zipfile.ZipInfo(member.name, time.gmtime(max(member.mtime, ZIP_EPOCH))[:6])
+            info.compress_type = (
+                zipfile.ZIP_STORED
+                if os.path.splitext(member.name)[1].lower() in STORED_EXTS
+                else zipfile.ZIP_DEFLATED
+            )
+            info.file_size = member.size  # picks ZIP64 for large members
+            info.external_attr = 0o644 << 16
+            with zf.open(info, "w") as dst:
+                for data in _read(member):
+                    dst.write(data)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
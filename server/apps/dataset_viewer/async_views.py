@@ -0,0 +1,280 @@
+"""Async file, thumbnail, item image and mask views for the ASGI mode.
+
+Under ``fluxlab.asgi`` (``settings.ASGI_SERVING``) the URLconf routes the
+serving endpoints here instead of to the DRF views in ``views.py``; the
+responses are the same.
+
+* Lookups use the async ORM.
+* Files are streamed in ``FILE_CHUNK_SIZE`` chunks read on a small IO
+  thread pool, so a slow client downloading an original holds a coroutine
+  rather than a worker thread.  The ASGI server only asks for the next
+  chunk once the previous one is sent.
+* Thumbnail renders and mask previews go to the shared image pool
+  (``imagepool.py``) at interactive priority.  When its queue is full the
+  request gets ``503`` with ``Retry-After`` instead of piling up.
+  Concurrent requests for the same missing thumbnail share one render,
+  which is cancelled if all of them disconnect before it starts.
+* Compact masks (``masks.py``) are rendered to PNG on the pool as well.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from . import imagepool, masks, views
+from .metrics import observe_decode, record_cache
+from .models import Dataset, DatasetItem
+from .utils import (
+    ensure_thumbnail,
+    get_dataset_root,
+    render_mask_preview,
+    resolve_dataset_image_abs_path,
+    sha256_file,
+    thumbnail_path_for,
+)
+
+MIMES = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+RETRY_AFTER = "1"
+
+_io_pool: ThreadPoolExecutor | None = None
+_io_pool_lock = threading.Lock()
+# key -> [pool future, number of requests waiting for it]
+_inflight: dict[str, list] = {}
+_inflight_lock = threading.Lock()
+
+
+def _io_executor() -> ThreadPoolExecutor:
+    global _io_pool
+    with _io_pool_lock:
+        if _io_pool is None:
+            _io_pool = ThreadPoolExecutor(settings.FILE_IO_THREADS, thread_name_prefix="fluxlab-io")
+        return _io_pool
+
+
+async def _io(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_io_executor(), fn, *args)
+
+
+def _forget(key: str, future: Future) -> None:
+    with _inflight_lock:
+        entry = _inflight.get(key)
+        if entry is not None and entry[0] is future:
+            del _inflight[key]
+
+
+async def run_decode(key: str, fn, *args):
+    """Run ``fn(*args)`` on the image pool, shared by concurrent calls with ``key``.
+
+    Raises :class:`imagepool.PoolBusy` when the pool queue is full.  When
+    every request waiting for a task has gone away, the task is cancelled
+    unless it already started.
+    """
+
+    with _inflight_lock:
+        entry = _inflight.get(key)
+        started = entry is None
+        if started:
+            if imagepool.get_pool().inline:
+                # Keep inline decodes off the event loop.
+                future = _io_executor().submit(fn, *args)
+            else:
+                future = imagepool.submit(fn, *args, priority=imagepool.INTERACTIVE)
+            entry = _inflight[key] = [future, 0]
+        entry[1] += 1
+    future = entry[0]
+    if started:
+        # Outside the lock: the callback runs right here if already done.
+        future.add_done_callback(lambda done: _forget(key, done))
+    try:
+        # Shielded: one client going away must not cancel a render others wait for.
+        return await asyncio.shield(asyncio.wrap_future(future))
+    finally:
+        with _inflight_lock:
+            entry[1] -= 1
+            if entry[1] == 0 and not future.done():
+                future.cancel()
+
+
+def _stat(path: Path) -> os.stat_result | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st if path.is_file() else None
+
+
+async def _chunks(path: Path, chunk_size: int):
+    f = await _io(open, path, "rb")
+    try:
+        while chunk := await _io(f.read, chunk_size):
+            yield chunk
+    finally:
+        f.close()
+
+
+async def _file_response(path: Path, st: os.stat_result, content_type: str, etag: bool = False):
+    resp = StreamingHttpResponse(_chunks(path, settings.FILE_CHUNK_SIZE), content_type=content_type)
+    resp["Content-Length"] = str(st.st_size)
+    if etag:
+        resp["Cache-Control"] = "public, max-age=86400"
+        digest = await _io(sha256_file, path)
+        if digest:
+            resp["ETag"] = digest
+    return resp
+
+
+def _detail(message: str, status: int) -> JsonResponse:
+    return JsonResponse({"detail": message}, status=status)
+
+
+def _busy() -> JsonResponse:
+    resp = _detail("image workers busy, retry later", 503)
+    resp["Retry-After"] = RETRY_AFTER
+    return resp
+
+
+async def _dataset_source(request, dataset_id: int):
+    """``(path, stat, ext)`` of the ``?path=`` image of a dataset, or an error response."""
+
+    dataset = await Dataset.objects.filter(id=dataset_id).afirst()
+    if not dataset:
+        return _detail("Dataset not found", 404)
+    rel_path = request.GET.get("path")
+    if not rel_path:
+        return _detail("path is required", 400)
+    try:
+        abs_path = await _io(resolve_dataset_image_abs_path, dataset, rel_path)
+    except ValueError:
+        return _detail("file not found", 404)
+    st = await _io(_stat, abs_path)
+    if st is None:
+        return _detail("file not found", 404)
+    ext = abs_path.suffix.lower().lstrip(".")
+    if ext not in MIMES:
+        return _detail("unsupported media type", 415)
+    return abs_path, st, ext
+
+
+async def dataset_file_serve(request, dataset_id: int):
+    if request.method != "GET":
+        return _detail(f'Method "{request.method}" not allowed.', 405)
+    source = await _dataset_source(request, dataset_id)
+    if isinstance(source, JsonResponse):
+        return source
+    abs_path, st, ext = source
+    return await _file_response(abs_path, st, MIMES[ext], etag=True)
+
+
+async def dataset_thumb_serve(request, dataset_id: int):
+    if request.method != "GET":
+        return _detail(f'Method "{request.method}" not allowed.', 405)
+    source = await _dataset_source(request, dataset_id)
+    if isinstance(source, JsonResponse):
+        return source
+    src_path = source[0]
+
+    thumb_path = thumbnail_path_for(dataset_id, request.GET["path"])
+    st = await _io(_stat, thumb_path)
+    record_cache("thumbnail", hit=st is not None)
+    if st is None:
+        started = time.perf_counter()
+        try:
+            rendered = await run_decode(str(thumb_path), ensure_thumbnail, src_path, thumb_path)
+        except imagepool.PoolBusy:
+            return _busy()
+        if rendered:
+            observe_decode("thumbnail", time.perf_counter() - started)
+        st = await _io(_stat, thumb_path)
+    return await _file_response(thumb_path, st, "image/jpeg", etag=True)
+
+
+async def item_image(request, item_id: int):
+    if request.method != "GET":
+        return _detail(f'Method "{request.method}" not allowed.', 405)
+    item = await DatasetItem.objects.select_related("dataset").filter(id=item_id).afirst()
+    if not item:
+        return _detail("Item not found", 404)
+    abs_path = os.path.normpath(os.path.join(item.dataset.root_dir, item.image_path))
+    if not abs_path.startswith(os.path.normpath(item.dataset.root_dir)):
+        return _detail("Invalid path", 404)
+    st = await _io(_stat, Path(abs_path))
+    if st is None:
+        return _detail("File not found", 404)
+    ext = Path(abs_path).suffix.lower().lstrip(".")
+    return await _file_response(Path(abs_path), st, MIMES.get(ext, "application/octet-stream"))
+
+
+async def _item_mask(item_id: int):
+    """``(item, PNG path)``; the path is ``None`` for a compact mask."""
+
+    item = await DatasetItem.objects.select_related("dataset").filter(id=item_id).afirst()
+    if not item or not item.mask_path:
+        return None, None
+    if item.mask_rle:
+        return item, None
+    root = get_dataset_root(item.dataset)
+    mask_abs = await _io(lambda: (root / item.mask_path).resolve())
+    return item, mask_abs
+
+
+@csrf_exempt
+async def dataset_item_mask(request, item_id: int):
+    """GET streams the mask; uploads and deletes go to the sync view."""
+
+    if request.method != "GET":
+        return await sync_to_async(views.dataset_item_mask)(request, item_id=item_id)
+    item, mask_abs = await _item_mask(item_id)
+    if item is not None and mask_abs is None:
+        blob = item.mask_rle
+        try:
+            png = await run_decode(f"mask:{item.id}:{zlib.crc32(blob)}", masks.to_png, blob)
+        except imagepool.PoolBusy:
+            return _busy()
+        return HttpResponse(png, content_type="image/png")
+    st = await _io(_stat, mask_abs) if mask_abs else None
+    if st is None:
+        return _detail("Mask not found", 404)
+    return await _file_response(mask_abs, st, "image/png")
+
+
+async def dataset_item_mask_preview(request, item_id: int):
+    if request.method != "GET":
+        return _detail(f'Method "{request.method}" not allowed.', 405)
+    item, mask_abs = await _item_mask(item_id)
+    if not item:
+        return _detail("Mask not found", 404)
+    try:
+        size = max(1, int(request.GET.get("size", "128")))
+    except ValueError:
+        return _detail("size must be int", 400)
+    if mask_abs is None:
+        render, source = masks.render_preview, item.mask_rle
+    elif await _io(_stat, mask_abs) is None:
+        return _detail("Mask not found", 404)
+    else:
+        render, source = render_mask_preview, mask_abs
+
+    cache_path = get_dataset_root(item.dataset) / ".cache" / "masks" / str(size) / item.mask_path
+    st = await _io(_stat, cache_path)
+    record_cache("mask_preview", hit=st is not None)
+    if st is None:
+        await _io(lambda: cache_path.parent.mkdir(parents=True, exist_ok=True))
+        started = time.perf_counter()
+        try:
+            await run_decode(str(cache_path), render, source, cache_path, size)
+        except imagepool.PoolBusy:
+            return _busy()
+        observe_decode("mask_preview", time.perf_counter() - started)
+        st = await _io(_stat, cache_path)
+    return await _file_response(cache_path, st, "image/png")
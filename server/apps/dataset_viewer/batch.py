@@ -0,0 +1,177 @@
+"""Batch item operations: fetch, delete and patch many items at once.
+
+Each mutation is one transaction of set-based statements (``id__in``
+deletes, ``bulk_update``), so pruning thousands of items costs a handful
+of queries instead of one request and commit per item.  Thumbnails, mask
+previews and (on request) the files themselves are removed afterwards on
+a background thread; they are derived data and losing a cleanup only
+leaves an orphan file behind.
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .captions import CAPTION_FIELDS, caption_fields, schedule_writeback, set_caption
+from .masks import COMPACT_FIELDS, set_mask_path
+from .models import Dataset, DatasetItem, FileSnapshot
+from .stats import ItemStats, StatsDelta, apply_delta
+from .sync import drop_thumbnail
+from .tags import retag_items, untag_items
+from .utils import resolve_dataset_image_abs_path
+from .writequeue import run_write
+
+MAX_BATCH = 10000
+STATS_FIELDS = ("has_caption", "file_size", "width", "height")
+PATCH_FIELDS = ["mask_path", *COMPACT_FIELDS, *CAPTION_FIELDS, "caption_dirty"]
+CHUNK = 500
+
+_cleanup_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fluxlab-cleanup")
+
+
+def _chunks(seq, size=CHUNK):
+    for start in range(0, len(seq), size):
+        yield seq[start : start + size]
+
+
+def fetch_items(dataset: Dataset, ids: list[int]) -> tuple[list[DatasetItem], list[int]]:
+    """Return the items of ``dataset`` with ``ids`` in request order, plus missing ids."""
+
+    found: dict[int, DatasetItem] = {}
+    for chunk in _chunks(ids):
+        found.update(
+            (item.id, item)
+            for item in DatasetItem.objects.filter(dataset=dataset, id__in=chunk)
+        )
+    return [found[i] for i in ids if i in found], [i for i in ids if i not in found]
+
+
+def _remove_derived(root_dir: str, dataset_id: int, rows: list[tuple], delete_files: bool):
+    root = Path(root_dir)
+    previews = root / ".cache" / "masks"
+    sizes = list(previews.iterdir()) if previews.is_dir() else []
+    for _, image_path, mask_path, caption_path in rows:
+        drop_thumbnail(dataset_id, image_path)
+        for size_dir in sizes:
+            if mask_path:
+                (size_dir / mask_path).unlink(missing_ok=True)
+        if delete_files:
+            for rel in (image_path, mask_path, caption_path):
+                if not rel:
+                    continue
+                try:
+                    os.unlink(root / rel)
+                except OSError:
+                    pass
+
+
+def delete_items(dataset: Dataset, ids: list[int], delete_files: bool = False) -> dict:
+    """Delete the given items of ``dataset`` in one transaction.
+
+    Unknown ids are reported as ``missing``.  With ``delete_files`` the
+    image, its mask and caption sidecar are removed from disk too (in the
+    background); otherwise they stay and the sync snapshot keeps them from
+    being re-registered.
+    """
+
+    def write():
+        rows = []
+        delta = StatsDelta()
+        for chunk in _chunks(ids):
+            qs = DatasetItem.objects.filter(dataset=dataset, id__in=chunk).only(
+                "image_path", "mask_path", "caption_path", *STATS_FIELDS
+            )
+            for item in qs:
+                rows.append((item.id, item.image_path, item.mask_path, item.caption_path))
+                delta.add(ItemStats.of(item), -1)
+        found = [row[0] for row in rows]
+        untag_items(found)
+        for chunk in _chunks(found):
+            DatasetItem.objects.filter(id__in=chunk).delete()
+        if delete_files:
+            paths = [row[1] for row in rows]
+            for chunk in _chunks(paths):
+                FileSnapshot.objects.filter(dataset=dataset, path__in=chunk).delete()
+        apply_delta(dataset.id, delta)
+        return rows
+
+    rows = run_write(write)
+    if rows:
+        _cleanup_pool.submit(_remove_derived, dataset.root_dir, dataset.id, rows, delete_files)
+    deleted = {row[0] for row in rows}
+    return {"deleted": len(deleted), "missing": [i for i in ids if i not in deleted]}
+
+
+def _checked_relpath(dataset: Dataset, rel: str) -> str:
+    rel = rel.replace("\\", "/").strip()
+    if os.path.isabs(rel) or rel.startswith("/"):
+        raise ValueError(f"path must be relative: {rel}")
+    resolve_dataset_image_abs_path(dataset, rel)
+    return os.path.normpath(rel).replace("\\", "/")
+
+
+def patch_items(dataset: Dataset, patches: list[dict]) -> dict:
+    """Update the caption and/or mask of many items at once.
+
+    ``patches`` are ``{"id", "caption_path"?, "mask_path"?, "title"?,
+    "caption"?, "tags"?}``; a missing key leaves the field alone, an empty
+    path clears it.  Paths are relative to the dataset root.  A caption
+    path that exists is read into the caption columns; otherwise the
+    current caption is written there.  Caption edits are stored in the
+    database and written to the sidecars in the background.  Raises
+    ``ValueError`` on a bad path, before anything is written.
+    """
+
+    changes: dict[int, dict] = {}
+    for patch in patches:
+        fields = {}
+        for name in ("caption_path", "mask_path"):
+            if name in patch:
+                value = patch[name] or ""
+                fields[name] = _checked_relpath(dataset, value) if value else ""
+        for name in ("title", "caption", "tags"):
+            if patch.get(name) is not None:
+                fields[name] = patch[name]
+        if fields:
+            changes.setdefault(patch["id"], {}).update(fields)
+
+    root = dataset.root_dir
+    items, _ = fetch_items(dataset, list(changes))
+    delta = StatsDelta()
+    dirty = False
+    for item in items:
+        delta.add(ItemStats.of(item), -1)
+        change = changes[item.id]
+        if "mask_path" in change:
+            set_mask_path(item, change["mask_path"])
+        if "caption_path" in change:
+            path = change["caption_path"]
+            if not path:
+                item.caption_path = ""
+                item.has_caption = False
+            elif os.path.isfile(os.path.join(root, path)):
+                for name, value in caption_fields(root, item.image_path, path).items():
+                    setattr(item, name, value)
+                item.caption_dirty = False
+            else:
+                item.caption_path = path
+                item.has_caption = True
+                item.caption_dirty = True
+        if {"title", "caption", "tags"} & change.keys():
+            set_caption(item, change.get("title"), change.get("caption"), change.get("tags"))
+        dirty = dirty or item.caption_dirty
+        delta.add(ItemStats.of(item))
+
+    def write():
+        DatasetItem.objects.bulk_update(items, PATCH_FIELDS, batch_size=CHUNK)
+        retag_items(dataset.id, items)
+        apply_delta(dataset.id, delta)
+
+    if items:
+        run_write(write)
+        if dirty:
+            schedule_writeback(dataset.id)
+    patched = {item.id for item in items}
+    return {"updated": len(patched), "missing": [i for i in changes if i not in patched]}
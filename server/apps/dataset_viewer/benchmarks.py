@@ -0,0 +1,273 @@
+"""Benchmark suite over a synthetic dataset, driven through the HTTP stack.
+
+:func:`run_suite` registers a dataset root (see ``synthetic.py``) and times
+the main endpoints with the Django test client, so middleware, views,
+serializers and the database are all included, only the network is not.
+Each case runs ``repeat`` times; a result holds the timings in seconds
+and their summary.  :func:`compare` flags cases slower than a baseline run.
+
+The suite writes to whatever database is configured; ``fluxlab_bench``
+runs it against a throw-away database file.  Uploaded files are removed
+and imported captions restored afterwards, so the same root can be
+benchmarked again.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import platform
+import shutil
+import statistics
+import time
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.test import Client
+
+from . import masks
+from .hashing import full_sha256, quick_fingerprint
+from .imageheader import read_header
+from .models import Dataset, DatasetItem
+from .response_cache import response_cache
+from .synthetic import synthetic_image
+from .utils import iter_images, pil_image_size, render_mask_preview, thumbnail_path_for
+
+UPLOAD_FILES = 16
+UPLOAD_SUBDIR = "bench_uploads"
+THUMB_ITEMS = 32
+
+
+def summarize(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "p95": ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))],
+        "max": ordered[-1],
+        "samples": ordered,
+    }
+
+
+class Suite:
+    def __init__(self, repeat: int = 5, log=None):
+        self.repeat = repeat
+        self.client = Client()
+        self.results: dict[str, dict] = {}
+        self.log = log or (lambda _msg: None)
+
+    def time(self, name: str, fn, setup=None, runs: int | None = None, **extra) -> dict:
+        """Run ``fn`` ``runs`` times (``setup`` untimed before each) and record it."""
+
+        samples = []
+        for _ in range(runs or self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            resp = fn()
+            samples.append(time.perf_counter() - started)
+            status = getattr(resp, "status_code", 200)
+            if status >= 400:
+                raise RuntimeError(f"{name}: HTTP {status}: {resp.content[:200]!r}")
+        result = {**summarize(samples), **extra}
+        self.results[name] = result
+        self.log(f"{name}: median {result['median'] * 1000:.1f} ms over {result['runs']} runs")
+        return result
+
+
+def _read(resp):
+    """Consume a (possibly streaming) response like a client would."""
+
+    if getattr(resp, "streaming", False):
+        for _ in resp.streaming_content:
+            pass
+    else:
+        resp.content
+    return resp
+
+
+def _upload_payload(run: int, count: int) -> dict:
+    files = []
+    for i in range(count):
+        buf = io.BytesIO()
+        synthetic_image(10_000_000 + run * count + i, 512, 512).save(buf, "JPEG", quality=90)
+        buf.seek(0)
+        buf.name = f"upload_{run:03d}_{i:03d}.jpg"
+        files.append(buf)
+    return {"files": files, "subdir": UPLOAD_SUBDIR}
+
+
+def run_suite(root: str | Path, name: str = "bench", repeat: int = 5, log=None) -> dict:
+    """Time the endpoints over the dataset at ``root``; returns the results."""
+
+    suite = Suite(repeat, log)
+    client = suite.client
+    Dataset.objects.filter(name=name).delete()
+
+    # Scan: the first pass registers every file, later passes find them unchanged.
+    suite.time(
+        "dataset_scan",
+        lambda: client.post(
+            "/api/datasets/scan", {"name": name, "root_dir": str(root)}, "application/json"
+        ),
+        runs=1,
+    )
+    dataset = Dataset.objects.get(name=name)
+    items = dataset.items_count
+    suite.results["dataset_scan"]["items"] = items
+    suite.time(
+        "dataset_rescan",
+        lambda: client.post(
+            "/api/datasets/scan", {"name": name, "root_dir": str(root)}, "application/json"
+        ),
+        items=items,
+    )
+
+    # Dimension probing alone: PIL's Image.open against the header parser.
+    files = list(iter_images(root))
+    suite.time("image_size_pil", lambda: [pil_image_size(p) for p in files], files=len(files))
+    suite.time("image_size_header", lambda: [read_header(p) for p in files], files=len(files))
+    # Ingest fingerprint against the full hash left to the background pass.
+    suite.time("hash_quick", lambda: [quick_fingerprint(p) for p in files], files=len(files))
+    suite.time("hash_sha256", lambda: [full_sha256(p) for p in files], files=len(files))
+
+    # Mask previews and coverage from the PNG files against the compact store.
+    mask_files = sorted(Path(root, "masks").glob("*.png"))[:THUMB_ITEMS]
+    blobs = [masks.encode_image(str(p))["mask_rle"] for p in mask_files]
+    scratch = Path(root, ".cache", "bench_masks.png")
+    scratch.parent.mkdir(parents=True, exist_ok=True)
+    suite.time(
+        "mask_preview_png",
+        lambda: [render_mask_preview(p, scratch, 128) for p in mask_files],
+        masks=len(mask_files),
+    )
+    suite.time(
+        "mask_preview_compact",
+        lambda: [masks.render_preview(b, scratch, 128) for b in blobs],
+        masks=len(mask_files),
+        bytes_png=sum(p.stat().st_size for p in mask_files),
+        bytes_compact=sum(len(b) for b in blobs),
+    )
+    suite.time("mask_coverage_compact", lambda: [masks.coverage(b) for b in blobs])
+    scratch.unlink(missing_ok=True)
+
+    url = f"/api/datasets/{dataset.id}"
+    page_size = settings.REST_FRAMEWORK.get("PAGE_SIZE", 50)
+    last_page = max(1, -(-items // page_size))
+    for label, page in (("first", 1), ("middle", max(1, last_page // 2)), ("last", last_page)):
+        suite.time(
+            f"dataset_items_list_{label}_page",
+            lambda page=page: client.get(f"{url}/items", {"page": page}),
+            setup=response_cache.clear,
+            page=page,
+        )
+    suite.time(
+        "dataset_items_list_cached",
+        lambda: client.get(f"{url}/items", {"page": last_page}),
+        page=last_page,
+    )
+
+    paths = list(
+        DatasetItem.objects.filter(dataset=dataset)
+        .order_by("id")
+        .values_list("image_path", flat=True)[:THUMB_ITEMS]
+    )
+
+    def drop_thumbs():
+        for rel in paths:
+            thumbnail_path_for(dataset.id, rel).unlink(missing_ok=True)
+
+    def thumbs():
+        for rel in paths:
+            resp = _read(client.get(f"{url}/thumb", {"path": rel}))
+            if resp.status_code != 200:
+                return resp
+
+    suite.time("dataset_thumb_serve_cold", thumbs, setup=drop_thumbs, thumbnails=len(paths))
+    suite.time("dataset_thumb_serve_warm", thumbs, thumbnails=len(paths))
+
+    exported = {}
+
+    def export():
+        resp = client.get(f"{url}/export")
+        exported["payload"] = resp.content
+        return resp
+
+    suite.time("dataset_export", export, setup=response_cache.clear, items=items)
+
+    payload = json.loads(exported["payload"])
+    originals = [row.get("caption") or "" for row in payload]
+    runs = iter(range(10**9))
+
+    def edit_captions():
+        run = next(runs)
+        for row, caption in zip(payload, originals):
+            row["caption"] = f"{caption} #{run}".strip()
+
+    suite.time(
+        "dataset_import",
+        lambda: client.post(f"{url}/import", json.dumps(payload), "application/json"),
+        setup=edit_captions,
+        items=len(payload),
+    )
+    # Put the captions back; the write-back would otherwise keep the edits on disk.
+    for row, caption in zip(payload, originals):
+        row["caption"] = caption
+    client.post(f"{url}/import", json.dumps(payload), "application/json")
+
+    upload_dir = Path(root, "images", UPLOAD_SUBDIR)
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    uploads = iter(range(10**9))
+    pending = {}
+    suite.time(
+        "dataset_upload",
+        lambda: client.post(f"{url}/upload", pending["data"]),
+        setup=lambda: pending.update(data=_upload_payload(next(uploads), UPLOAD_FILES)),
+        files=UPLOAD_FILES,
+    )
+    shutil.rmtree(upload_dir, ignore_errors=True)
+
+    suite.time(
+        "enhance_preview",
+        lambda: client.post(
+            "/api/enhance/preview",
+            {"image_path": "img.jpg", "auto_policy": "BASIC"},
+            "application/json",
+        ),
+        runs=max(suite.repeat, 20),
+    )
+    return suite.results
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "database": settings.DATABASES["default"]["ENGINE"],
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 1.25) -> list[dict]:
+    """Cases whose median is more than ``threshold`` times the baseline median."""
+
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or not base.get("median"):
+            continue
+        ratio = result["median"] / base["median"]
+        if ratio > threshold:
+            regressions.append(
+                {
+                    "case": name,
+                    "ratio": round(ratio, 3),
+                    "median": result["median"],
+                    "baseline_median": base["median"],
+                }
+            )
+    return regressions
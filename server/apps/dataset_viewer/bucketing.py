@@ -0,0 +1,144 @@
+"""Aspect-ratio bucketing for Flux LoRA training.
+
+Every item is assigned to the target resolution whose aspect ratio is
+closest (in log space) to its own.  Assignment works on the ``width`` and
+``height`` already stored on :class:`DatasetItem`, vectorized with NumPy over
+the whole dataset, and never opens an image.  Results are persisted in
+``DatasetItem.bucket`` so only new items need to be processed on later runs.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Dataset, DatasetItem
+from .stats import bump_version
+
+CHUNK = 262_144
+UPDATE_BATCH = 500
+
+
+def bucket_label(width: int, height: int) -> str:
+    return f"{width}x{height}"
+
+
+def parse_bucket_label(label: str) -> tuple[int, int]:
+    w, _, h = label.partition("x")
+    return int(w), int(h)
+
+
+def parse_resolutions(raw) -> list[tuple[int, int]]:
+    """Validate a list of ``[w, h]`` pairs or ``"WxH"`` strings."""
+
+    if not isinstance(raw, (list, tuple)) or not raw:
+        raise ValueError("resolutions must be a non-empty list")
+    result: list[tuple[int, int]] = []
+    for entry in raw:
+        try:
+            if isinstance(entry, str):
+                w, h = parse_bucket_label(entry)
+            else:
+                w, h = (int(v) for v in entry)
+        except (TypeError, ValueError):
+            raise ValueError(f"invalid resolution: {entry!r}")
+        if w <= 0 or h <= 0:
+            raise ValueError(f"invalid resolution: {entry!r}")
+        if (w, h) not in result:
+            result.append((w, h))
+    return result
+
+
+def get_resolutions(dataset: Dataset) -> list[tuple[int, int]]:
+    return parse_resolutions(dataset.bucket_resolutions or settings.BUCKET_RESOLUTIONS)
+
+
+def assign_buckets(widths, heights, resolutions) -> np.ndarray:
+    """Return the index into ``resolutions`` for every (width, height) pair.
+
+    Pairs without usable dimensions get ``-1``.
+    """
+
+    w = np.asarray(widths, dtype=np.float64)
+    h = np.asarray(heights, dtype=np.float64)
+    res = np.asarray(resolutions, dtype=np.float64)
+    targets = np.log(res[:, 0] / res[:, 1])
+    out = np.full(w.shape[0], -1, dtype=np.int64)
+    for start in range(0, w.shape[0], CHUNK):
+        cw, ch = w[start : start + CHUNK], h[start : start + CHUNK]
+        valid = (cw > 0) & (ch > 0)
+        log_ar = np.log(np.where(valid, cw, 1.0) / np.where(valid, ch, 1.0))
+        idx = np.abs(log_ar[:, None] - targets[None, :]).argmin(axis=1)
+        out[start : start + CHUNK] = np.where(valid, idx, -1)
+    return out
+
+
+def assign_dataset_buckets(dataset: Dataset, full: bool = False) -> int:
+    """Assign buckets to the items of ``dataset`` and return how many changed.
+
+    Only items without a bucket are processed unless ``full`` is set, which
+    is required after the dataset's resolutions change.
+    """
+
+    resolutions = get_resolutions(dataset)
+    qs = DatasetItem.objects.filter(
+        dataset=dataset, width__isnull=False, height__isnull=False
+    )
+    if not full:
+        qs = qs.filter(bucket="")
+    rows = np.array(list(qs.values_list("id", "width", "height")), dtype=np.int64)
+    if not rows.size:
+        return 0
+
+    assigned = assign_buckets(rows[:, 1], rows[:, 2], resolutions)
+    changed = 0
+    with transaction.atomic():
+        for idx, (w, h) in enumerate(resolutions):
+            ids = rows[assigned == idx, 0].tolist()
+            label = bucket_label(w, h)
+            for start in range(0, len(ids), UPDATE_BATCH):
+                changed += (
+                    DatasetItem.objects.filter(id__in=ids[start : start + UPDATE_BATCH])
+                    .exclude(bucket=label)
+                    .update(bucket=label)
+                )
+        if full:
+            labels = [bucket_label(w, h) for w, h in resolutions]
+            changed += (
+                DatasetItem.objects.filter(dataset=dataset)
+                .exclude(bucket="")
+                .exclude(bucket__in=labels)
+                .update(bucket="")
+            )
+        if changed:
+            bump_version(dataset.id)
+    return changed
+
+
+def bucket_histogram(dataset: Dataset) -> dict:
+    counts = dict(
+        DatasetItem.objects.filter(dataset=dataset)
+        .values_list("bucket")
+        .annotate(n=Count("id"))
+        .values_list("bucket", "n")
+    )
+    buckets = []
+    for w, h in get_resolutions(dataset):
+        label = bucket_label(w, h)
+        buckets.append(
+            {
+                "bucket": label,
+                "width": w,
+                "height": h,
+                "aspect_ratio": round(w / h, 4),
+                "count": counts.pop(label, 0),
+            }
+        )
+    return {
+        "buckets": buckets,
+        "unassigned": counts.pop("", 0),
+        # Labels left over from a previous configuration.
+        "stale": counts,
+    }
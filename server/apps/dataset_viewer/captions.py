@@ -0,0 +1,319 @@
+"""Captions stored on ``DatasetItem`` with lazy sidecar write-back.
+
+The database is the read path: scan, sync and import fill
+``caption_title``/``caption_text``/``caption_tags``, so listing, export and
+training exports never open a sidecar.  ``caption_mtime_ns`` records the
+sidecar's mtime when it was last read or written (``NO_SIDECAR`` when
+there is none, ``0`` for rows that predate these columns).
+
+Edits made through the API only touch the database and set
+``caption_dirty``; :func:`schedule_writeback` then writes the sidecars in
+batches on a background thread after the transaction commits.
+:func:`reconcile_captions` goes the other way and re-reads sidecars that
+were edited on disk (their mtime no longer matches); rows with a pending
+write-back keep the database version.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.db import close_old_connections, transaction
+
+from .models import Dataset, DatasetItem
+from .stats import ItemStats, StatsDelta, apply_delta
+from .tags import retag_items
+from .utils import find_caption_file, read_caption_file
+from .writequeue import run_write
+
+logger = logging.getLogger(__name__)
+
+NO_SIDECAR = -1
+CAPTION_FIELDS = (
+    "caption_path",
+    "has_caption",
+    "caption_title",
+    "caption_text",
+    "caption_tags",
+    "caption_mtime_ns",
+)
+SIDECAR_SUFFIXES = (".json", ".txt")
+BATCH = 500
+
+
+def is_sidecar_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in SIDECAR_SUFFIXES
+
+
+def caption_fields(root_dir: str | Path, image_path: str, caption_path: str = "") -> dict:
+    """``DatasetItem`` caption columns read from the item's sidecar, if any."""
+
+    path = find_caption_file(root_dir, image_path, caption_path)
+    if path is None:
+        return {
+            "caption_path": "",
+            "has_caption": False,
+            "caption_title": "",
+            "caption_text": "",
+            "caption_tags": [],
+            "caption_mtime_ns": NO_SIDECAR,
+        }
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except OSError:
+        mtime_ns = NO_SIDECAR
+    meta = read_caption_file(path)
+    return {
+        "caption_path": os.path.relpath(path, root_dir).replace("\\", "/"),
+        "has_caption": True,
+        "caption_title": meta["title"],
+        "caption_text": meta["caption"],
+        "caption_tags": list(meta["tags"]),
+        "caption_mtime_ns": mtime_ns,
+    }
+
+
+def keep_db_caption(item, fields: dict) -> dict:
+    """Merge the caption columns of a re-probe with what only the database has.
+
+    While a write-back is pending the database version wins outright.  A
+    ``.txt`` sidecar holds the caption text only, so the title and tags set
+    through the API are kept as long as that text is still the item's.
+    """
+
+    if item is None:
+        return fields
+    if item.caption_dirty:
+        return {k: v for k, v in fields.items() if k not in CAPTION_FIELDS}
+    path = fields.get("caption_path", "")
+    if (
+        path.lower().endswith(".txt")
+        and path == item.caption_path
+        and fields.get("caption_text") == (item.caption_text or "").strip()
+    ):
+        return {
+            **fields,
+            "caption_title": item.caption_title,
+            "caption_tags": list(item.caption_tags or []),
+        }
+    return fields
+
+
+def item_caption(item, root_dir: str | Path) -> dict:
+    """``{title, caption, tags}`` of an item, from the database when ingested."""
+
+    if item.caption_mtime_ns or item.caption_dirty:
+        return {
+            "title": item.caption_title,
+            "caption": item.caption_text,
+            "tags": list(item.caption_tags or []),
+        }
+    # Row not ingested yet (created before captions moved to the database).
+    path = find_caption_file(root_dir, item.image_path, item.caption_path)
+    return read_caption_file(path) if path else {"title": "", "caption": "", "tags": []}
+
+
+def set_caption(item, title: str | None, caption: str | None, tags: list | None) -> None:
+    """Edit the caption of ``item`` in memory and mark it for write-back."""
+
+    if title is not None:
+        item.caption_title = title
+    if caption is not None:
+        item.caption_text = caption
+    if tags is not None:
+        item.caption_tags = list(tags)
+    if not item.caption_path:
+        base, _ = os.path.splitext(item.image_path)
+        item.caption_path = base + ".json"
+    item.has_caption = bool(item.caption_text)
+    item.caption_dirty = True
+
+
+def sidecar_text(path: str | Path, title: str, caption: str, tags: list) -> str:
+    """Contents of the sidecar at ``path``, by its suffix."""
+
+    if Path(path).suffix.lower() == ".txt":
+        return caption or ""
+    return json.dumps(
+        {"title": title or "", "caption": caption or "", "tags": tags or []},
+        ensure_ascii=False,
+    )
+
+
+def write_sidecar(abs_path: str | Path, title: str, caption: str, tags: list) -> int:
+    """Write a sidecar atomically and return its new mtime.
+
+    ``.txt`` sidecars hold the caption text only (what trainers read), the
+    title and tags stay in the database (:func:`keep_db_caption`);
+    anything else gets the JSON ``{title, caption, tags}``.
+    """
+
+    abs_path = Path(abs_path)
+    abs_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = abs_path.with_name(abs_path.name + ".tmp")
+    tmp.write_text(sidecar_text(abs_path, title, caption, tags), encoding="utf-8")
+    os.replace(tmp, abs_path)
+    return abs_path.stat().st_mtime_ns
+
+
+def _write_entry(args) -> tuple[int, int | None]:
+    item_id, abs_path, title, caption, tags = args
+    try:
+        return item_id, write_sidecar(abs_path, title, caption, tags)
+    except OSError:
+        logger.exception("cannot write caption sidecar %s", abs_path)
+        return item_id, None
+
+
+def flush_captions(dataset: Dataset, workers: int = 4) -> int:
+    """Write the sidecars of all dirty items of ``dataset``; return how many."""
+
+    root = Path(dataset.root_dir)
+    written = 0
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while True:
+            rows = list(
+                DatasetItem.objects.filter(dataset=dataset, caption_dirty=True, id__gt=last_id)
+                .values_list("id", "caption_path", "caption_title", "caption_text", "caption_tags")
+                .order_by("id")[:BATCH]
+            )
+            if not rows:
+                return written
+            last_id = rows[-1][0]
+            jobs = [(i, root / path, title, text, tags) for i, path, title, text, tags in rows]
+            results = dict(pool.map(_write_entry, jobs))
+
+            def write():
+                cleared = 0
+                for item_id, _, title, text, tags in rows:
+                    mtime = results[item_id]
+                    if mtime is None:
+                        continue
+                    # Only if nobody edited the caption again meanwhile; a
+                    # new edit schedules its own flush.
+                    cleared += DatasetItem.objects.filter(
+                        id=item_id,
+                        caption_dirty=True,
+                        caption_title=title,
+                        caption_text=text,
+                        caption_tags=tags,
+                    ).update(caption_dirty=False, caption_mtime_ns=mtime)
+                return cleared
+
+            written += run_write(write)
+
+
+_writeback_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fluxlab-captions")
+_scheduled: set[int] = set()
+_scheduled_lock = threading.Lock()
+
+
+def _writeback_job(dataset_id: int) -> None:
+    with _scheduled_lock:
+        _scheduled.discard(dataset_id)
+    try:
+        dataset = Dataset.objects.filter(id=dataset_id).first()
+        if dataset is not None:
+            flush_captions(dataset)
+    except Exception:  # noqa: BLE001 - background job, keep the thread alive
+        logger.exception("caption write-back failed for dataset %s", dataset_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_writeback(dataset_id: int) -> None:
+    """Flush dirty captions of the dataset in the background after commit.
+
+    Calls made while a flush for the dataset is still queued are coalesced.
+    """
+
+    def submit():
+        with _scheduled_lock:
+            if dataset_id in _scheduled:
+                return
+            _scheduled.add(dataset_id)
+        _writeback_pool.submit(_writeback_job, dataset_id)
+
+    transaction.on_commit(submit)
+
+
+def collect_sidecars(root_dir: str | Path) -> dict[str, int]:
+    """rel path -> mtime_ns of every sidecar under ``<root>/images``."""
+
+    root = str(root_dir)
+    result: dict[str, int] = {}
+    for dirpath, _, filenames in os.walk(os.path.join(root, "images")):
+        for name in filenames:
+            if is_sidecar_name(name):
+                full = os.path.join(dirpath, name)
+                try:
+                    mtime = os.stat(full).st_mtime_ns
+                except OSError:
+                    continue
+                result[os.path.relpath(full, root).replace("\\", "/")] = mtime
+    return result
+
+
+def _sibling_sidecar(image_path: str, sidecars: dict[str, int]) -> str:
+    base, _ = os.path.splitext(image_path)
+    for suffix in SIDECAR_SUFFIXES:
+        if base + suffix in sidecars:
+            return base + suffix
+    return ""
+
+
+def reconcile_captions(dataset: Dataset, sidecars: dict[str, int] | None = None) -> int:
+    """Re-read sidecars edited, created or deleted on disk; return items updated.
+
+    ``sidecars`` (from :func:`collect_sidecars`) can be passed when the
+    caller already walked the tree.
+    """
+
+    root = dataset.root_dir
+    if sidecars is None:
+        sidecars = collect_sidecars(root)
+    stale: list[int] = []
+    rows = (
+        DatasetItem.objects.filter(dataset=dataset, caption_dirty=False)
+        .values_list("id", "image_path", "caption_path", "caption_mtime_ns")
+        .iterator(chunk_size=2000)
+    )
+    for item_id, image_path, caption_path, mtime_ns in rows:
+        path = caption_path or _sibling_sidecar(image_path, sidecars)
+        current = sidecars.get(path, NO_SIDECAR) if path else NO_SIDECAR
+        # Sidecars outside images/ are not in the walk; keep them as they are.
+        if path and not path.startswith("images/") and mtime_ns:
+            continue
+        if current != mtime_ns:
+            stale.append(item_id)
+
+    updated = 0
+    for start in range(0, len(stale), BATCH):
+        items = list(
+            DatasetItem.objects.filter(id__in=stale[start : start + BATCH]).defer("mask_rle")
+        )
+        delta = StatsDelta()
+        for item in items:
+            delta.add(ItemStats.of(item), -1)
+            path = item.caption_path
+            if path and not (Path(root) / path).is_file():
+                path = ""
+            fields = keep_db_caption(item, caption_fields(root, item.image_path, path))
+            for name, value in fields.items():
+                setattr(item, name, value)
+            delta.add(ItemStats.of(item))
+
+        def write(items=items, delta=delta):
+            DatasetItem.objects.bulk_update(items, list(CAPTION_FIELDS))
+            retag_items(dataset.id, items)
+            apply_delta(dataset.id, delta)
+
+        run_write(write)
+        updated += len(items)
+    return updated
@@ -0,0 +1,112 @@
+"""Query-string filtering and ordering of dataset items.
+
+Shared by ``dataset_items_list`` and every endpoint that operates on "the
+items matching these filters", so the same parameters select the same rows
+everywhere.  Invalid parameters raise ``ValueError`` with a message suitable
+for a 400 response.
+"""
+
+from __future__ import annotations
+
+from django.db.models import QuerySet
+
+from .tags import filter_by_tags, parse_tag_list
+
+ALLOWED_SORT = {
+    "created_at",
+    "width",
+    "height",
+    "image_path",
+    "ext",
+    "aspect_ratio",
+    "megapixels",
+    "file_size",
+}
+
+# query param -> (lookup, parser)
+RANGE_FILTERS = {
+    "min_w": ("width__gte", int),
+    "max_w": ("width__lte", int),
+    "min_h": ("height__gte", int),
+    "max_h": ("height__lte", int),
+    "min_ar": ("aspect_ratio__gte", float),
+    "max_ar": ("aspect_ratio__lte", float),
+    "min_mp": ("megapixels__gte", float),
+    "max_mp": ("megapixels__lte", float),
+    "min_size": ("file_size__gte", int),
+    "max_size": ("file_size__lte", int),
+    # Only compact masks have a coverage, see ``masks.py``.
+    "min_mask_coverage": ("mask_coverage__gte", float),
+    "max_mask_coverage": ("mask_coverage__lte", float),
+}
+
+
+def parse_bool(params, name: str) -> bool | None:
+    value = params.get(name)
+    if not value:
+        return None
+    if value.lower() not in ("true", "false"):
+        raise ValueError(f"{name} must be true|false")
+    return value.lower() == "true"
+
+
+def normalize_ext(value: str) -> str:
+    return value.strip().lstrip(".").lower()
+
+
+def filter_items(qs: QuerySet, params) -> QuerySet:
+    q = params.get("q")
+    if q:
+        qs = qs.filter(image_path__icontains=q)
+
+    for name, (lookup, parse) in RANGE_FILTERS.items():
+        raw = params.get(name)
+        if raw is None:
+            continue
+        try:
+            value = parse(raw)
+        except ValueError:
+            kind = "int" if parse is int else "number"
+            raise ValueError(f"{name} must be {kind}")
+        qs = qs.filter(**{lookup: value})
+
+    has_caption = parse_bool(params, "has_caption")
+    if has_caption is not None:
+        qs = qs.filter(has_caption=has_caption)
+
+    hash_pending = parse_bool(params, "hash_pending")
+    if hash_pending is not None:
+        qs = qs.filter(sha256="") if hash_pending else qs.exclude(sha256="")
+
+    exts = params.get("ext")
+    if exts:
+        exts_set = {normalize_ext(e) for e in exts.split(",") if e.strip()}
+        if exts_set:
+            qs = qs.filter(ext__in=exts_set)
+
+    buckets = params.get("bucket")
+    if buckets:
+        qs = qs.filter(bucket__in=[b.strip() for b in buckets.split(",") if b.strip()])
+
+    qs = filter_by_tags(
+        qs,
+        parse_tag_list(params.get("tags")),
+        parse_tag_list(params.get("any_tags")),
+        parse_tag_list(params.get("not_tags")),
+    )
+
+    split = params.get("split")
+    if split:
+        qs = qs.filter(split="" if split == "none" else split)
+
+    return qs
+
+
+def order_items(qs: QuerySet, params) -> QuerySet:
+    order_by = params.get("order_by", "image_path")
+    order = params.get("order", "asc")
+    if order_by not in ALLOWED_SORT:
+        raise ValueError(f"order_by must be one of {sorted(ALLOWED_SORT)}")
+    prefix = "" if order == "asc" else "-"
+    # ``id`` keeps pages stable for low-cardinality keys such as ``ext``.
+    return qs.order_by(prefix + order_by, prefix + "id")
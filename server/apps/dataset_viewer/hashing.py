@@ -0,0 +1,212 @@
+"""Two-tier content fingerprints: a quick sampled hash now, sha256 later.
+
+Scans, syncs and uploads only compute :func:`quick_fingerprint` - the file
+size plus a BLAKE2 hash of three ``QUICK_BLOCK`` blocks (head, middle,
+tail), i.e. at most 192 KiB read per file whatever its size.  It is exact
+for files up to three blocks and is what change detection, rename
+matching and upload dedupe use.  Items whose ``sha256`` is still empty
+are "hash pending".
+
+:func:`fill_pending_hashes` computes the full ``sha256`` of pending items
+on a thread pool (``hashlib.file_digest`` releases the GIL while hashing
+large reads) and writes them back in batches, also into the sync
+snapshots; items registered before quick hashes existed get theirs in the
+same pass.  A file changed while it was hashed is left pending for the
+next pass.  In the server :func:`schedule` runs the pass on a background
+thread after each scan, sync and upload; ``fluxlab_scan``/``fluxlab_sync``
+run it before they exit.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+QUICK_BLOCK = 64 * 1024
+READ_BUFFER = 1024 * 1024
+BATCH = 200
+
+
+def quick_fingerprint(path: str | Path) -> str:
+    """``"<size>:<blake2b of head, middle and tail blocks>"``, ``""`` if unreadable."""
+
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            h = hashlib.blake2b(digest_size=16)
+            if size <= 3 * QUICK_BLOCK:
+                h.update(f.read())
+            else:
+                for offset in (0, (size - QUICK_BLOCK) // 2, size - QUICK_BLOCK):
+                    f.seek(offset)
+                    h.update(f.read(QUICK_BLOCK))
+    except OSError:
+        return ""
+    return f"{size}:{h.hexdigest()}"
+
+
+def full_sha256(path: str | Path) -> str:
+    try:
+        with open(path, "rb") as f:
+            if hasattr(hashlib, "file_digest"):  # Python 3.11+
+                return hashlib.file_digest(f, "sha256").hexdigest()
+            h = hashlib.sha256()
+            while chunk := f.read(READ_BUFFER):
+                h.update(chunk)
+            return h.hexdigest()
+    except OSError:
+        return ""
+
+
+def _stamp(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _hash_entry(args: tuple[str, bool]) -> tuple[str, str]:
+    """``(quick, sha256)`` of a file; ``sha256`` only when asked for.
+
+    Both are ``""`` when the file is unreadable or changed while it was read.
+    """
+
+    path, full = args
+    before = _stamp(path)
+    if before is None:
+        return "", ""
+    quick = quick_fingerprint(path)
+    digest = full_sha256(path) if full else ""
+    if _stamp(path) != before:
+        return "", ""
+    return quick, digest
+
+
+def keep_full_hash(item, fields: dict) -> dict:
+    """Keep the known ``sha256`` of ``item`` when a re-probe saw the same quick hash."""
+
+    if item is not None and item.sha256 and item.quick_hash == fields.get("quick_hash"):
+        return {**fields, "sha256": item.sha256}
+    return fields
+
+
+def _write_hashes(dataset_id: int, rows: list[tuple[int, str, str, str, str]]) -> None:
+    from .models import DatasetItem, FileSnapshot
+    from .stats import bump_version
+
+    for item_id, path, seen, quick, digest in rows:
+        fields = {"quick_hash": quick}
+        if digest:
+            fields["sha256"] = digest
+        # Skipped when a sync or rescan replaced the file meanwhile.
+        if DatasetItem.objects.filter(id=item_id, quick_hash=seen).update(**fields):
+            FileSnapshot.objects.filter(dataset_id=dataset_id, path=path).update(**fields)
+    bump_version(dataset_id)
+
+
+def pending_items(dataset):
+    """Items still missing their full (or, for old rows, quick) hash."""
+
+    from django.db.models import Q
+
+    from .models import DatasetItem
+
+    return DatasetItem.objects.filter(dataset=dataset).filter(Q(sha256="") | Q(quick_hash=""))
+
+
+def fill_pending_hashes(dataset, workers: int | None = None, progress=None) -> dict:
+    """Compute the missing hashes of ``dataset``; returns counts.
+
+    Items from before quick hashes existed only get their quick hash.
+    """
+
+    from .writequeue import run_write
+
+    workers = workers or settings.HASH_WORKERS
+    pending = list(
+        pending_items(dataset)
+        .order_by("id")
+        .values_list("id", "image_path", "quick_hash", "sha256", "file_size")
+    )
+    counts = {"hashed": 0, "failed": 0}
+    with ThreadPoolExecutor(workers, thread_name_prefix="fluxlab-hash") as pool:
+        for start in range(0, len(pending), BATCH):
+            chunk = pending[start : start + BATCH]
+            jobs = [
+                (os.path.join(dataset.root_dir, path), not sha) for _id, path, _q, sha, _s in chunk
+            ]
+            rows = []
+            for (item_id, path, seen, sha, size), (quick, digest) in zip(
+                chunk, pool.map(_hash_entry, jobs)
+            ):
+                # A quick hash (or size) differing from the stored one means the
+                # file changed since it was probed; the next sync re-probes it.
+                expected = seen or f"{size}:"
+                if not quick or not quick.startswith(expected) or (not sha and not digest):
+                    counts["failed"] += 1
+                    continue
+                rows.append((item_id, path, seen, quick, digest))
+            if rows:
+                run_write(_write_hashes, dataset.id, rows)
+            counts["hashed"] += len(rows)
+            if progress:
+                progress(start + len(chunk), len(pending))
+    return counts
+
+
+class _Scheduler:
+    """One daemon thread working through the datasets queued by :func:`schedule`."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.queued: list[int] = []
+        self.thread: threading.Thread | None = None
+
+    def add(self, dataset_id: int) -> None:
+        with self.cond:
+            if dataset_id not in self.queued:
+                self.queued.append(dataset_id)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="fluxlab-hash-scheduler", daemon=True
+                )
+                self.thread.start()
+            self.cond.notify()
+
+    def _run(self) -> None:
+        from .models import Dataset
+
+        while True:
+            with self.cond:
+                while not self.queued:
+                    self.cond.wait()
+                dataset_id = self.queued.pop(0)
+            close_old_connections()
+            try:
+                dataset = Dataset.objects.filter(id=dataset_id).first()
+                if dataset is not None:
+                    fill_pending_hashes(dataset)
+            except Exception:
+                logger.exception("background hashing of dataset %s failed", dataset_id)
+            finally:
+                close_old_connections()
+
+
+_scheduler = _Scheduler()
+
+
+def schedule(dataset_id: int) -> None:
+    """Fill the pending hashes of a dataset in the background (no-op when disabled)."""
+
+    if settings.BACKGROUND_HASHING:
+        _scheduler.add(dataset_id)
@@ -0,0 +1,198 @@
+"""Image dimensions read from the file header, without PIL.
+
+:func:`read_header` looks at the first bytes of a JPEG (SOF marker, plus
+the EXIF orientation in APP1), PNG (IHDR) or WebP (VP8/VP8L/VP8X chunk,
+plus the EXIF chunk) and returns size, mode and orientation.  Only the
+segment headers are read, typically a few hundred bytes, which matters
+on network storage and keeps per-file cost far below ``Image.open``.
+
+Sizes are the stored ones, as ``Image.open(...).size`` reports them; use
+:attr:`ImageHeader.display_size` for the size after EXIF rotation.  Files
+the parser does not understand give ``None`` and callers fall back to PIL
+(see ``utils.open_image_size``).
+"""
+
+from __future__ import annotations
+
+import io
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+
+HEAD_BYTES = 64
+MAX_EXIF = 64 * 1024
+ORIENTATION_TAG = 0x0112
+# SOF markers carrying the frame size; C4 (DHT), C8 (JPG) and CC (DAC) are not frames.
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+# PNG (color type, bit depth) -> PIL mode.
+PNG_MODES = {
+    (0, 1): "1",
+    (0, 2): "L",
+    (0, 4): "L",
+    (0, 8): "L",
+    (0, 16): "I;16",
+    (2, 8): "RGB",
+    (2, 16): "RGB",
+    (3, 1): "P",
+    (3, 2): "P",
+    (3, 4): "P",
+    (3, 8): "P",
+    (4, 8): "LA",
+    (4, 16): "LA",
+    (6, 8): "RGBA",
+    (6, 16): "RGBA",
+}
+
+
+@dataclass(frozen=True)
+class ImageHeader:
+    format: str
+    width: int
+    height: int
+    mode: str
+    orientation: int = 1
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def display_size(self) -> tuple[int, int]:
+        """Size once the EXIF orientation is applied (5-8 swap the axes)."""
+
+        if self.orientation in (5, 6, 7, 8):
+            return self.height, self.width
+        return self.width, self.height
+
+
+def read_header(source: str | Path | bytes) -> ImageHeader | None:
+    """Parse the header of a JPEG/PNG/WebP file (or its bytes); ``None`` if unknown."""
+
+    try:
+        if isinstance(source, bytes):
+            return _parse(io.BytesIO(source))
+        with open(source, "rb") as f:
+            return _parse(f)
+    except (OSError, struct.error, ValueError):
+        return None
+
+
+def _parse(f) -> ImageHeader | None:
+    head = f.read(HEAD_BYTES)
+    if head[:2] == b"\xff\xd8":
+        return _jpeg(f)
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return _png(head)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return _webp(f, head)
+    return None
+
+
+def _exif_orientation(data: bytes) -> int:
+    """Orientation tag of a TIFF-structured EXIF block; 1 when absent."""
+
+    if data[:6] == b"Exif\x00\x00":
+        data = data[6:]
+    if data[:2] == b"II":
+        order = "<"
+    elif data[:2] == b"MM":
+        order = ">"
+    else:
+        return 1
+    (ifd,) = struct.unpack_from(order + "I", data, 4)
+    (count,) = struct.unpack_from(order + "H", data, ifd)
+    for i in range(count):
+        tag, kind = struct.unpack_from(order + "HH", data, ifd + 2 + 12 * i)
+        if tag == ORIENTATION_TAG and kind == 3:
+            (value,) = struct.unpack_from(order + "H", data, ifd + 2 + 12 * i + 8)
+            return value if 1 <= value <= 8 else 1
+    return 1
+
+
+def _jpeg(f) -> ImageHeader | None:
+    f.seek(2)
+    orientation = 1
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        marker = f.read(1)
+        while marker == b"\xff":  # fill bytes
+            marker = f.read(1)
+        if not marker:
+            return None
+        code = marker[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD8:  # TEM, RSTn, SOI: no length
+            continue
+        if code in (0xD9, 0xDA):  # EOI or SOS before any frame header
+            return None
+        (length,) = struct.unpack(">H", f.read(2))
+        if length < 2:
+            return None
+        if code in SOF_MARKERS:
+            _precision, height, width, components = struct.unpack(">BHHB", f.read(6))
+            if not width or not height:  # height deferred to a DNL marker
+                return None
+            mode = JPEG_MODES.get(components)
+            if mode is None:
+                return None
+            return ImageHeader("JPEG", width, height, mode, orientation)
+        if code == 0xE1 and length - 2 <= MAX_EXIF:
+            data = f.read(length - 2)
+            if data[:6] == b"Exif\x00\x00":
+                orientation = _exif_orientation(data)
+            continue
+        f.seek(length - 2, io.SEEK_CUR)
+
+
+def _png(head: bytes) -> ImageHeader | None:
+    if head[12:16] != b"IHDR":
+        return None
+    width, height, depth, color_type = struct.unpack_from(">IIBB", head, 16)
+    mode = PNG_MODES.get((color_type, depth))
+    if mode is None or not width or not height:
+        return None
+    # eXIf chunks are rare and PIL does not rotate PNGs by them either.
+    return ImageHeader("PNG", width, height, mode)
+
+
+def _webp_exif(f) -> int:
+    """Walk the RIFF chunks after VP8X for an EXIF chunk."""
+
+    f.seek(12)
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return 1
+        fourcc, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+        if fourcc == b"EXIF":
+            return _exif_orientation(f.read(min(size, MAX_EXIF)))
+        f.seek(size + (size & 1), io.SEEK_CUR)
+
+
+def _webp(f, head: bytes) -> ImageHeader | None:
+    fourcc = head[12:16]
+    if fourcc == b"VP8 ":
+        if head[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack_from("<HH", head, 26)
+        return ImageHeader("WEBP", width & 0x3FFF, height & 0x3FFF, "RGB")
+    if fourcc == b"VP8L":
+        if head[20] != 0x2F:
+            return None
+        (bits,) = struct.unpack_from("<I", head, 21)
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+        mode = "RGBA" if (bits >> 28) & 1 else "RGB"
+        return ImageHeader("WEBP", width, height, mode)
+    if fourcc == b"VP8X":
+        flags = head[20]
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        mode = "RGBA" if flags & 0x10 else "RGB"
+        orientation = _webp_exif(f) if flags & 0x08 else 1
+        return ImageHeader("WEBP", width, height, mode, orientation)
+    return None
@@ -0,0 +1,206 @@
+"""One process pool for the image work of the server process.
+
+Thumbnail renders, mask previews, mask validation, upload probing and the
+probing done by API-triggered scans and syncs are all submitted here
+instead of running in request threads, so decoding scales across cores and
+does not compete for the GIL with request handling.
+
+Tasks wait in a priority queue and are handed to the
+``IMAGE_POOL_WORKERS`` processes one at a time, so a queued thumbnail
+(``INTERACTIVE``) always starts before queued upload (``UPLOAD``) or scan
+(``BACKGROUND``) work.  At most ``IMAGE_POOL_MAX_PENDING`` tasks wait:
+interactive submissions then fail with :class:`PoolBusy` (the views answer
+503), the others block until there is room.  Cancelling a returned future
+drops the task if it has not started yet; the async views do that when the
+client disconnects.
+
+With ``IMAGE_POOL_WORKERS = 0`` tasks run inline in the calling thread;
+tests that need that override the setting, which replaces the pool.
+Submitted functions must be module-level and take picklable arguments.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+INTERACTIVE = 0
+UPLOAD = 1
+BACKGROUND = 2
+# ``parallel_map(SHARED)`` maps on this pool at BACKGROUND priority.
+SHARED = 0
+
+
+def worker_context():
+    # Not fork: the server process has threads (and maybe an event loop) running.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def init_worker() -> None:
+    import django
+
+    django.setup()
+
+
+class PoolBusy(Exception):
+    """The queue already holds ``IMAGE_POOL_MAX_PENDING`` tasks."""
+
+
+class ImagePool:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.cond = threading.Condition()
+        self.queue: list = []  # (priority, seq, future, fn, args)
+        self.seq = itertools.count()
+        self.running = 0
+        self.executor = None
+
+    @property
+    def inline(self) -> bool:
+        return self.workers <= 0
+
+    def submit(self, fn, *args, priority: int = INTERACTIVE, block: bool | None = None) -> Future:
+        """Queue ``fn(*args)``; blocks when full unless ``block`` is false.
+
+        ``block`` defaults to false for ``INTERACTIVE`` and true otherwise.
+        """
+
+        future = Future()
+        if self.inline:
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+            return future
+
+        if block is None:
+            block = priority != INTERACTIVE
+        with self.cond:
+            while len(self.queue) >= self.max_pending:
+                self._drop_cancelled()
+                if len(self.queue) < self.max_pending:
+                    break
+                if not block:
+                    raise PoolBusy
+                self.cond.wait()
+            heapq.heappush(self.queue, (priority, next(self.seq), future, fn, args))
+            self._dispatch()
+        return future
+
+    def run(self, fn, *args, priority: int = INTERACTIVE):
+        return self.submit(fn, *args, priority=priority).result()
+
+    def map(self, fn, items, priority: int = BACKGROUND):
+        """Order-preserving ``map`` keeping about two tasks per worker queued."""
+
+        window = max(2, 2 * self.workers)
+        pending: deque[Future] = deque()
+        try:
+            for item in items:
+                pending.append(self.submit(fn, item, priority=priority, block=True))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _drop_cancelled(self) -> None:
+        kept = [entry for entry in self.queue if not entry[2].cancelled()]
+        if len(kept) != len(self.queue):
+            heapq.heapify(kept)
+            self.queue = kept
+
+    def _dispatch(self) -> None:
+        # Called with ``cond`` held.
+        while self.running < self.workers and self.queue:
+            _priority, _seq, future, fn, args = heapq.heappop(self.queue)
+            if not future.set_running_or_notify_cancel():
+                continue
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=worker_context(), initializer=init_worker
+                )
+            self.running += 1
+            try:
+                inner = self.executor.submit(fn, *args)
+            except BrokenProcessPool as exc:
+                self.executor = None
+                self.running -= 1
+                future.set_exception(exc)
+                continue
+            inner.add_done_callback(lambda done, outer=future: self._done(outer, done))
+        self.cond.notify_all()
+
+    def _done(self, outer: Future, inner: Future) -> None:
+        exc = inner.exception()
+        if exc is None:
+            outer.set_result(inner.result())
+        else:
+            outer.set_exception(exc)
+        with self.cond:
+            self.running -= 1
+            if isinstance(exc, BrokenProcessPool):
+                # A worker died (e.g. OOM on a huge image); start a fresh pool.
+                self.executor = None
+            self._dispatch()
+
+    def shutdown(self) -> None:
+        with self.cond:
+            for entry in self.queue:
+                entry[2].cancel()
+            self.queue = []
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+_pool: ImagePool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ImagePool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ImagePool(settings.IMAGE_POOL_WORKERS, settings.IMAGE_POOL_MAX_PENDING)
+        return _pool
+
+
+def _reset_pool(setting, **kwargs) -> None:
+    global _pool
+    if setting not in ("IMAGE_POOL_WORKERS", "IMAGE_POOL_MAX_PENDING"):
+        return
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+setting_changed.connect(_reset_pool)
+
+
+def submit(fn, *args, priority: int = INTERACTIVE, block: bool | None = None) -> Future:
+    return get_pool().submit(fn, *args, priority=priority, block=block)
+
+
+def run(fn, *args, priority: int = INTERACTIVE):
+    """Run ``fn(*args)`` on the pool and wait for the result."""
+
+    return get_pool().run(fn, *args, priority=priority)
+
+
+def map(fn, items, priority: int = BACKGROUND):
+    return get_pool().map(fn, items, priority=priority)
@@ -0,0 +1,165 @@
+"""Per-file probing and the dataset scan shared by the API and commands.
+
+The probing helpers are module-level and work on plain paths so they can
+run inside worker processes.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+from .bucketing import assign_dataset_buckets
+from .captions import caption_fields, keep_db_caption
+from .hashing import keep_full_hash, quick_fingerprint
+from .masks import keep_compact_mask
+from .models import DatasetItem
+from .similarity import bump_features, image_features
+from .stats import ItemStats, StatsDelta, apply_delta
+from .tags import retag_items
+from .utils import (
+    default_mask_relpath,
+    derived_image_fields,
+    iter_images,
+    open_image_size,
+    parallel_map,
+)
+from .writequeue import run_write
+
+IMAGE_EXTS = {"jpg", "jpeg", "png", "webp"}
+SCAN_BATCH = 500
+
+
+def is_image_name(name: str) -> bool:
+    return os.path.splitext(name)[1].lower().lstrip(".") in IMAGE_EXTS
+
+
+def probe_image(root_dir: str, rel_path: str, quick: str | None = None) -> dict | None:
+    """Return the ``DatasetItem`` field values for a file, or ``None``.
+
+    ``None`` means the file is not a readable image.  ``quick`` can be passed
+    when the caller already fingerprinted the file.  ``sha256`` is left
+    empty for ``hashing.fill_pending_hashes``.
+    """
+
+    abs_path = os.path.join(root_dir, rel_path)
+    size = open_image_size(abs_path)
+    if not size:
+        return None
+    width, height = size
+    mask_rel = default_mask_relpath(SimpleNamespace(image_path=rel_path))
+    has_mask = (Path(root_dir) / mask_rel).is_file()
+    try:
+        file_size = os.path.getsize(abs_path)
+    except OSError:
+        return None
+    return {
+        "width": width,
+        "height": height,
+        "file_size": file_size,
+        "quick_hash": quick or quick_fingerprint(abs_path),
+        "sha256": "",
+        "mask_path": mask_rel if has_mask else None,
+        "features": image_features(abs_path),
+        **caption_fields(root_dir, rel_path),
+        **derived_image_fields(rel_path, width, height),
+    }
+
+
+def probe_entry(args: tuple[str, str]) -> dict | None:
+    """``probe_image`` taking one tuple, for ``parallel_map``."""
+
+    return probe_image(*args)
+
+
+def _write_scan_batch(dataset_id, new_items, changed, changed_fields, delta) -> None:
+    DatasetItem.objects.bulk_create(new_items, batch_size=SCAN_BATCH)
+    if changed:
+        DatasetItem.objects.bulk_update(changed, sorted(changed_fields))
+    for obj in new_items:
+        delta.add(ItemStats.of(obj))
+    retag_items(dataset_id, [*new_items, *changed])
+    if new_items or "features" in changed_fields:
+        bump_features(dataset_id)
+    apply_delta(dataset_id, delta)
+
+
+def scan_dataset(dataset, workers: int = 1, resume: bool = False, progress=None) -> dict:
+    """Register or refresh every image under ``<root>/images``.
+
+    Files are probed in a process pool and written in batches, each
+    committed on its own.  With ``resume`` files that already have an item
+    of the same size (and a feature vector) are not probed again, so an
+    interrupted scan continues where it stopped.
+    """
+
+    root = dataset.root_dir
+    paths = [os.path.relpath(p, root).replace("\\", "/") for p in iter_images(root)]
+    counts = {"created": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+    with parallel_map(workers) as pmap:
+        for start in range(0, len(paths), SCAN_BATCH):
+            chunk = paths[start : start + SCAN_BATCH]
+            existing = {
+                obj.image_path: obj
+                for obj in DatasetItem.objects.filter(dataset=dataset, image_path__in=chunk)
+            }
+            if resume:
+                todo = []
+                for rel in chunk:
+                    obj = existing.get(rel)
+                    try:
+                        same = (
+                            obj is not None
+                            and bool(obj.features)
+                            and obj.file_size == os.path.getsize(os.path.join(root, rel))
+                        )
+                    except OSError:
+                        same = False
+                    if same:
+                        counts["unchanged"] += 1
+                    else:
+                        todo.append(rel)
+            else:
+                todo = chunk
+
+            delta = StatsDelta()
+            new_items: list = []
+            changed: list = []
+            changed_fields: set[str] = set()
+            for rel, fields in zip(todo, pmap(probe_entry, [(root, rel) for rel in todo])):
+                if not fields:
+                    counts["skipped"] += 1
+                    continue
+                obj = existing.get(rel)
+                if obj is None:
+                    new_items.append(DatasetItem(dataset=dataset, image_path=rel, **fields))
+                    continue
+                before = ItemStats.of(obj)
+                fields = keep_full_hash(obj, keep_db_caption(obj, fields))
+                fields = keep_compact_mask(obj, fields)
+                updated = [n for n, v in fields.items() if getattr(obj, n) != v]
+                if not updated:
+                    counts["unchanged"] += 1
+                    continue
+                for name in updated:
+                    setattr(obj, name, fields[name])
+                if {"width", "height"} & set(updated):
+                    obj.bucket = ""
+                    updated.append("bucket")
+                changed.append(obj)
+                changed_fields.update(updated)
+                delta.add(before, -1)
+                delta.add(ItemStats.of(obj))
+
+            if new_items or changed:
+                run_write(
+                    _write_scan_batch, dataset.id, new_items, changed, changed_fields, delta
+                )
+            counts["created"] += len(new_items)
+            counts["updated"] += len(changed)
+            if progress:
+                progress(start + len(chunk), len(paths))
+
+    assign_dataset_buckets(dataset)
+    return counts
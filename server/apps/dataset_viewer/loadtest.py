@@ -0,0 +1,319 @@
+"""HTTP load generator replaying how the dataset grid is browsed.
+
+Each virtual user loops over what ``view.js`` does for one page view:
+
+* ``GET /api/datasets/<id>/`` and ``GET .../items?page=N`` for a random page;
+* every ``thumb_url`` of the page;
+* with probability ``modal`` the batch detail fetch of the page and the
+  full image of one item, with probability ``mask`` the mask preview of
+  each masked item on the page.
+
+Optionally an uploader thread posts a generated image every
+``upload_every`` seconds.  Users hold one keep-alive connection each (a
+browser opens about six per host); ``keepalive=False`` connects per
+request instead, which servers that write headers and body separately
+(``runserver``) need to avoid ~40 ms delayed-ACK stalls.  Only the standard library is used on
+the client side, so any server - ``runserver``, gunicorn, uwsgi - can be
+measured from the same machine.
+
+:func:`ramp` runs stages of increasing user counts and :func:`saturation`
+picks the stage after which adding users no longer adds throughput.
+"""
+
+from __future__ import annotations
+
+import http.client
+import io
+import json
+import math
+import random
+import statistics
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from urllib.parse import urlencode, urlsplit
+
+PAGE_SIZE = 50
+# A stage is saturated when it adds less than this share of throughput...
+MIN_GAIN = 0.1
+# ...or fails more than this share of requests.
+MAX_ERROR_RATE = 0.01
+
+
+@dataclass
+class Options:
+    base_url: str
+    dataset_id: int
+    modal: float = 0.2
+    mask: float = 0.1
+    think: float = 0.0
+    upload_every: float = 0.0
+    timeout: float = 30.0
+    keepalive: bool = True
+    seed: int | None = None
+
+
+@dataclass
+class StageResult:
+    users: int
+    duration: float = 0.0
+    latencies: dict[str, list[float]] = field(default_factory=dict)
+    errors: dict[str, int] = field(default_factory=dict)
+    bytes: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, endpoint: str, seconds: float, ok: bool, size: int) -> None:
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            self.bytes += size
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    @property
+    def requests(self) -> int:
+        return sum(len(v) for v in self.latencies.values())
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.duration if self.duration else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.errors.values()) / self.requests if self.requests else 0.0
+
+    def summary(self) -> dict:
+        endpoints = {}
+        every = []
+        for name, samples in sorted(self.latencies.items()):
+            every += samples
+            endpoints[name] = {
+                "requests": len(samples),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(samples) / self.duration, 2) if self.duration else 0.0,
+                **percentiles(samples),
+            }
+        return {
+            "users": self.users,
+            "duration": round(self.duration, 3),
+            "requests": self.requests,
+            "throughput": round(self.throughput, 2),
+            "error_rate": round(self.error_rate, 4),
+            "bytes_per_second": round(self.bytes / self.duration) if self.duration else 0,
+            "latency": percentiles(every),
+            "endpoints": endpoints,
+        }
+
+
+def percentiles(samples: list[float]) -> dict:
+    """p50/p95/p99/max/mean in milliseconds (nearest rank)."""
+
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    ordered = sorted(samples)
+
+    def rank(q):
+        return round(ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)] * 1000, 2)
+
+    return {
+        "p50": rank(0.50),
+        "p95": rank(0.95),
+        "p99": rank(0.99),
+        "max": round(ordered[-1] * 1000, 2),
+        "mean": round(statistics.fmean(ordered) * 1000, 2),
+    }
+
+
+class Client:
+    """One keep-alive HTTP connection recording every request into a stage."""
+
+    def __init__(self, options: Options, stage: StageResult):
+        url = urlsplit(options.base_url)
+        self.host = url.hostname or "127.0.0.1"
+        self.port = url.port
+        self.https = url.scheme == "https"
+        self.prefix = url.path.rstrip("/")
+        self.timeout = options.timeout
+        self.keepalive = options.keepalive
+        self.stage = stage
+        self.conn = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, endpoint: str, method: str, path: str, body=None, headers=None):
+        """Return ``(status, body)``; ``(0, b"")`` on a connection error."""
+
+        started = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = self._connect()
+            self.conn.request(method, self.prefix + path, body=body, headers=headers or {})
+            resp = self.conn.getresponse()
+            data = resp.read()
+            status = resp.status
+            if not self.keepalive or resp.getheader("Connection", "").lower() == "close":
+                self.close()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            status, data = 0, b""
+        self.stage.record(endpoint, time.perf_counter() - started, 200 <= status < 400, len(data))
+        return status, data
+
+    def get_json(self, endpoint: str, path: str):
+        status, data = self.request(endpoint, "GET", path)
+        if status != 200:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def browse(client: Client, options: Options, rng: random.Random) -> None:
+    """One page view of the grid."""
+
+    base = f"/api/datasets/{options.dataset_id}"
+    meta = client.get_json("dataset", f"{base}/")
+    count = (meta or {}).get("items_count") or 0
+    pages = max(1, math.ceil(count / PAGE_SIZE))
+    page = client.get_json("items", f"{base}/items?" + urlencode({"page": rng.randint(1, pages)}))
+    items = (page or {}).get("results") or []
+
+    for item in items:
+        if item.get("thumb_url"):
+            client.request("thumb", "GET", item["thumb_url"])
+
+    if items and rng.random() < options.modal:
+        ids = ",".join(str(item["id"]) for item in items)
+        client.request("batch", "GET", f"{base}/items/batch?ids={ids}")
+        item = rng.choice(items)
+        if item.get("image_url"):
+            client.request("image", "GET", item["image_url"])
+    if rng.random() < options.mask:
+        for item in items:
+            if item.get("has_mask"):
+                client.request(
+                    "mask_preview", "GET", f"/api/dataset-items/{item['id']}/mask/preview?size=128"
+                )
+
+
+def _multipart(filename: str, payload: bytes) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    body.write(f"--{boundary}\r\n".encode())
+    body.write(b'Content-Disposition: form-data; name="subdir"\r\n\r\nloadtest_uploads\r\n')
+    body.write(f"--{boundary}\r\n".encode())
+    body.write(
+        f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n".encode()
+    )
+    body.write(payload)
+    body.write(f"\r\n--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+def upload(client: Client, options: Options, rng: random.Random) -> None:
+    from .synthetic import synthetic_image
+
+    buf = io.BytesIO()
+    synthetic_image(rng.getrandbits(32), 256, 256).save(buf, "JPEG", quality=85)
+    body, content_type = _multipart(f"load_{uuid.uuid4().hex[:12]}.jpg", buf.getvalue())
+    client.request(
+        "upload",
+        "POST",
+        f"/api/datasets/{options.dataset_id}/upload",
+        body=body,
+        headers={"Content-Type": content_type},
+    )
+
+
+def run_stage(options: Options, users: int, duration: float) -> StageResult:
+    """Run ``users`` browsing threads (plus the uploader) for ``duration`` seconds."""
+
+    stage = StageResult(users=users)
+    stop = threading.Event()
+    seed = options.seed if options.seed is not None else random.randrange(2**32)
+
+    def user(index: int):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(options, stage)
+        try:
+            while not stop.is_set():
+                browse(client, options, rng)
+                if options.think:
+                    stop.wait(rng.expovariate(1 / options.think))
+        finally:
+            client.close()
+
+    def uploader():
+        rng = random.Random(seed - 1)
+        client = Client(options, stage)
+        try:
+            while not stop.wait(options.upload_every):
+                upload(client, options, rng)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)]
+    if options.upload_every > 0:
+        threads.append(threading.Thread(target=uploader, daemon=True))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # Requests in flight at the deadline are counted, so is their time.
+    stage.duration = time.perf_counter() - started
+    return stage
+
+
+def saturation(stages: list[dict]) -> dict | None:
+    """Last stage before throughput stops growing or errors appear."""
+
+    best = None
+    for stage in stages:
+        if stage["error_rate"] > MAX_ERROR_RATE:
+            break
+        if best is not None and stage["throughput"] < best["throughput"] * (1 + MIN_GAIN):
+            break
+        best = stage
+    if best is None:
+        return None
+    return {
+        "users": best["users"],
+        "throughput": best["throughput"],
+        "p95": best["latency"]["p95"],
+        "reached": best is not stages[-1],
+    }
+
+
+def ramp(options: Options, users: list[int], duration: float, log=None) -> dict:
+    """Run one stage per entry of ``users``; returns the report."""
+
+    stages = []
+    for count in users:
+        summary = run_stage(options, count, duration).summary()
+        stages.append(summary)
+        if log:
+            latency = summary["latency"]
+            log(
+                f"users={count}: {summary['throughput']} req/s, p50={latency['p50']} ms "
+                f"p95={latency['p95']} ms p99={latency['p99']} ms, "
+                f"errors={summary['error_rate']:.2%}"
+            )
+    return {
+        "target": options.base_url,
+        "dataset": options.dataset_id,
+        "stage_seconds": duration,
+        "stages": stages,
+        "saturation": saturation(stages),
+    }
@@ -0,0 +1,110 @@
+"""Helpers shared by the fluxlab_* management commands."""
+
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dataset_viewer.hashing import fill_pending_hashes
+from dataset_viewer.models import Dataset
+from dataset_viewer.profiling import parse_collectors, profiled
+
+
+def resolve_datasets(refs):
+    """Datasets by id or name; all datasets when ``refs`` is empty."""
+
+    if not refs:
+        return list(Dataset.objects.order_by("id"))
+    datasets = []
+    for ref in refs:
+        qs = (
+            Dataset.objects.filter(id=int(ref))
+            if ref.isdigit()
+            else Dataset.objects.filter(name=ref)
+        )
+        dataset = qs.first()
+        if dataset is None:
+            raise CommandError(f"dataset not found: {ref}")
+        datasets.append(dataset)
+    return datasets
+
+
+def add_hash_argument(parser):
+    parser.add_argument(
+        "--no-hash",
+        action="store_true",
+        help="leave the full sha256 of new files pending instead of computing it at the end",
+    )
+
+
+def fill_hashes(command, dataset, options: dict) -> None:
+    """Compute the pending full hashes of ``dataset`` unless ``--no-hash``."""
+
+    if options.get("no_hash"):
+        return
+    result = fill_pending_hashes(
+        dataset, progress=Progress(command.stdout, f"{dataset.name} sha256", options)
+    )
+    if result["hashed"] or result["failed"] or options.get("verbosity", 1) > 1:
+        command.stdout.write(
+            f"{dataset.name}: hashed={result['hashed']}, failed={result['failed']}"
+        )
+
+
+def add_common_arguments(parser):
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="worker processes (default: all cores)",
+    )
+    parser.add_argument("--no-progress", action="store_true", help="only print the summary")
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="cprofile,memory",
+        help="profile this process (cprofile,sample,memory); see /api/profiles",
+    )
+
+
+class JobCommand(BaseCommand):
+    """Base of the long-running commands: ``--profile`` captures the whole run."""
+
+    def execute(self, *args, **options):
+        if not options.get("profile"):
+            return super().execute(*args, **options)
+        meta = {
+            "kind": "job",
+            "command": self.__module__.rsplit(".", 1)[-1],
+            "args": [str(a) for a in args],
+            "options": {
+                k: v
+                for k, v in options.items()
+                if isinstance(v, (str, int, float, bool, list)) and k not in ("stdout", "stderr")
+            },
+        }
+        with profiled(parse_collectors(options["profile"]), meta):
+            result = super().execute(*args, **options)
+        self.stderr.write(f"profile saved: {meta['id']}")
+        return result
+
+
+class Progress:
+    """``progress(done, total)`` callback printing at most once a second."""
+
+    def __init__(self, stream, label: str, options: dict):
+        self.stream = stream
+        self.label = label
+        self.enabled = not options.get("no_progress") and options.get("verbosity", 1) > 0
+        self.started = time.monotonic()
+        self.last = 0.0
+
+    def __call__(self, done: int, total: int) -> None:
+        now = time.monotonic()
+        if not self.enabled or (now - self.last < 1.0 and done < total):
+            return
+        self.last = now
+        rate = done / max(now - self.started, 1e-6)
+        pct = 100.0 * done / total if total else 100.0
+        self.stream.write(f"{self.label}: {done}/{total} ({pct:.0f}%, {rate:.0f}/s)")
+        self.stream.flush()
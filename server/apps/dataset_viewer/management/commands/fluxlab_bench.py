@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from dataset_viewer.benchmarks import compare, environment, run_suite
+from dataset_viewer.synthetic import generate_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Time scan, item listing, thumbnails, export/import, upload and enhance preview "
+        "over a synthetic dataset and write the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--root", help="existing dataset root (default: generate one)")
+        parser.add_argument("--items", type=int, default=1000, help="items to generate")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--scale", type=float, default=0.5, help="generated image size factor")
+        parser.add_argument("--repeat", type=int, default=5, help="runs per case")
+        parser.add_argument("--out", default="-", help="result file (default: stdout)")
+        parser.add_argument("--baseline", help="earlier result file to compare against")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=1.25,
+            help="fail when a median is this many times the baseline median",
+        )
+        parser.add_argument(
+            "--in-place",
+            action="store_true",
+            help="use the configured database instead of a throw-away one",
+        )
+
+    def log(self, message):
+        self.stderr.write(message)
+
+    def handle(self, *args, **opts):
+        baseline = None
+        if opts["baseline"]:
+            try:
+                baseline = json.loads(Path(opts["baseline"]).read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                raise CommandError(f"cannot read {opts['baseline']}: {e}")
+
+        tmp = tempfile.mkdtemp(prefix="fluxlab-bench-")
+        try:
+            root = opts["root"]
+            if not root:
+                root = os.path.join(tmp, "dataset")
+                self.log(f"generating {opts['items']} items in {root}")
+                generate_dataset(root, opts["items"], seed=opts["seed"], scale=opts["scale"])
+            started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            with override_settings(THUMBNAILS_ROOT=Path(tmp, "thumbnails")):
+                if opts["in_place"]:
+                    results = run_suite(root, repeat=opts["repeat"], log=self.log)
+                else:
+                    results = self.run_isolated(root, tmp, opts)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        report = {
+            "meta": {
+                "started": started,
+                "root": None if not opts["root"] else root,
+                "items": results["dataset_scan"]["items"],
+                "seed": opts["seed"],
+                "scale": opts["scale"],
+                "repeat": opts["repeat"],
+                **environment(),
+            },
+            "results": results,
+        }
+        if baseline is not None:
+            report["regressions"] = compare(results, baseline["results"], opts["threshold"])
+
+        text = json.dumps(report, indent=2)
+        if opts["out"] == "-":
+            self.stdout.write(text)
+        else:
+            Path(opts["out"]).write_text(text, encoding="utf-8")
+            self.log(f"results written to {opts['out']}")
+        if report.get("regressions"):
+            names = ", ".join(f"{r['case']} x{r['ratio']}" for r in report["regressions"])
+            raise CommandError(f"slower than baseline: {names}")
+
+    def run_isolated(self, root, tmp, opts):
+        if connection.vendor == "sqlite":
+            connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(
+                tmp, "bench.sqlite3"
+            )
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            return run_suite(root, repeat=opts["repeat"], log=self.log)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,62 @@
+import json
+import sys
+
+from django.core.management.base import CommandError
+
+from dataset_viewer.metadata import export_metadata
+from dataset_viewer.shards import export_packed
+from dataset_viewer.trainer_layout import LINK_MODES, export_trainer_layout
+
+from ._common import JobCommand, add_common_arguments, resolve_datasets
+
+
+class Command(JobCommand):
+    help = "Export a dataset: caption JSON, tar shards, bucket memmaps or a trainer layout."
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", help="dataset id or name")
+        parser.add_argument(
+            "--format",
+            choices=["json", "tar", "memmap", "trainer"],
+            default="json",
+        )
+        parser.add_argument("--out", help="output file (json) or directory")
+        parser.add_argument("--shard-size", type=int, default=1000)
+        parser.add_argument("--concept", help="trainer: concept name (default: dataset name)")
+        parser.add_argument("--repeats", type=int, default=1)
+        parser.add_argument("--mode", choices=LINK_MODES, default="hardlink")
+        add_common_arguments(parser)
+
+    def handle(self, *args, **opts):
+        (dataset,) = resolve_datasets([opts["dataset"]])
+        fmt = opts["format"]
+
+        if fmt == "json":
+            data = json.dumps(export_metadata(dataset), ensure_ascii=False, indent=2)
+            if opts["out"]:
+                with open(opts["out"], "w", encoding="utf-8") as f:
+                    f.write(data)
+            else:
+                sys.stdout.write(data + "\n")
+            return
+
+        if fmt == "trainer":
+            if not opts["out"]:
+                raise CommandError("--out is required for the trainer layout")
+            result = export_trainer_layout(
+                dataset,
+                opts["out"],
+                concept=opts["concept"],
+                repeats=opts["repeats"],
+                mode=opts["mode"],
+                workers=opts["workers"],
+            )
+        else:
+            result = export_packed(
+                dataset,
+                fmt,
+                out_dir=opts["out"],
+                shard_size=opts["shard_size"],
+                workers=opts["workers"],
+            )
+        self.stdout.write(json.dumps(result))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from dataset_viewer.synthetic import generate_dataset
+
+from ._common import Progress
+
+
+class Command(BaseCommand):
+    help = "Write a synthetic dataset (images, caption sidecars, masks) for benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("root", help="output directory (images/ and masks/ go inside)")
+        parser.add_argument("--items", type=int, default=1000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--scale", type=float, default=1.0, help="image size factor, e.g. 0.25 for quick runs"
+        )
+        parser.add_argument("--caption-ratio", type=float, default=0.8)
+        parser.add_argument("--mask-ratio", type=float, default=0.3)
+        parser.add_argument("--no-progress", action="store_true", help="only print the summary")
+
+    def handle(self, *args, **opts):
+        counts = generate_dataset(
+            opts["root"],
+            opts["items"],
+            seed=opts["seed"],
+            scale=opts["scale"],
+            caption_ratio=opts["caption_ratio"],
+            mask_ratio=opts["mask_ratio"],
+            progress=Progress(self.stdout, opts["root"], opts),
+        )
+        summary = ", ".join(f"{k}={v}" for k, v in counts.items())
+        self.stdout.write(f"{opts['root']}: {summary}")
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import CommandError
+
+from dataset_viewer.captions import flush_captions
+from dataset_viewer.metadata import MetadataError, import_metadata, parse_metadata
+
+from ._common import JobCommand, Progress, add_common_arguments, resolve_datasets
+
+
+class Command(JobCommand):
+    help = "Import caption metadata (the dataset_export JSON format) into a dataset."
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", help="dataset id or name")
+        parser.add_argument("file", help="JSON file produced by export")
+        add_common_arguments(parser)
+
+    def handle(self, *args, **opts):
+        (dataset,) = resolve_datasets([opts["dataset"]])
+        try:
+            with open(opts["file"], "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"cannot read {opts['file']}: {e}")
+        try:
+            updated = import_metadata(
+                dataset,
+                parse_metadata(payload),
+                progress=Progress(self.stdout, dataset.name, opts),
+            )
+        except MetadataError as e:
+            raise CommandError(json.dumps(e.payload, ensure_ascii=False))
+        # The process is about to exit: write the sidecars now.
+        written = flush_captions(dataset, workers=opts["workers"])
+        self.stdout.write(f"{dataset.name}: updated={updated} sidecars={written}")
@@ -0,0 +1,89 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dataset_viewer.loadtest import Client, Options, StageResult, ramp
+
+
+def parse_users(raw: str) -> list[int]:
+    try:
+        users = [int(part) for part in raw.split(",") if part.strip()]
+    except ValueError:
+        users = []
+    if not users or min(users) < 1:
+        raise CommandError("--users must be a comma separated list of positive ints")
+    return users
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay grid browsing (list, thumbnails, details, mask previews, uploads) against "
+        "a running server at increasing concurrency and report latency percentiles, "
+        "throughput and the saturation point."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("dataset", help="dataset id or name on the target server")
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="server base URL")
+        parser.add_argument(
+            "--users", default="1,2,4,8,16,32", help="concurrent users per stage (ramp)"
+        )
+        parser.add_argument("--duration", type=float, default=20.0, help="seconds per stage")
+        parser.add_argument(
+            "--modal", type=float, default=0.2, help="share of page views opening an item"
+        )
+        parser.add_argument(
+            "--mask", type=float, default=0.1, help="share of page views loading mask previews"
+        )
+        parser.add_argument(
+            "--think", type=float, default=0.0, help="mean pause between page views (s)"
+        )
+        parser.add_argument(
+            "--upload-every",
+            type=float,
+            default=0.0,
+            help="seconds between background uploads (0: none); files go to images/loadtest_uploads",
+        )
+        parser.add_argument(
+            "--no-keepalive", action="store_true", help="open a new connection per request"
+        )
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--out", help="write the JSON report here as well")
+
+    def resolve(self, options: Options, ref: str) -> int:
+        if ref.isdigit():
+            return int(ref)
+        listing = Client(options, StageResult(users=0)).get_json("datasets", "/api/datasets/")
+        for row in listing or []:
+            if row.get("name") == ref:
+                return row["id"]
+        raise CommandError(f"dataset not found on {options.base_url}: {ref}")
+
+    def handle(self, *args, **opts):
+        options = Options(
+            base_url=opts["url"],
+            dataset_id=0,
+            modal=opts["modal"],
+            mask=opts["mask"],
+            think=opts["think"],
+            upload_every=opts["upload_every"],
+            keepalive=not opts["no_keepalive"],
+            seed=opts["seed"],
+        )
+        options.dataset_id = self.resolve(options, opts["dataset"])
+        report = ramp(options, parse_users(opts["users"]), opts["duration"], log=self.stderr.write)
+
+        text = json.dumps(report, indent=2)
+        if opts["out"]:
+            Path(opts["out"]).write_text(text, encoding="utf-8")
+        self.stdout.write(text)
+        knee = report["saturation"]
+        if knee is None:
+            self.stderr.write("no stage completed without errors")
+        elif knee["reached"]:
+            self.stderr.write(
+                f"saturates at {knee['users']} users: {knee['throughput']} req/s, p95 {knee['p95']} ms"
+            )
+        else:
+            self.stderr.write("not saturated yet; add stages with more users")
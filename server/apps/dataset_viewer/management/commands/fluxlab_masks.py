@@ -0,0 +1,35 @@
+from dataset_viewer.masks import compact_dataset, expand_dataset
+
+from ._common import JobCommand, Progress, add_common_arguments, resolve_datasets
+
+
+class Command(JobCommand):
+    help = (
+        "Convert masks between PNG files and the compact database store; "
+        "converted masks are skipped, so reruns resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("datasets", nargs="*", help="dataset ids or names (default: all)")
+        parser.add_argument(
+            "--to",
+            choices=("compact", "png"),
+            default="compact",
+            help="compact: encode PNG masks into the database; png: write them back as files",
+        )
+        parser.add_argument(
+            "--keep-png", action="store_true", help="keep the PNG files after compacting"
+        )
+        add_common_arguments(parser)
+
+    def handle(self, *args, **opts):
+        for dataset in resolve_datasets(opts["datasets"]):
+            progress = Progress(self.stdout, f"{dataset.name} masks", opts)
+            if opts["to"] == "compact":
+                counts = compact_dataset(
+                    dataset, workers=opts["workers"], keep_png=opts["keep_png"], progress=progress
+                )
+            else:
+                counts = expand_dataset(dataset, progress=progress)
+            summary = ", ".join(f"{k}={v}" for k, v in counts.items())
+            self.stdout.write(f"{dataset.name}: {summary}")
@@ -0,0 +1,63 @@
+import os
+
+from django.core.management.base import CommandError
+
+from dataset_viewer.ingest import scan_dataset
+from dataset_viewer.models import Dataset
+from dataset_viewer.stats import bump_version
+
+from ._common import (
+    JobCommand,
+    Progress,
+    add_common_arguments,
+    add_hash_argument,
+    fill_hashes,
+    resolve_datasets,
+)
+
+
+class Command(JobCommand):
+    help = "Scan dataset roots and register/refresh their images."
+
+    def add_arguments(self, parser):
+        parser.add_argument("datasets", nargs="*", help="dataset ids or names (default: all)")
+        parser.add_argument("--name", help="create or re-point a dataset with this name")
+        parser.add_argument("--root", help="root_dir for --name")
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="skip files already registered with the same size",
+        )
+        add_hash_argument(parser)
+        add_common_arguments(parser)
+
+    def handle(self, *args, **opts):
+        if opts["name"] or opts["root"]:
+            if not (opts["name"] and opts["root"]):
+                raise CommandError("--name and --root go together")
+            if not os.path.isdir(opts["root"]):
+                raise CommandError("root_dir does not exist")
+            dataset, _ = Dataset.objects.get_or_create(
+                name=opts["name"], defaults={"root_dir": opts["root"]}
+            )
+            if dataset.root_dir != opts["root"]:
+                dataset.root_dir = opts["root"]
+                dataset.save(update_fields=["root_dir"])
+                bump_version(dataset.id)
+            datasets = [dataset]
+        else:
+            datasets = resolve_datasets(opts["datasets"])
+
+        for dataset in datasets:
+            if not os.path.isdir(dataset.root_dir):
+                self.stderr.write(f"{dataset.name}: root_dir does not exist")
+                continue
+            result = scan_dataset(
+                dataset,
+                workers=opts["workers"],
+                resume=opts["resume"],
+                progress=Progress(self.stdout, dataset.name, opts),
+            )
+            summary = ", ".join(f"{k}={v}" for k, v in result.items())
+            self.stdout.write(f"{dataset.name}: {summary}")
+            fill_hashes(self, dataset, opts)
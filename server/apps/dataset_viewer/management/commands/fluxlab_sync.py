@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+from dataset_viewer.sync import sync_dataset
+
+from ._common import (
+    JobCommand,
+    add_common_arguments,
+    add_hash_argument,
+    fill_hashes,
+    resolve_datasets,
+)
+
+try:  # optional: event-driven wakeups instead of plain polling
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover - depends on the environment
+    Observer = None
+
+
+class Command(JobCommand):
+    help = "Apply filesystem changes under dataset roots to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("datasets", nargs="*", help="dataset ids or names (default: all)")
+        parser.add_argument("--watch", action="store_true", help="keep running")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=30.0,
+            help="seconds between passes in --watch mode (upper bound with inotify)",
+        )
+        parser.add_argument(
+            "--poll", action="store_true", help="never use inotify even if watchdog is installed"
+        )
+        add_hash_argument(parser)
+        add_common_arguments(parser)
+
+    def handle(self, *args, **opts):
+        datasets = resolve_datasets(opts["datasets"])
+        if not opts["watch"]:
+            for dataset in datasets:
+                self.sync_one(dataset, opts)
+            return
+
+        wakeup = threading.Event()
+        observer = None
+        if Observer is not None and not opts["poll"]:
+            observer = self.start_observer(datasets, wakeup)
+            self.stdout.write("watching with inotify")
+        else:
+            self.stdout.write(f"polling every {opts['interval']}s")
+        try:
+            while True:
+                for dataset in datasets:
+                    dataset.refresh_from_db()
+                    self.sync_one(dataset, opts)
+                wakeup.wait(opts["interval"])
+                if wakeup.is_set():
+                    # Let a burst of events settle before walking the tree.
+                    time.sleep(1.0)
+                    wakeup.clear()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def sync_one(self, dataset, opts):
+        try:
+            result = sync_dataset(dataset, workers=opts["workers"])
+        except FileNotFoundError:
+            self.stderr.write(f"{dataset.name}: root_dir does not exist")
+            return
+        changes = {k: v for k, v in result.items() if v and k != "files"}
+        if changes or self.verbosity > 1:
+            summary = ", ".join(f"{k}={v}" for k, v in changes.items()) or "no changes"
+            self.stdout.write(f"{dataset.name}: {summary} ({result['files']} files)")
+        fill_hashes(self, dataset, opts)
+
+    def start_observer(self, datasets, wakeup):
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Our own reads during a pass must not schedule another one.
+                if event.event_type not in ("opened", "closed_no_write"):
+                    wakeup.set()
+
+        observer = Observer()
+        for dataset in datasets:
+            images = os.path.join(dataset.root_dir, "images")
+            if os.path.isdir(images):
+                observer.schedule(Handler(), images, recursive=True)
+        observer.start()
+        return observer
@@ -0,0 +1,53 @@
+import os
+
+from django.conf import settings
+
+from dataset_viewer.models import DatasetItem
+from dataset_viewer.utils import ensure_thumbnail, parallel_map, thumbnail_path_for
+
+from ._common import JobCommand, Progress, add_common_arguments, resolve_datasets
+
+BATCH = 256
+
+
+def render_entry(args) -> str:
+    src, dst = args
+    try:
+        return "rendered" if ensure_thumbnail(src, dst) else "existing"
+    except Exception:
+        return "failed"
+
+
+class Command(JobCommand):
+    help = "Pre-render grid thumbnails; existing thumbnails are kept, so reruns resume."
+
+    def add_arguments(self, parser):
+        parser.add_argument("datasets", nargs="*", help="dataset ids or names (default: all)")
+        parser.add_argument("--force", action="store_true", help="re-render existing thumbnails")
+        add_common_arguments(parser)
+
+    def handle(self, *args, **opts):
+        for dataset in resolve_datasets(opts["datasets"]):
+            paths = list(
+                DatasetItem.objects.filter(dataset=dataset)
+                .order_by("id")
+                .values_list("image_path", flat=True)
+            )
+            jobs = []
+            for rel in paths:
+                dst = thumbnail_path_for(dataset.id, rel)
+                if opts["force"]:
+                    dst.unlink(missing_ok=True)
+                elif dst.exists():
+                    continue
+                jobs.append((os.path.join(dataset.root_dir, rel), str(dst)))
+
+            counts = {"rendered": 0, "existing": len(paths) - len(jobs), "failed": 0}
+            progress = Progress(self.stdout, dataset.name, opts)
+            with parallel_map(opts["workers"], chunksize=16) as pmap:
+                for start in range(0, len(jobs), BATCH):
+                    for status in pmap(render_entry, jobs[start : start + BATCH]):
+                        counts[status] += 1
+                    progress(start + len(jobs[start : start + BATCH]), len(jobs))
+            summary = ", ".join(f"{k}={v}" for k, v in counts.items())
+            self.stdout.write(f"{dataset.name}: {summary} (size {settings.THUMBNAIL_SIZE})")
@@ -0,0 +1,279 @@
+"""Compact run-length encoded masks kept in the database.
+
+Masks are mostly a few large solid regions, so runs of equal grey values
+take a fraction of the PNG's size and only a few kilobytes of runs are
+inflated instead of every pixel.  With
+``MASK_STORE = "compact"`` uploaded masks go to ``DatasetItem.mask_rle``
+instead of a PNG under ``masks/``; ``fluxlab_masks`` converts existing
+datasets either way.
+
+``mask_path`` keeps naming the mask (``masks/<stem>.png``) so ``has_mask``,
+stats and filters do not care where it lives.  Previews, coverage and the
+bucket export read the runs directly; a PNG is only produced when a client
+asks for the raw mask or an archive needs one.
+
+Format: ``b"FLM1"`` and ``width, height, runs`` as little-endian uint32,
+then, deflated, one uint8 grey value per run and the run lengths as LEB128
+varints, in row-major order.  Rows crossing the same regions repeat the
+same runs, which deflate removes.  Grey levels are kept, so the PNG
+materialized from it is the uploaded ``L`` image.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import os
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .models import DatasetItem
+from .stats import bump_version
+from .utils import get_dataset_root, parallel_map
+from .writequeue import run_write
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FLM1"
+_HEADER = struct.Struct("<4sIII")
+_VARINT_BYTES = 5  # 35 bits, more than width * height can reach
+COMPACT_FIELDS = ["mask_rle", "mask_coverage", "mask_png_size"]
+NO_COMPACT = {"mask_rle": b"", "mask_coverage": None, "mask_png_size": 0}
+BATCH = 200
+
+
+def compact_enabled() -> bool:
+    return settings.MASK_STORE == "compact"
+
+
+# === encoding ===
+
+
+def _varints(values: np.ndarray) -> bytes:
+    values = values.astype(np.uint64)
+    shifts = np.arange(0, 7 * _VARINT_BYTES, 7, dtype=np.uint64)
+    groups = (values[:, None] >> shifts) & np.uint64(0x7F)
+    nbytes = 1 + (values[:, None] >= (np.uint64(1) << shifts[1:])).sum(axis=1)
+    column = np.arange(_VARINT_BYTES)
+    more = column[None, :] < (nbytes - 1)[:, None]
+    out = (groups | (more.astype(np.uint64) << np.uint64(7))).astype(np.uint8)
+    return out[column[None, :] < nbytes[:, None]].tobytes()
+
+
+def _read_varints(data: np.ndarray, count: int) -> np.ndarray:
+    last = (data & 0x80) == 0
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    if len(starts) != count or not last[-1]:
+        raise ValueError("corrupt mask runs")
+    group = np.cumsum(np.concatenate(([0], last[:-1])))
+    position = np.arange(len(data)) - starts[group]
+    values = (data & 0x7F).astype(np.uint64) << (7 * position).astype(np.uint64)
+    return np.add.reduceat(values, starts).astype(np.int64)
+
+
+def encode(mask: np.ndarray) -> bytes:
+    """RLE of a 2-D uint8 mask."""
+
+    height, width = mask.shape
+    flat = np.ascontiguousarray(mask, dtype=np.uint8).ravel()
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    body = flat[starts].tobytes() + _varints(lengths)
+    return _HEADER.pack(MAGIC, width, height, len(starts)) + zlib.compress(body, 6)
+
+
+def runs(blob: bytes) -> tuple[int, int, np.ndarray, np.ndarray]:
+    """``(width, height, values, lengths)`` of an encoded mask."""
+
+    magic, width, height, count = _HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("not a compact mask")
+    try:
+        body = np.frombuffer(zlib.decompress(blob[_HEADER.size :]), dtype=np.uint8)
+    except zlib.error as e:
+        raise ValueError("corrupt mask runs") from e
+    values, lengths = body[:count], _read_varints(body[count:], count)
+    if int(lengths.sum()) != width * height:
+        raise ValueError("corrupt mask runs")
+    return width, height, values, lengths
+
+
+def decode(blob: bytes) -> np.ndarray:
+    width, height, values, lengths = runs(blob)
+    return np.repeat(values, lengths).reshape(height, width)
+
+
+def coverage(blob: bytes) -> float:
+    """Mean mask value in ``[0, 1]``: the masked share of the image."""
+
+    width, height, values, lengths = runs(blob)
+    return float((values.astype(np.int64) * lengths).sum()) / (255 * width * height)
+
+
+def sample(blob: bytes, width: int, height: int) -> np.ndarray:
+    """Nearest-neighbour ``height x width`` resample, without decoding the mask."""
+
+    src_w, src_h, values, lengths = runs(blob)
+    xs = ((np.arange(width) + 0.5) * src_w / width).astype(np.int64)
+    ys = ((np.arange(height) + 0.5) * src_h / height).astype(np.int64)
+    index = ys[:, None] * src_w + xs[None, :]
+    ends = np.cumsum(lengths)
+    return values[np.searchsorted(ends, index, side="right")]
+
+
+# === PNG conversion (image pool / worker processes) ===
+
+
+def encode_image(source) -> dict | None:
+    """``COMPACT_FIELDS`` of a mask image path or bytes; ``None`` if unreadable.
+
+    The size of the PNG :func:`to_png` renders is stored too, so archives
+    can lay out their members without rendering every mask first.
+    """
+
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+            mask = np.asarray(img.convert("L"))
+    except Exception:
+        return None
+    blob = encode(mask)
+    return {
+        "mask_rle": blob,
+        "mask_coverage": coverage(blob),
+        "mask_png_size": len(to_png(blob)),
+    }
+
+
+def to_png(blob: bytes) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(decode(blob), "L").save(buf, "PNG")
+    return buf.getvalue()
+
+
+def preview_size(width: int, height: int, size: int) -> tuple[int, int]:
+    scale = min(size / width, size / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def render_preview(blob: bytes, cache_path: str | Path, size: int) -> None:
+    """``utils.render_mask_preview`` for a compact mask."""
+
+    width, height, _values, _lengths = runs(blob)
+    alpha = sample(blob, *preview_size(width, height, size))
+    # White pasted through the mask onto transparent black: every channel is the mask.
+    rgba = np.repeat(alpha[..., None], 4, axis=2)
+    Image.fromarray(rgba, "RGBA").save(cache_path, "PNG")
+
+
+# === item helpers ===
+
+
+def set_compact(item, fields: dict | None) -> None:
+    """Store the ``encode_image`` fields on ``item``; ``None`` clears them."""
+
+    for name, value in (fields or NO_COMPACT).items():
+        setattr(item, name, value)
+
+
+def set_mask_path(item, path: str | None) -> None:
+    """Point ``item`` at another mask; a compact mask of the old one is dropped."""
+
+    if (path or None) != item.mask_path:
+        set_compact(item, None)
+    item.mask_path = path or None
+
+
+def keep_compact_mask(item, fields: dict) -> dict:
+    """Keep the mask of a re-probed item whose mask only lives in the database."""
+
+    if item is not None and item.mask_rle and not fields.get("mask_path"):
+        return {**fields, "mask_path": item.mask_path}
+    return fields
+
+
+def drop_previews(root: str | Path, mask_path: str) -> None:
+    previews = Path(root) / ".cache" / "masks"
+    if previews.is_dir():
+        for size_dir in previews.iterdir():
+            (size_dir / mask_path).unlink(missing_ok=True)
+
+
+# === dataset conversion ===
+
+
+def _write_png(path: Path, blob: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(to_png(blob))
+    os.replace(tmp, path)
+
+
+def _save(items) -> None:
+    DatasetItem.objects.bulk_update(items, COMPACT_FIELDS)
+    if items:
+        bump_version(items[0].dataset_id)
+
+
+def compact_dataset(dataset, workers: int = 1, keep_png: bool = False, progress=None) -> dict:
+    """Move the PNG masks of ``dataset`` into the database.
+
+    The PNG files are removed once their batch is committed, unless
+    ``keep_png``.  Masks that cannot be read are left as they are.
+    """
+
+    root = get_dataset_root(dataset)
+    qs = DatasetItem.objects.filter(dataset=dataset, mask_path__isnull=False, mask_rle=b"")
+    ids = list(qs.exclude(mask_path="").order_by("id").values_list("id", flat=True))
+    counts = {"converted": 0, "failed": 0, "saved_bytes": 0}
+    with parallel_map(workers) as pmap:
+        for start in range(0, len(ids), BATCH):
+            items = list(DatasetItem.objects.filter(id__in=ids[start : start + BATCH]))
+            paths = [str(root / item.mask_path) for item in items]
+            done = []
+            for item, path, result in zip(items, paths, pmap(encode_image, paths)):
+                if result is None:
+                    logger.warning("mask %s is not a readable image, left as PNG", path)
+                    counts["failed"] += 1
+                    continue
+                set_compact(item, result)
+                done.append((item, path))
+            run_write(_save, [item for item, _ in done])
+            for item, path in done:
+                try:
+                    counts["saved_bytes"] += os.path.getsize(path) - len(item.mask_rle)
+                    if not keep_png:
+                        os.unlink(path)
+                except OSError:
+                    pass
+            counts["converted"] += len(done)
+            if progress:
+                progress(min(start + BATCH, len(ids)), len(ids))
+    return counts
+
+
+def expand_dataset(dataset, progress=None) -> dict:
+    """Write the compact masks of ``dataset`` back to PNG files and drop them."""
+
+    root = get_dataset_root(dataset)
+    ids = list(
+        DatasetItem.objects.filter(dataset=dataset)
+        .exclude(mask_rle=b"")
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    counts = {"expanded": 0}
+    for start in range(0, len(ids), BATCH):
+        items = list(DatasetItem.objects.filter(id__in=ids[start : start + BATCH]))
+        for item in items:
+            _write_png(root / item.mask_path, item.mask_rle)
+            set_compact(item, None)
+        run_write(_save, items)
+        counts["expanded"] += len(items)
+        if progress:
+            progress(min(start + BATCH, len(ids)), len(ids))
+    return counts
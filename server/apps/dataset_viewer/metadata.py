@@ -0,0 +1,129 @@
+"""Caption metadata export/import shared by the API and management commands."""
+
+from __future__ import annotations
+
+from pydantic import BaseModel, ValidationError
+
+from .captions import item_caption, schedule_writeback, set_caption
+from .masks import COMPACT_FIELDS, set_mask_path
+from .models import Dataset, DatasetItem
+from .stats import ItemStats, StatsDelta, apply_delta
+from .tags import retag_items
+from .writequeue import run_write
+
+BATCH = 500
+
+
+class MetadataItem(BaseModel):
+    filename: str
+    title: str | None = ""
+    caption: str | None = ""
+    tags: list[str] | None = []
+    mask: str | None = ""
+
+
+class MetadataError(ValueError):
+    """Rejected import; ``payload`` is the 400 response body."""
+
+    def __init__(self, payload: dict):
+        super().__init__(payload.get("detail"))
+        self.payload = payload
+
+
+def export_metadata(dataset: Dataset) -> list[dict]:
+    items = DatasetItem.objects.filter(dataset=dataset).defer("mask_rle").order_by("image_path")
+    results: list[dict] = []
+    for item in items.iterator(chunk_size=2000):
+        meta = {"title": "", "caption": "", "tags": []}
+        if item.caption_path or item.caption_dirty:
+            meta = item_caption(item, dataset.root_dir)
+        results.append(
+            {
+                "filename": item.image_path,
+                **meta,
+                "mask": item.mask_path or "",
+            }
+        )
+    return results
+
+
+def parse_metadata(payload) -> list[MetadataItem]:
+    if not isinstance(payload, list):
+        raise MetadataError({"detail": "invalid format"})
+    items: list[MetadataItem] = []
+    filenames: set[str] = set()
+    for raw in payload:
+        try:
+            meta = MetadataItem(**raw)
+        except (TypeError, ValidationError) as e:
+            detail = e.errors() if isinstance(e, ValidationError) else str(e)
+            raise MetadataError({"detail": detail})
+        if meta.filename in filenames:
+            raise MetadataError({"detail": f"duplicate filename: {meta.filename}"})
+        filenames.add(meta.filename)
+        items.append(meta)
+    return items
+
+
+CAPTION_COLUMNS = [
+    "caption_path",
+    "mask_path",
+    *COMPACT_FIELDS,
+    "has_caption",
+    "caption_title",
+    "caption_text",
+    "caption_tags",
+    "caption_dirty",
+]
+
+
+def _write_import_batch(dataset_id: int, items: list[DatasetItem], delta) -> None:
+    DatasetItem.objects.bulk_update(items, CAPTION_COLUMNS)
+    retag_items(dataset_id, items)
+    apply_delta(dataset_id, delta)
+
+
+def import_metadata(dataset: Dataset, items: list[MetadataItem], progress=None) -> int:
+    """Store captions and mask paths of ``items`` in the database.
+
+    The file names must match the dataset's items exactly.  Work is done in
+    batches, each committed on its own, so an interrupted run can simply be
+    repeated.  Sidecars are written back afterwards in the background (see
+    ``captions.schedule_writeback``).
+    """
+
+    db_names = set(
+        DatasetItem.objects.filter(dataset=dataset).values_list("image_path", flat=True)
+    )
+    filenames = {meta.filename for meta in items}
+    if filenames != db_names:
+        raise MetadataError(
+            {
+                "detail": "filenames mismatch",
+                "missing": sorted(db_names - filenames),
+                "extra": sorted(filenames - db_names),
+            }
+        )
+
+    done = 0
+    for start in range(0, len(items), BATCH):
+        batch = items[start : start + BATCH]
+        db_map = {
+            obj.image_path: obj
+            for obj in DatasetItem.objects.filter(
+                dataset=dataset, image_path__in=[m.filename for m in batch]
+            )
+        }
+        delta = StatsDelta()
+        for meta in batch:
+            item = db_map[meta.filename]
+            delta.add(ItemStats.of(item), -1)
+            set_caption(item, meta.title or "", meta.caption or "", meta.tags or [])
+            set_mask_path(item, meta.mask)
+            delta.add(ItemStats.of(item))
+        run_write(_write_import_batch, dataset.id, list(db_map.values()), delta)
+        done += len(batch)
+        if progress:
+            progress(done, len(items))
+    schedule_writeback(dataset.id)
+    return done
@@ -0,0 +1,257 @@
+"""In-process request metrics exposed in the Prometheus text format.
+
+:class:`MetricsMiddleware` times every request and counts its SQL queries
+(through ``connection.execute_wrapper``) per URL route; views report
+thumbnail/mask-preview cache hits, image decode time and the response
+cache through the helpers below.  ``GET /api/metrics`` renders the
+registry.
+
+The registry lives in the process: under several workers each one keeps
+and serves its own numbers.  Under ASGI the SQL count and time are not
+collected (the ORM runs on worker threads there).
+
+Requests slower than ``settings.SLOW_REQUEST_SECONDS`` are logged on the
+``fluxlab.slow`` logger with their query string and slowest SQL statement.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+slow_logger = logging.getLogger("fluxlab.slow")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SQL_PREVIEW = 300
+
+
+def _label_text(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values: dict[tuple, float] = defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] += amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_label_text(self.labels, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        names = (*self.labels, "le")
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else _number(bound)
+                yield f"{self.name}_bucket{_label_text(names, (*labels, le))} {cumulative}"
+            text = _label_text(self.labels, labels)
+            yield f"{self.name}_sum{text} {_number(total)}"
+            yield f"{self.name}_count{text} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: list = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self.lock:
+            for metric in self.metrics:
+                metric.values.clear()
+
+
+registry = Registry()
+request_seconds = registry.add(
+    Histogram(
+        "fluxlab_request_duration_seconds",
+        "Request latency by route.",
+        ("route", "method", "status"),
+    )
+)
+request_queries = registry.add(
+    Histogram(
+        "fluxlab_request_db_queries",
+        "SQL queries per request by route.",
+        ("route",),
+        QUERY_BUCKETS,
+    )
+)
+db_seconds = registry.add(
+    Counter("fluxlab_db_query_seconds_total", "Time spent in SQL by route.", ("route",))
+)
+response_bytes = registry.add(
+    Counter("fluxlab_response_bytes_total", "Response body bytes by route.", ("route",))
+)
+cache_requests = registry.add(
+    Counter(
+        "fluxlab_cache_requests_total",
+        "Cache lookups (thumbnail, mask_preview, response, etag) by result.",
+        ("cache", "result"),
+    )
+)
+decode_seconds = registry.add(
+    Histogram("fluxlab_image_decode_seconds", "Image decode and render time.", ("kind",))
+)
+slow_requests = registry.add(
+    Counter("fluxlab_slow_requests_total", "Requests over SLOW_REQUEST_SECONDS.", ("route",))
+)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    with registry.lock:
+        cache_requests.inc(cache, "hit" if hit else "miss")
+
+
+def observe_decode(kind: str, seconds: float) -> None:
+    with registry.lock:
+        decode_seconds.observe(seconds, kind)
+
+
+class _QueryTimer:
+    """``execute_wrapper`` collecting the SQL count and time of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = (0.0, "")
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if elapsed > self.slowest[0]:
+                self.slowest = (elapsed, sql)
+
+
+def _route(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    return match.route if match is not None else "<unmatched>"
+
+
+def _body_size(response) -> int:
+    length = response.get("Content-Length")
+    if length:
+        return int(length)
+    if response.streaming:
+        return 0
+    return len(response.content)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        queries = _QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    async def __acall__(self, request):
+        # Under ASGI the ORM runs on sync_to_async threads, out of reach of
+        # an execute_wrapper installed here: only time and bytes are recorded.
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - started, None)
+        return response
+
+    def _record(self, request, response, elapsed: float, queries: _QueryTimer | None) -> None:
+        route = _route(request)
+        with registry.lock:
+            request_seconds.observe(elapsed, route, request.method, response.status_code)
+            if queries is not None:
+                request_queries.observe(queries.count, route)
+                db_seconds.inc(route, amount=queries.seconds)
+            response_bytes.inc(route, amount=_body_size(response))
+            slow = elapsed >= settings.SLOW_REQUEST_SECONDS
+            if slow:
+                slow_requests.inc(route)
+        if not slow:
+            return
+        queries = queries or _QueryTimer()
+        slow_logger.warning(
+            "slow request %.3fs %s %s?%s status=%s queries=%d db=%.3fs slowest_sql=%.3fs %s",
+            elapsed,
+            request.method,
+            request.path,
+            request.GET.urlencode(),
+            response.status_code,
+            queries.count,
+            queries.seconds,
+            queries.slowest[0],
+            queries.slowest[1][:SQL_PREVIEW],
+        )
+
+
+def metrics_view(_request):
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:50
+
+import os
+from collections import Counter
+
+from django.db import migrations, models
+
+HIST_BIN = 256
+
+
+def backfill_stats(apps, schema_editor):
+    Dataset = apps.get_model("dataset_viewer", "Dataset")
+    DatasetItem = apps.get_model("dataset_viewer", "DatasetItem")
+    for dataset in Dataset.objects.all():
+        counts = Counter()
+        width_hist, height_hist = Counter(), Counter()
+        for item in DatasetItem.objects.filter(dataset=dataset).iterator():
+            try:
+                size = os.path.getsize(os.path.join(dataset.root_dir, item.image_path))
+            except OSError:
+                size = 0
+            if size:
+                item.file_size = size
+                item.save(update_fields=["file_size"])
+            counts["items"] += 1
+            counts["captioned"] += bool(item.has_caption)
+            counts["masked"] += bool(item.mask_path)
+            counts["bytes"] += size
+            if item.width:
+                width_hist[str((item.width // HIST_BIN) * HIST_BIN)] += 1
+            if item.height:
+                height_hist[str((item.height // HIST_BIN) * HIST_BIN)] += 1
+        dataset.items_count = counts["items"]
+        dataset.captioned_count = counts["captioned"]
+        dataset.masked_count = counts["masked"]
+        dataset.total_bytes = counts["bytes"]
+        dataset.width_hist = dict(sorted(width_hist.items(), key=lambda kv: int(kv[0])))
+        dataset.height_hist = dict(sorted(height_hist.items(), key=lambda kv: int(kv[0])))
+        dataset.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0005_alter_datasetitem_mask_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dataset",
+            name="captioned_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="dataset",
+            name="height_hist",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="dataset",
+            name="items_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="dataset",
+            name="masked_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="dataset",
+            name="total_bytes",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="dataset",
+            name="width_hist",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="file_size",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:51
+
+import os
+
+from django.db import migrations, models
+
+
+def backfill_derived(apps, schema_editor):
+    DatasetItem = apps.get_model("dataset_viewer", "DatasetItem")
+    for item in DatasetItem.objects.all().iterator():
+        item.ext = os.path.splitext(item.image_path)[1].lower().lstrip(".")
+        if item.width and item.height:
+            item.aspect_ratio = round(item.width / item.height, 4)
+            item.megapixels = round(item.width * item.height / 1_000_000, 4)
+        item.save(update_fields=["ext", "aspect_ratio", "megapixels"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0006_dataset_stats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasetitem",
+            name="aspect_ratio",
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="ext",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="megapixels",
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(fields=["dataset", "ext"], name="ds_item_ext_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(fields=["dataset", "aspect_ratio"], name="ds_item_ar_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(fields=["dataset", "megapixels"], name="ds_item_mp_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(fields=["dataset", "file_size"], name="ds_item_size_idx"),
+        ),
+        migrations.RunPython(backfill_derived, migrations.RunPython.noop),
+    ]
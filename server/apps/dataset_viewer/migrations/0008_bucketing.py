@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0007_datasetitem_derived_columns"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dataset",
+            name="bucket_resolutions",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="bucket",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(fields=["dataset", "bucket"], name="ds_item_bucket_idx"),
+        ),
+    ]
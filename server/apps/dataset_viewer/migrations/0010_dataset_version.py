@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0009_filesnapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dataset",
+            name="version",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
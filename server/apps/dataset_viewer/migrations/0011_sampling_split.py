@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:03
+
+import dataset_viewer.models
+import random
+
+from django.db import migrations, models
+
+
+def backfill_rand_key(apps, schema_editor):
+    # AddField evaluated the default once; give every row its own key.
+    DatasetItem = apps.get_model("dataset_viewer", "DatasetItem")
+    batch = []
+    for item in DatasetItem.objects.only("id").iterator(chunk_size=2000):
+        item.rand_key = random.random()
+        batch.append(item)
+        if len(batch) >= 2000:
+            DatasetItem.objects.bulk_update(batch, ["rand_key"])
+            batch = []
+    DatasetItem.objects.bulk_update(batch, ["rand_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0010_dataset_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasetitem",
+            name="rand_key",
+            field=models.FloatField(default=dataset_viewer.models.random_key),
+        ),
+        migrations.RunPython(backfill_rand_key, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="split",
+            field=models.CharField(blank=True, max_length=8),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(fields=["dataset", "rand_key"], name="ds_item_rand_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(
+                fields=["dataset", "bucket", "rand_key"], name="ds_item_bucket_rand_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(fields=["dataset", "split"], name="ds_item_split_idx"),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0011_sampling_split"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasetitem",
+            name="caption_dirty",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="caption_mtime_ns",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="caption_tags",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="caption_text",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="caption_title",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(
+                fields=["dataset", "caption_dirty"], name="ds_item_caption_dirty_idx"
+            ),
+        ),
+    ]
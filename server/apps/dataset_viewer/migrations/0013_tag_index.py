@@ -0,0 +1,112 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_tags(apps, schema_editor):
+    DatasetItem = apps.get_model("dataset_viewer", "DatasetItem")
+    Tag = apps.get_model("dataset_viewer", "Tag")
+    ItemTag = apps.get_model("dataset_viewer", "ItemTag")
+    tag_ids = {}
+    links = []
+    for item in DatasetItem.objects.only("id", "dataset_id", "caption_tags").iterator():
+        names = {" ".join(str(t).lower().split())[:255] for t in item.caption_tags or []}
+        for name in names - {""}:
+            key = (item.dataset_id, name)
+            if key not in tag_ids:
+                tag_ids[key] = Tag.objects.create(dataset_id=item.dataset_id, name=name).id
+            links.append(ItemTag(item_id=item.id, tag_id=tag_ids[key]))
+    ItemTag.objects.bulk_create(links, batch_size=500)
+    for tag in Tag.objects.all():
+        tag.count = ItemTag.objects.filter(tag=tag).count()
+        tag.save(update_fields=["count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0012_caption_columns"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "dataset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="tags",
+                        to="dataset_viewer.dataset",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ItemTag",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "item",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="item_tags",
+                        to="dataset_viewer.datasetitem",
+                    ),
+                ),
+                (
+                    "tag",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="item_tags",
+                        to="dataset_viewer.tag",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="tag",
+            index=models.Index(fields=["dataset", "-count"], name="tag_count_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="tag",
+            index=models.Index(fields=["name"], name="tag_name_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="tag",
+            constraint=models.UniqueConstraint(
+                fields=("dataset", "name"), name="tag_unique"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="itemtag",
+            index=models.Index(fields=["tag", "item"], name="item_tag_tag_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="itemtag",
+            constraint=models.UniqueConstraint(
+                fields=("item", "tag"), name="item_tag_unique"
+            ),
+        ),
+        migrations.RunPython(backfill_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0013_tag_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dataset",
+            name="features_version",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="features",
+            field=models.BinaryField(blank=True, default=b""),
+        ),
+    ]
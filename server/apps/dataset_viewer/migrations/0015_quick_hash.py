@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0014_item_features"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasetitem",
+            name="quick_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="filesnapshot",
+            name="quick_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(
+                fields=["dataset", "quick_hash"], name="ds_item_quick_hash_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="datasetitem",
+            index=models.Index(fields=["dataset", "sha256"], name="ds_item_sha256_idx"),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0015_quick_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasetitem",
+            name="mask_coverage",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="datasetitem",
+            name="mask_rle",
+            field=models.BinaryField(blank=True, default=b""),
+        ),
+    ]
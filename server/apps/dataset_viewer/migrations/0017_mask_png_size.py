@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("dataset_viewer", "0016_compact_masks"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasetitem",
+            name="mask_png_size",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
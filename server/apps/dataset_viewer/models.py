@@ -1,6 +1,12 @@
+import random
+
 from django.db import models
 
 
+def random_key() -> float:
+    return random.random()
+
+
 class Dataset(models.Model):
     name = models.CharField(max_length=255, unique=True)
     description = models.TextField(blank=True)
@@ -8,6 +14,22 @@ class Dataset(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized aggregates, maintained incrementally by ``stats.py``.
+    items_count = models.PositiveIntegerField(default=0)
+    captioned_count = models.PositiveIntegerField(default=0)
+    masked_count = models.PositiveIntegerField(default=0)
+    total_bytes = models.PositiveBigIntegerField(default=0)
+    width_hist = models.JSONField(default=dict, blank=True)
+    height_hist = models.JSONField(default=dict, blank=True)
+    # [[w, h], ...]; empty means settings.BUCKET_RESOLUTIONS.
+    bucket_resolutions = models.JSONField(default=list, blank=True)
+    # Bumped by every write to the dataset or its items; keys the response
+    # cache and the ETags of ``response_cache.py``.
+    version = models.PositiveBigIntegerField(default=0)
+    # Bumped when item feature vectors change; the similarity matrix of
+    # ``similarity.py`` is rebuilt when it no longer matches.
+    features_version = models.PositiveBigIntegerField(default=0)
+
     def __str__(self) -> str:
         return self.name
 
@@ -22,10 +44,40 @@ class DatasetItem(models.Model):
         blank=True,
         help_text="relative to dataset.root_dir",
     )
+    # Run-length encoded mask, see ``masks.py``; when set it is the mask and
+    # no PNG needs to exist at ``mask_path``.
+    mask_rle = models.BinaryField(default=b"", blank=True)
+    # Mean mask value in [0, 1], known for compact masks.
+    mask_coverage = models.FloatField(null=True, blank=True)
+    # Byte size of the PNG ``masks.to_png`` renders from ``mask_rle``.
+    mask_png_size = models.PositiveIntegerField(default=0)
     width = models.IntegerField(null=True)
     height = models.IntegerField(null=True)
+    file_size = models.PositiveBigIntegerField(default=0)
+    # Derived from image_path/width/height so filters can use indexes.
+    ext = models.CharField(max_length=16, blank=True)
+    aspect_ratio = models.FloatField(null=True)
+    megapixels = models.FloatField(null=True)
+    # "<w>x<h>" of the assigned training bucket, see ``bucketing.py``.
+    bucket = models.CharField(max_length=16, blank=True)
+    # Uniform in [0, 1), fixed at creation; ``sampling.py`` probes it through
+    # an index instead of sorting by RANDOM().
+    rand_key = models.FloatField(default=random_key)
+    # "train" / "val" after ``assign_split``, empty before.
+    split = models.CharField(max_length=8, blank=True)
+    # ``hashing.quick_fingerprint`` at ingest; ``sha256`` stays empty until
+    # the background pass in ``hashing.py`` fills it.
+    quick_hash = models.CharField(max_length=64, blank=True)
     sha256 = models.CharField(max_length=64, blank=True)
     has_caption = models.BooleanField(default=False, db_index=True)
+    # Caption contents mirrored from the sidecar, see ``captions.py``.
+    caption_title = models.TextField(blank=True)
+    caption_text = models.TextField(blank=True)
+    caption_tags = models.JSONField(default=list, blank=True)
+    caption_mtime_ns = models.BigIntegerField(default=0)
+    caption_dirty = models.BooleanField(default=False)
+    # float16 image descriptor for similarity search, see ``similarity.py``.
+    features = models.BinaryField(default=b"", blank=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self) -> str:
@@ -50,4 +102,94 @@ class DatasetItem(models.Model):
             models.Index(
                 fields=["dataset", "created_at"], name="ds_item_created_idx"
             ),
+            models.Index(fields=["dataset", "ext"], name="ds_item_ext_idx"),
+            models.Index(
+                fields=["dataset", "aspect_ratio"], name="ds_item_ar_idx"
+            ),
+            models.Index(
+                fields=["dataset", "megapixels"], name="ds_item_mp_idx"
+            ),
+            models.Index(
+                fields=["dataset", "file_size"], name="ds_item_size_idx"
+            ),
+            models.Index(
+                fields=["dataset", "bucket"], name="ds_item_bucket_idx"
+            ),
+            models.Index(
+                fields=["dataset", "rand_key"], name="ds_item_rand_idx"
+            ),
+            models.Index(
+                fields=["dataset", "bucket", "rand_key"],
+                name="ds_item_bucket_rand_idx",
+            ),
+            models.Index(
+                fields=["dataset", "split"], name="ds_item_split_idx"
+            ),
+            models.Index(
+                fields=["dataset", "caption_dirty"], name="ds_item_caption_dirty_idx"
+            ),
+            models.Index(
+                fields=["dataset", "quick_hash"], name="ds_item_quick_hash_idx"
+            ),
+            models.Index(fields=["dataset", "sha256"], name="ds_item_sha256_idx"),
+        ]
+
+
+class Tag(models.Model):
+    """Distinct normalized caption tag of a dataset, see ``tags.py``."""
+
+    dataset = models.ForeignKey(Dataset, related_name="tags", on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    # Number of items carrying the tag, maintained incrementally.
+    count = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{self.dataset_id}:{self.name}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=("dataset", "name"), name="tag_unique")
+        ]
+        indexes = [
+            models.Index(fields=["dataset", "-count"], name="tag_count_idx"),
+            models.Index(fields=["name"], name="tag_name_idx"),
+        ]
+
+
+class ItemTag(models.Model):
+    item = models.ForeignKey(DatasetItem, related_name="item_tags", on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, related_name="item_tags", on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=("item", "tag"), name="item_tag_unique")
+        ]
+        indexes = [
+            models.Index(fields=["tag", "item"], name="item_tag_tag_idx"),
+        ]
+
+
+class FileSnapshot(models.Model):
+    """Last seen state of a file under a dataset root, used by ``sync.py``.
+
+    Files that could not be opened as images are recorded too, so an
+    unchanged broken file is not re-probed on every pass.
+    """
+
+    dataset = models.ForeignKey(Dataset, related_name="files", on_delete=models.CASCADE)
+    path = models.CharField(max_length=1024)
+    size = models.PositiveBigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    inode = models.PositiveBigIntegerField(default=0)
+    quick_hash = models.CharField(max_length=64, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.dataset_id}:{self.path}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=("dataset", "path"), name="file_snapshot_unique"
+            )
         ]
@@ -0,0 +1,349 @@
+"""Opt-in profiling of selected requests and long jobs.
+
+With ``settings.PROFILING_ENABLED`` :class:`ProfilingMiddleware` profiles a
+request when it carries the ``X-Fluxlab-Profile`` header or the
+``__profile`` query parameter, or at random with probability
+``settings.PROFILING_RATE``.  The header/parameter value picks the
+collectors (comma separated, default ``cprofile,memory``):
+
+* ``cprofile`` - deterministic profile of the request thread (``.prof``,
+  loadable with ``pstats``/snakeviz, plus a text summary);
+* ``sample`` - a thread sampling the request's stack every
+  ``PROFILING_INTERVAL`` seconds, written as collapsed stacks for
+  flamegraph tools;
+* ``memory`` - ``tracemalloc`` snapshot of the allocations still alive at
+  the end (raw dump plus the top lines) and the peak.  ``tracemalloc`` is
+  process-wide, so only one capture at a time collects memory.
+
+Management commands accept ``--profile`` the same way (see
+``management/commands/_common.py``).  Captures are written under
+``settings.PROFILES_ROOT`` next to a JSON file with the request metadata;
+the newest ``PROFILING_KEEP`` are kept.  Staff users list, download and
+delete them through ``/api/profiles``.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import FileResponse, Http404
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+HEADER = "HTTP_X_FLUXLAB_PROFILE"
+PARAM = "__profile"
+COLLECTORS = ("cprofile", "sample", "memory")
+DEFAULT_COLLECTORS = ("cprofile", "memory")
+TRACEMALLOC_FRAMES = 16
+TOP_LINES = 40
+# Files of a capture: suffix -> content type.
+FILES = {
+    "json": "application/json",
+    "prof": "application/octet-stream",
+    "pstats.txt": "text/plain; charset=utf-8",
+    "stacks.txt": "text/plain; charset=utf-8",
+    "tracemalloc": "application/octet-stream",
+    "tracemalloc.txt": "text/plain; charset=utf-8",
+}
+
+_memory_lock = threading.Lock()
+
+
+def parse_collectors(raw: str | None) -> tuple[str, ...]:
+    """Collectors named in a header/param/option value; truthy junk means the default."""
+
+    names = tuple(n for n in (p.strip().lower() for p in (raw or "").split(",")) if n)
+    picked = tuple(n for n in names if n in COLLECTORS)
+    return picked or DEFAULT_COLLECTORS
+
+
+class StackSampler:
+    """Samples one thread's Python stack from a helper thread."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="fluxlab-sampler", daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def profiles_root() -> Path:
+    return Path(settings.PROFILES_ROOT)
+
+
+def new_profile_id() -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    return f"{stamp}-{uuid.uuid4().hex[:8]}"
+
+
+class Capture:
+    """Collectors running around one request or job; :meth:`save` writes them."""
+
+    def __init__(self, collectors: tuple[str, ...]):
+        self.collectors = list(collectors)
+        self.profiler = None
+        self.sampler = None
+        self.memory = False
+        self.snapshot = None
+        self.started = 0.0
+        self.duration = 0.0
+
+    def start(self):
+        if "memory" in self.collectors:
+            # Skipped when another capture (or someone else) is tracing.
+            self.memory = not tracemalloc.is_tracing() and _memory_lock.acquire(blocking=False)
+            if self.memory:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            else:
+                self.collectors.remove("memory")
+        if "sample" in self.collectors:
+            self.sampler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL)
+            self.sampler.start()
+        if "cprofile" in self.collectors:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        if self.memory:
+            self.snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+                ]
+            )
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            _memory_lock.release()
+
+    def save(self, meta: dict) -> dict:
+        root = profiles_root()
+        root.mkdir(parents=True, exist_ok=True)
+        profile_id = meta.setdefault("id", new_profile_id())
+        base = root / profile_id
+        files = []
+        if self.profiler is not None:
+            self.profiler.dump_stats(f"{base}.prof")
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(TOP_LINES)
+            Path(f"{base}.pstats.txt").write_text(out.getvalue(), encoding="utf-8")
+            files += ["prof", "pstats.txt"]
+        if self.sampler is not None:
+            Path(f"{base}.stacks.txt").write_text(self.sampler.collapsed(), encoding="utf-8")
+            meta["samples"] = sum(self.sampler.stacks.values())
+            files.append("stacks.txt")
+        if self.snapshot is not None:
+            self.snapshot.dump(f"{base}.tracemalloc")
+            stats = self.snapshot.statistics("lineno")
+            lines = [str(stat) for stat in stats[:TOP_LINES]]
+            Path(f"{base}.tracemalloc.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+            meta["memory_peak"] = self.peak
+            meta["memory_retained"] = sum(stat.size for stat in stats)
+            files += ["tracemalloc", "tracemalloc.txt"]
+        meta.update(
+            created=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            duration=round(self.duration, 6),
+            collectors=self.collectors,
+            files=["json", *files],
+        )
+        tmp = root / f"{profile_id}.json.tmp"
+        tmp.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        os.replace(tmp, f"{base}.json")
+        prune()
+        return meta
+
+
+@contextmanager
+def profiled(collectors: tuple[str, ...], meta: dict):
+    """Profile the enclosed block and save it with ``meta`` (updated in place)."""
+
+    capture = Capture(collectors)
+    capture.start()
+    try:
+        yield meta
+    finally:
+        capture.stop()
+        capture.save(meta)
+
+
+def prune() -> None:
+    metas = sorted(profiles_root().glob("*.json"))
+    for old in metas[: max(0, len(metas) - settings.PROFILING_KEEP)]:
+        profile_id = old.name[: -len(".json")]
+        for suffix in FILES:
+            Path(old.parent, f"{profile_id}.{suffix}").unlink(missing_ok=True)
+
+
+def _selected(request) -> str | None:
+    value = request.META.get(HEADER) or request.GET.get(PARAM)
+    if value:
+        return value
+    rate = settings.PROFILING_RATE
+    if rate and random.random() < rate:
+        return ""
+    return None
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _select(self, request) -> str | None:
+        if not settings.PROFILING_ENABLED or request.path.startswith("/api/profiles"):
+            return None
+        return _selected(request)
+
+    def _meta(self, request, value: str) -> dict:
+        return {
+            "kind": "request",
+            "method": request.method,
+            "path": request.path,
+            "query": request.GET.urlencode(),
+            "trigger": "random" if value == "" else "request",
+        }
+
+    def _finish(self, request, response, meta: dict) -> None:
+        match = getattr(request, "resolver_match", None)
+        meta.update(status=response.status_code, route=match.route if match else None)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        value = self._select(request)
+        if value is None:
+            return self.get_response(request)
+        meta = self._meta(request, value)
+        with profiled(parse_collectors(value), meta):
+            response = self.get_response(request)
+            self._finish(request, response, meta)
+        response["X-Fluxlab-Profile-Id"] = meta["id"]
+        return response
+
+    async def __acall__(self, request):
+        # The collectors watch the event loop thread, so other requests
+        # running on the loop meanwhile show up in the capture too.
+        value = self._select(request)
+        if value is None:
+            return await self.get_response(request)
+        meta = self._meta(request, value)
+        with profiled(parse_collectors(value), meta):
+            response = await self.get_response(request)
+            self._finish(request, response, meta)
+        response["X-Fluxlab-Profile-Id"] = meta["id"]
+        return response
+
+
+def _load_meta(profile_id: str) -> dict:
+    if "/" in profile_id or "\\" in profile_id or profile_id.startswith("."):
+        raise Http404("Profile not found")
+    path = profiles_root() / f"{profile_id}.json"
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        raise Http404("Profile not found")
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profiles_list(request):
+    """Stored captures, newest first: ``?kind=request|job&limit=100``."""
+
+    try:
+        limit = int(request.GET.get("limit", 100))
+    except ValueError:
+        return Response({"detail": "limit must be int"}, status=400)
+    kind = request.GET.get("kind")
+    results = []
+    for path in sorted(profiles_root().glob("*.json"), reverse=True):
+        try:
+            meta = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if kind and meta.get("kind") != kind:
+            continue
+        results.append(meta)
+        if len(results) >= limit:
+            break
+    return Response({"results": results})
+
+
+@api_view(["GET", "DELETE"])
+@permission_classes([IsAdminUser])
+def profile_detail(request, profile_id: str):
+    meta = _load_meta(profile_id)
+    if request.method == "DELETE":
+        for suffix in FILES:
+            Path(profiles_root(), f"{profile_id}.{suffix}").unlink(missing_ok=True)
+        return Response(status=204)
+    return Response(meta)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profile_download(request, profile_id: str, name: str):
+    """One file of a capture, e.g. ``prof`` or ``stacks.txt``."""
+
+    meta = _load_meta(profile_id)
+    if name not in FILES or name not in meta.get("files", []):
+        raise Http404("File not found")
+    path = profiles_root() / f"{profile_id}.{name}"
+    if not path.is_file():
+        raise Http404("File not found")
+    return FileResponse(
+        open(path, "rb"),
+        as_attachment=True,
+        filename=path.name,
+        content_type=FILES[name],
+    )
@@ -0,0 +1,162 @@
+"""Version-keyed response cache and ETags for the read-only JSON endpoints.
+
+Every write to a dataset bumps ``Dataset.version`` (see ``stats.py``), so a
+response computed for a given version stays valid until the next write and
+needs no time-based expiry.  :func:`cached_json` keys responses by
+``(endpoint, normalized query, version token)``:
+
+* the ETag is derived from that key, so ``If-None-Match`` is answered with
+  304 after a single small query, without running the view;
+* rendered bodies are kept in a per-process LRU bounded by
+  ``settings.RESPONSE_CACHE_MAX_BYTES``.  Entries for old versions are never
+  hit again and simply age out.
+"""
+
+from __future__ import annotations
+
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .metrics import record_cache
+from .models import Dataset
+
+
+class ResponseCache:
+    """Thread-safe LRU of rendered bodies, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: str, body: bytes) -> None:
+        # A single huge export must not flush everything else.
+        if len(body) > self.max_bytes // 4:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+response_cache = ResponseCache(getattr(settings, "RESPONSE_CACHE_MAX_BYTES", 64 << 20))
+
+
+def dataset_version(dataset_id: int, **_kwargs) -> str | None:
+    """Version token of one dataset, ``None`` if it does not exist.
+
+    ``created_at`` is part of the token so a recreated dataset that reuses
+    an id never matches entries of its predecessor.
+    """
+
+    row = (
+        Dataset.objects.filter(id=dataset_id)
+        .values_list("version", "created_at")
+        .first()
+    )
+    if row is None:
+        return None
+    version, created_at = row
+    return f"{version}.{created_at.timestamp():.6f}"
+
+
+def datasets_version(**_kwargs) -> str:
+    """Version token of the dataset list: changes on any create/delete/write."""
+
+    agg = Dataset.objects.aggregate(
+        n=Count("id"), last=Max("id"), versions=Sum("version"), created=Max("created_at")
+    )
+    created = agg["created"].timestamp() if agg["created"] else 0
+    return f"{agg['n']}.{agg['last']}.{agg['versions']}.{created:.6f}"
+
+
+def _normalized_query(request) -> list:
+    return sorted((name, sorted(values)) for name, values in request.GET.lists())
+
+
+def _etag(key: str) -> str:
+    return '"' + hashlib.blake2b(key.encode("utf-8"), digest_size=12).hexdigest() + '"'
+
+
+def _if_none_match(request) -> list[str]:
+    header = request.META.get("HTTP_IF_NONE_MATCH", "")
+    return [tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()]
+
+
+def cached_json(version_of):
+    """Cache the 200 responses of a GET view keyed by ``version_of(**kwargs)``.
+
+    Apply below ``@api_view``.  When ``version_of`` returns ``None`` (e.g.
+    unknown dataset) the view runs uncached and produces its own error.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                return view(request, *args, **kwargs)
+            version = version_of(**kwargs)
+            if version is None:
+                return view(request, *args, **kwargs)
+            key = repr(
+                (view.__name__, sorted(kwargs.items()), _normalized_query(request), version)
+            )
+            etag = _etag(key)
+            tags = _if_none_match(request)
+            if etag in tags or "*" in tags:
+                record_cache("etag", hit=True)
+                resp = HttpResponseNotModified()
+                resp["ETag"] = etag
+                return resp
+
+            body = response_cache.get(key)
+            record_cache("response", hit=body is not None)
+            if body is None:
+                resp = view(request, *args, **kwargs)
+                if resp.status_code != 200:
+                    return resp
+                if isinstance(resp, Response):
+                    body = JSONRenderer().render(resp.data)
+                else:
+                    body = resp.content
+                response_cache.put(key, body)
+            resp = HttpResponse(body, content_type="application/json")
+            resp["ETag"] = etag
+            # Revalidate every time; the 304 path is cheap.
+            resp["Cache-Control"] = "no-cache"
+            return resp
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,158 @@
+"""Random sampling and train/val splits of dataset items.
+
+Every item carries ``rand_key``, a uniform random number fixed at creation
+and indexed together with the dataset (and bucket).  A sample is drawn by
+probing that index at random points and reading short runs of items from
+there, so drawing ``n`` items costs a few dozen index seeks whatever the
+size of the dataset; ``ORDER BY RANDOM()`` would sort the whole table.
+
+Splits are deterministic: an item's rank inside its stratum is given by a
+hash of ``(seed, image_path)``, so the same seed over the same items
+always yields the same split.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import random
+
+from django.db.models import Count, QuerySet
+
+from .models import Dataset, DatasetItem
+from .stats import bump_version
+from .writequeue import run_write
+
+MAX_SAMPLE = 1000
+PROBES = 32
+STRATIFY_BY = ("bucket", "has_caption", "has_mask")
+ALLOCATIONS = ("proportional", "equal")
+SPLITS = ("train", "val")
+UPDATE_BATCH = 500
+
+
+def sample_uniform(qs: QuerySet, n: int, rng: random.Random) -> list[DatasetItem]:
+    """Up to ``n`` distinct random items of ``qs``.
+
+    Each probe reads a run of consecutive ``rand_key`` values starting at a
+    random point (wrapping around at 1.0).  Since the keys themselves are
+    random, a run is a random subset; several probes keep a sample from
+    being one contiguous run.
+    """
+
+    if n <= 0:
+        return []
+    picked: dict[int, DatasetItem] = {}
+    run = math.ceil(n / min(n, PROBES))
+    for _ in range(PROBES * 2):
+        if len(picked) >= n:
+            break
+        start = rng.random()
+        window = list(qs.filter(rand_key__gte=start).order_by("rand_key")[:run])
+        if len(window) < run:
+            window += qs.filter(rand_key__lt=start).order_by("rand_key")[: run - len(window)]
+        if not window:
+            return []
+        for item in window:
+            if len(picked) < n:
+                picked.setdefault(item.id, item)
+    if len(picked) < n:
+        # Small set or many collisions: top up in key order.
+        rest = qs.exclude(id__in=list(picked)).order_by("rand_key")[: n - len(picked)]
+        picked.update((item.id, item) for item in rest)
+    return list(picked.values())
+
+
+def strata(qs: QuerySet, by: str) -> list[tuple[object, QuerySet]]:
+    if by == "bucket":
+        labels = qs.order_by("bucket").values_list("bucket", flat=True).distinct()
+        return [(label, qs.filter(bucket=label)) for label in labels]
+    if by == "has_caption":
+        return [(flag, qs.filter(has_caption=flag)) for flag in (True, False)]
+    if by == "has_mask":
+        return [(flag, qs.filter(mask_path__isnull=not flag)) for flag in (True, False)]
+    raise ValueError(f"stratify must be one of {list(STRATIFY_BY)}")
+
+
+def allocate(n: int, sizes: list[int], allocation: str = "proportional") -> list[int]:
+    """Split ``n`` across strata of ``sizes`` (largest remainder), capped by size."""
+
+    total = sum(sizes)
+    if not total:
+        return [0] * len(sizes)
+    if allocation == "equal":
+        nonempty = [s for s in sizes if s]
+        share = [n / len(nonempty) if s else 0 for s in sizes]
+    else:
+        share = [n * s / total for s in sizes]
+    quotas = [math.floor(x) for x in share]
+    order = sorted(range(len(sizes)), key=lambda i: share[i] - quotas[i], reverse=True)
+    for i in order[: n - sum(quotas)]:
+        quotas[i] += 1
+    return [min(q, s) for q, s in zip(quotas, sizes)]
+
+
+def sample_stratified(
+    qs: QuerySet, n: int, by: str, rng: random.Random, allocation: str = "proportional"
+) -> list[dict]:
+    groups = [(key, sub, sub.count()) for key, sub in strata(qs, by)]
+    quotas = allocate(n, [size for _, _, size in groups], allocation)
+    return [
+        {"key": key, "total": size, "items": sample_uniform(sub, quota, rng)}
+        for (key, sub, size), quota in zip(groups, quotas)
+        if size
+    ]
+
+
+def split_score(seed: int, image_path: str) -> float:
+    digest = hashlib.blake2b(f"{seed}:{image_path}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+def assign_split(
+    dataset: Dataset, val_fraction: float, seed: int = 0, stratify: str | None = None
+) -> dict:
+    """Persist a train/val split on every item of ``dataset``.
+
+    Within each stratum (the whole dataset without ``stratify``) the
+    ``round(val_fraction * size)`` items with the lowest score go to "val".
+    """
+
+    if not 0 <= val_fraction <= 1:
+        raise ValueError("val_fraction must be in [0..1]")
+    qs = DatasetItem.objects.filter(dataset=dataset)
+    groups = strata(qs, stratify) if stratify else [(None, qs)]
+    val_ids: list[int] = []
+    train_ids: list[int] = []
+    for _, sub in groups:
+        rows = sorted(
+            sub.values_list("id", "image_path").iterator(chunk_size=2000),
+            key=lambda row: split_score(seed, row[1]),
+        )
+        cut = round(val_fraction * len(rows))
+        val_ids += [row[0] for row in rows[:cut]]
+        train_ids += [row[0] for row in rows[cut:]]
+
+    def write():
+        for label, ids in (("val", val_ids), ("train", train_ids)):
+            for start in range(0, len(ids), UPDATE_BATCH):
+                DatasetItem.objects.filter(id__in=ids[start : start + UPDATE_BATCH]).exclude(
+                    split=label
+                ).update(split=label)
+        bump_version(dataset.id)
+
+    run_write(write)
+    return {"train": len(train_ids), "val": len(val_ids)}
+
+
+def split_counts(dataset: Dataset) -> dict:
+    counts = dict.fromkeys((*SPLITS, "unassigned"), 0)
+    rows = (
+        DatasetItem.objects.filter(dataset=dataset)
+        .values_list("split")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    for label, n in rows:
+        counts[label or "unassigned"] = n
+    return counts
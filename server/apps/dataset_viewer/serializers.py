@@ -4,15 +4,23 @@ from .models import Dataset, DatasetItem
 
 
 class DatasetListSerializer(serializers.ModelSerializer):
-    items_count = serializers.IntegerField(read_only=True)
-
     class Meta:
         model = Dataset
-        fields = ["id", "name", "root_dir", "items_count"]
+        fields = [
+            "id",
+            "name",
+            "root_dir",
+            "items_count",
+            "captioned_count",
+            "masked_count",
+            "total_bytes",
+            "version",
+        ]
 
 
 class DatasetDetailSerializer(serializers.ModelSerializer):
-    items_count = serializers.IntegerField(read_only=True)
+    # Items whose full sha256 is not computed yet, see ``hashing.py``.
+    pending_hashes = serializers.SerializerMethodField()
 
     class Meta:
         model = Dataset
@@ -23,16 +31,28 @@ class DatasetDetailSerializer(serializers.ModelSerializer):
             "created_at",
             "updated_at",
             "items_count",
+            "captioned_count",
+            "masked_count",
+            "total_bytes",
+            "version",
+            "pending_hashes",
         )
 
 
+    def get_pending_hashes(self, obj) -> int:
+        return obj.items.filter(sha256="").count()
+
+
 class DatasetItemListSerializer(serializers.ModelSerializer):
-    caption = serializers.CharField(source="caption_path", allow_blank=True)
+    caption = serializers.CharField(source="caption_text", allow_blank=True)
+    title = serializers.CharField(source="caption_title", allow_blank=True)
+    tags = serializers.ListField(source="caption_tags", child=serializers.CharField())
     image_url = serializers.SerializerMethodField()
     thumb_url = serializers.SerializerMethodField()
     has_mask = serializers.SerializerMethodField()
     mask_path = serializers.SerializerMethodField()
     mask_url = serializers.SerializerMethodField()
+    hash_pending = serializers.SerializerMethodField()
 
     class Meta:
         model = DatasetItem
@@ -44,10 +64,22 @@ class DatasetItemListSerializer(serializers.ModelSerializer):
             "has_mask",
             "mask_path",
             "mask_url",
+            "mask_coverage",
             "width",
             "height",
+            "ext",
+            "aspect_ratio",
+            "megapixels",
+            "file_size",
+            "bucket",
+            "split",
+            "quick_hash",
             "sha256",
+            "hash_pending",
             "caption",
+            "title",
+            "tags",
+            "caption_path",
             "created_at",
         )
 
@@ -68,15 +100,21 @@ class DatasetItemListSerializer(serializers.ModelSerializer):
     def get_mask_url(self, obj):  # pragma: no cover - trivial
         return f"/api/dataset-items/{obj.id}/mask" if obj.mask_path else None
 
+    def get_hash_pending(self, obj) -> bool:
+        return not obj.sha256
+
 class DatasetItemDetailSerializer(serializers.ModelSerializer):
     """Serializer for a single dataset item."""
 
-    caption = serializers.CharField(source="caption_path", allow_blank=True)
+    caption = serializers.CharField(source="caption_text", allow_blank=True)
+    title = serializers.CharField(source="caption_title", allow_blank=True)
+    tags = serializers.ListField(source="caption_tags", child=serializers.CharField())
     image_url = serializers.SerializerMethodField()
     thumb_url = serializers.SerializerMethodField()
     has_mask = serializers.SerializerMethodField()
     mask_path = serializers.SerializerMethodField()
     mask_url = serializers.SerializerMethodField()
+    hash_pending = serializers.SerializerMethodField()
 
     class Meta:
         model = DatasetItem
@@ -88,10 +126,22 @@ class DatasetItemDetailSerializer(serializers.ModelSerializer):
             "has_mask",
             "mask_path",
             "mask_url",
+            "mask_coverage",
             "width",
             "height",
+            "ext",
+            "aspect_ratio",
+            "megapixels",
+            "file_size",
+            "bucket",
+            "split",
+            "quick_hash",
             "sha256",
+            "hash_pending",
             "caption",
+            "title",
+            "tags",
+            "caption_path",
             "created_at",
         )
 
@@ -111,3 +161,6 @@ class DatasetItemDetailSerializer(serializers.ModelSerializer):
 
     def get_mask_url(self, obj):  # pragma: no cover - trivial
         return f"/api/dataset-items/{obj.id}/mask" if obj.mask_path else None
+
+    def get_hash_pending(self, obj) -> bool:
+        return not obj.sha256
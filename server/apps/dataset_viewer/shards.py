@@ -0,0 +1,422 @@
+"""Packed training exports.
+
+Two formats are written from a dataset, or from a filtered subset of it:
+
+* ``tar`` - WebDataset-style shards ``shard-000000.tar`` holding
+  ``<key>.<ext>``, ``<key>.txt``, ``<key>.json`` and ``<key>.mask.png`` per
+  sample, plus ``index.json`` with the byte offset of every member so a
+  loader can seek straight to one sample.
+* ``memmap`` - one ``<bucket>.npy`` uint8 array of shape ``(n, h, w, 3)`` per
+  bucket, with every image resized and center-cropped to the bucket size
+  (``<bucket>.mask.npy`` holds the masks), loadable with
+  ``np.load(path, mmap_mode="r")``.
+
+Reading and encoding samples runs in a process pool.  Re-exports compare a
+signature built from each sample's sha256, caption and mask, and only
+rewrite the shards or bucket arrays whose contents changed.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import tarfile
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from . import masks
+from .bucketing import assign_dataset_buckets, parse_bucket_label
+from .captions import item_caption
+from .models import Dataset, DatasetItem
+from .utils import parallel_map
+
+EXPORT_FORMATS = ("tar", "memmap")
+INDEX_NAME = "index.json"
+TAR_BLOCK = tarfile.BLOCKSIZE
+
+
+@dataclass(frozen=True)
+class ExportSample:
+    """Everything a worker process needs to encode one item."""
+
+    key: str
+    item_id: int
+    image_path: str
+    image_abs: str
+    ext: str
+    sha256: str
+    width: int | None
+    height: int | None
+    bucket: str
+    title: str
+    caption: str
+    tags: tuple[str, ...]
+    mask_abs: str | None
+    mask_stamp: str
+    # Compact mask (``masks.py``), used instead of ``mask_abs`` when set.
+    mask_rle: bytes = b""
+
+    def signature(self) -> str:
+        return json.dumps(
+            [
+                self.key,
+                self.image_path,
+                self.sha256,
+                self.title,
+                self.caption,
+                list(self.tags),
+                self.mask_stamp,
+            ]
+        )
+
+    def meta(self) -> dict:
+        return {
+            "item_id": self.item_id,
+            "filename": self.image_path,
+            "width": self.width,
+            "height": self.height,
+            "bucket": self.bucket,
+            "title": self.title,
+            "caption": self.caption,
+            "tags": list(self.tags),
+        }
+
+
+def _file_stamp(path: str | Path) -> str:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def default_export_dir(dataset: Dataset, fmt: str) -> Path:
+    return Path(settings.EXPORTS_ROOT) / str(dataset.id) / fmt
+
+
+def collect_samples(dataset: Dataset, qs=None) -> list[ExportSample]:
+    if qs is None:
+        qs = DatasetItem.objects.filter(dataset=dataset)
+    root = Path(dataset.root_dir)
+    samples: list[ExportSample] = []
+    for item in qs.order_by("id").iterator(chunk_size=2000):
+        image_abs = root / item.image_path
+        meta = item_caption(item, root)
+        mask_abs = str(root / item.mask_path) if item.mask_path and not item.mask_rle else None
+        if item.mask_rle:
+            mask_stamp = "rle:" + sha256(item.mask_rle).hexdigest()[:32]
+        else:
+            mask_stamp = _file_stamp(mask_abs) if mask_abs else ""
+        samples.append(
+            ExportSample(
+                key=f"{item.id:09d}",
+                item_id=item.id,
+                image_path=item.image_path,
+                image_abs=str(image_abs),
+                ext=item.ext or image_abs.suffix.lower().lstrip("."),
+                sha256=item.sha256 or _file_stamp(image_abs),
+                width=item.width,
+                height=item.height,
+                bucket=item.bucket,
+                title=meta.get("title", ""),
+                caption=meta.get("caption", ""),
+                tags=tuple(meta.get("tags", [])),
+                mask_abs=mask_abs,
+                mask_stamp=mask_stamp,
+                mask_rle=bytes(item.mask_rle),
+            )
+        )
+    return samples
+
+
+def _group_signature(samples: list[ExportSample]) -> str:
+    h = sha256()
+    for sample in samples:
+        h.update(sample.signature().encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _load_index(out_dir: Path, fmt: str) -> dict:
+    try:
+        with open(out_dir / INDEX_NAME, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return index if index.get("format") == fmt else {}
+
+
+def _write_index(out_dir: Path, index: dict) -> None:
+    tmp = out_dir / (INDEX_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp, out_dir / INDEX_NAME)
+
+
+# === Tar shards ===
+
+
+def load_tar_members(sample: ExportSample) -> list[tuple[str, bytes]]:
+    """Read the members of one sample; runs in a worker process."""
+
+    try:
+        with open(sample.image_abs, "rb") as f:
+            image = f.read()
+    except OSError:
+        return []
+    members = [
+        (f"{sample.key}.{sample.ext}", image),
+        (f"{sample.key}.txt", sample.caption.encode("utf-8")),
+        (f"{sample.key}.json", json.dumps(sample.meta(), ensure_ascii=False).encode("utf-8")),
+    ]
+    if sample.mask_rle:
+        members.append((f"{sample.key}.mask.png", masks.to_png(sample.mask_rle)))
+    elif sample.mask_abs:
+        try:
+            with open(sample.mask_abs, "rb") as f:
+                members.append((f"{sample.key}.mask.png", f.read()))
+        except OSError:
+            pass
+    return members
+
+
+def _write_tar_shard(path: Path, samples, payloads) -> tuple[list[dict], int]:
+    entries: list[dict] = []
+    tmp = path.with_name(path.name + ".tmp")
+    with tarfile.open(tmp, "w", format=tarfile.USTAR_FORMAT) as tar:
+        for sample, members in zip(samples, payloads):
+            if not members:
+                continue
+            offsets = {}
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+                padded = -(-len(data) // TAR_BLOCK) * TAR_BLOCK
+                offsets[name[len(sample.key) + 1 :]] = [tar.offset - padded, len(data)]
+            entries.append(
+                {"key": sample.key, "item_id": sample.item_id, "members": offsets}
+            )
+    os.replace(tmp, path)
+    return entries, path.stat().st_size
+
+
+def export_tar_shards(
+    dataset: Dataset,
+    out_dir: Path,
+    shard_size: int = 1000,
+    workers: int = 1,
+    qs=None,
+) -> dict:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    samples = collect_samples(dataset, qs)
+    previous = _load_index(out_dir, "tar")
+    prev_shards = {s["name"]: s for s in previous.get("shards", [])}
+
+    shards: list[dict] = []
+    written = reused = missing = 0
+    with parallel_map(workers) as pmap:
+        for n, start in enumerate(range(0, len(samples), shard_size)):
+            group = samples[start : start + shard_size]
+            name = f"shard-{n:06d}.tar"
+            signature = _group_signature(group)
+            prev = prev_shards.get(name)
+            if (
+                prev
+                and prev.get("signature") == signature
+                and prev.get("shard_size") == shard_size
+                and (out_dir / name).is_file()
+            ):
+                shards.append(prev)
+                reused += 1
+                continue
+            entries, size = _write_tar_shard(
+                out_dir / name, group, pmap(load_tar_members, group)
+            )
+            missing += len(group) - len(entries)
+            shards.append(
+                {
+                    "name": name,
+                    "signature": signature,
+                    "shard_size": shard_size,
+                    "count": len(entries),
+                    "bytes": size,
+                    "samples": entries,
+                }
+            )
+            written += 1
+
+    keep = {s["name"] for s in shards}
+    for stale in out_dir.glob("shard-*.tar"):
+        if stale.name not in keep:
+            stale.unlink()
+
+    _write_index(
+        out_dir,
+        {"format": "tar", "dataset_id": dataset.id, "shards": shards},
+    )
+    return {
+        "format": "tar",
+        "out_dir": str(out_dir),
+        "samples": sum(s["count"] for s in shards),
+        "shards": len(shards),
+        "written": written,
+        "reused": reused,
+        "missing": missing,
+    }
+
+
+# === Memory-mapped bucket arrays ===
+
+
+def render_bucket_sample(args) -> tuple[bytes | None, bytes | None]:
+    """Resize and center-crop one sample to its bucket; runs in a worker."""
+
+    sample, (width, height) = args
+    try:
+        with Image.open(sample.image_abs) as img:
+            image = ImageOps.fit(img.convert("RGB"), (width, height), Image.LANCZOS)
+            pixels = image.tobytes()
+    except Exception:
+        return None, None
+    mask = None
+    if sample.mask_rle:
+        img = Image.fromarray(masks.decode(sample.mask_rle), "L")
+        mask = ImageOps.fit(img, (width, height), Image.NEAREST).tobytes()
+    elif sample.mask_abs:
+        try:
+            with Image.open(sample.mask_abs) as img:
+                mask = ImageOps.fit(img.convert("L"), (width, height), Image.NEAREST).tobytes()
+        except Exception:
+            mask = None
+    return pixels, mask
+
+
+def _write_bucket_arrays(out_dir: Path, label: str, size, samples, payloads) -> dict:
+    width, height = size
+    has_masks = any(s.mask_abs or s.mask_rle for s in samples)
+    image_path = out_dir / f"{label}.npy"
+    mask_path = out_dir / f"{label}.mask.npy"
+    image_tmp = out_dir / f"{label}.npy.tmp"
+    mask_tmp = out_dir / f"{label}.mask.npy.tmp"
+    images = np.lib.format.open_memmap(
+        image_tmp, mode="w+", dtype=np.uint8, shape=(len(samples), height, width, 3)
+    )
+    masks = None
+    if has_masks:
+        masks = np.lib.format.open_memmap(
+            mask_tmp, mode="w+", dtype=np.uint8, shape=(len(samples), height, width)
+        )
+    rows: list[dict] = []
+    for row, (sample, (pixels, mask)) in enumerate(zip(samples, payloads)):
+        ok = pixels is not None
+        if ok:
+            images[row] = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3)
+        if masks is not None and mask is not None:
+            masks[row] = np.frombuffer(mask, dtype=np.uint8).reshape(height, width)
+        rows.append(
+            {"key": sample.key, "item_id": sample.item_id, "row": row, "ok": ok}
+        )
+    images.flush()
+    del images
+    os.replace(image_tmp, image_path)
+    if masks is not None:
+        masks.flush()
+        del masks
+        os.replace(mask_tmp, mask_path)
+    elif mask_path.exists():
+        mask_path.unlink()
+    return {
+        "file": image_path.name,
+        "mask_file": mask_path.name if has_masks else None,
+        "samples": rows,
+    }
+
+
+def export_memmap(dataset: Dataset, out_dir: Path, workers: int = 1, qs=None) -> dict:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    assign_dataset_buckets(dataset)
+    samples = [s for s in collect_samples(dataset, qs) if s.bucket]
+    by_bucket: dict[str, list[ExportSample]] = {}
+    for sample in samples:
+        by_bucket.setdefault(sample.bucket, []).append(sample)
+
+    previous = _load_index(out_dir, "memmap")
+    prev_buckets = {b["bucket"]: b for b in previous.get("buckets", [])}
+    buckets: list[dict] = []
+    written = reused = missing = 0
+    with parallel_map(workers, chunksize=2) as pmap:
+        for label in sorted(by_bucket):
+            group = by_bucket[label]
+            size = parse_bucket_label(label)
+            signature = _group_signature(group)
+            prev = prev_buckets.get(label)
+            if (
+                prev
+                and prev.get("signature") == signature
+                and (out_dir / prev["file"]).is_file()
+            ):
+                buckets.append(prev)
+                reused += 1
+                continue
+            entry = _write_bucket_arrays(
+                out_dir,
+                label,
+                size,
+                group,
+                pmap(render_bucket_sample, [(s, size) for s in group]),
+            )
+            missing += sum(1 for r in entry["samples"] if not r["ok"])
+            buckets.append(
+                {
+                    "bucket": label,
+                    "width": size[0],
+                    "height": size[1],
+                    "count": len(group),
+                    "signature": signature,
+                    **entry,
+                }
+            )
+            written += 1
+
+    keep = {b["bucket"] for b in buckets}
+    for label in set(prev_buckets) - keep:
+        for name in (f"{label}.npy", f"{label}.mask.npy"):
+            (out_dir / name).unlink(missing_ok=True)
+
+    _write_index(
+        out_dir,
+        {"format": "memmap", "dataset_id": dataset.id, "buckets": buckets},
+    )
+    return {
+        "format": "memmap",
+        "out_dir": str(out_dir),
+        "samples": sum(b["count"] for b in buckets),
+        "buckets": len(buckets),
+        "written": written,
+        "reused": reused,
+        "missing": missing,
+    }
+
+
+def export_packed(
+    dataset: Dataset,
+    fmt: str,
+    out_dir: str | Path | None = None,
+    shard_size: int = 1000,
+    workers: int = 1,
+    qs=None,
+) -> dict:
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {list(EXPORT_FORMATS)}")
+    target = Path(out_dir) if out_dir else default_export_dir(dataset, fmt)
+    if fmt == "tar":
+        return export_tar_shards(dataset, target, shard_size, workers, qs)
+    return export_memmap(dataset, target, workers, qs)
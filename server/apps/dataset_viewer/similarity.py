@@ -0,0 +1,301 @@
+"""Content similarity search over per-item feature vectors.
+
+Every probed image gets a small descriptor (:func:`image_features`): a
+4x4x4 RGB histogram (Hellinger-normalized) and a 4x4 grid of 4-bin
+gradient orientation histograms, each part L2-normalized, 128 float16
+values in all.  It is computed on the CPU from a 32x32 downscale of the
+image, so no model or GPU is needed, and stored in ``DatasetItem.features``.
+
+For search the vectors of a dataset are copied into one contiguous
+``N x DIM`` float16 matrix under ``<root>/.cache/features`` and memory
+mapped; queries are scored against it block by block with a running
+top-K.  Datasets of ``IVF_MIN`` items or more are also clustered with
+spherical k-means and their rows stored grouped by cluster, so a query
+only scores the ``nprobe`` clusters closest to it (IVF).
+
+The matrix is rebuilt when ``Dataset.features_version`` moves, which
+:func:`bump_features` does in every write that stores new vectors.
+Deletions do not bump it: rows of deleted items are skipped when results
+are read back.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from django.db.models import F
+from PIL import Image
+
+from .models import Dataset, DatasetItem
+
+SIDE = 32
+COLOR_LEVELS = 4
+GRID = 4
+ORIENTATIONS = 4
+DIM = COLOR_LEVELS**3 + GRID * GRID * ORIENTATIONS
+BLOCK = 65536
+IVF_MIN = 20000
+IVF_MAX_LISTS = 1024
+IVF_ITERATIONS = 8
+DEFAULT_NPROBE = 8
+MAX_K = 200
+MAX_QUERIES = 100
+FETCH = 2000
+
+_GRAY = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+_cell = np.arange(SIDE) * GRID // SIDE
+_CELLS = (_cell[:, None] * GRID + _cell[None, :]) * ORIENTATIONS
+
+
+def image_features(path: str | Path) -> bytes:
+    """Descriptor of the image at ``path`` as float16 bytes, ``b""`` if unreadable."""
+
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (SIDE * 2, SIDE * 2))
+            rgb = np.asarray(
+                img.convert("RGB").resize((SIDE, SIDE), Image.BILINEAR), dtype=np.float32
+            )
+    except Exception:
+        return b""
+
+    levels = (rgb * (COLOR_LEVELS / 256)).astype(np.intp)
+    bins = (levels[..., 0] * COLOR_LEVELS + levels[..., 1]) * COLOR_LEVELS + levels[..., 2]
+    color = np.bincount(bins.ravel(), minlength=COLOR_LEVELS**3).astype(np.float32)
+    color = np.sqrt(color / color.sum())
+
+    gray = rgb @ _GRAY
+    gx = np.zeros_like(gray)
+    gy = np.zeros_like(gray)
+    gx[:, 1:-1] = gray[:, 2:] - gray[:, :-2]
+    gy[1:-1, :] = gray[2:, :] - gray[:-2, :]
+    angle = np.mod(np.arctan2(gy, gx), np.pi)
+    orient = np.minimum((angle * (ORIENTATIONS / np.pi)).astype(np.intp), ORIENTATIONS - 1)
+    grad = np.bincount(
+        (_CELLS + orient).ravel(),
+        weights=np.hypot(gx, gy).ravel(),
+        minlength=GRID * GRID * ORIENTATIONS,
+    ).astype(np.float32)
+    norm = np.linalg.norm(grad)
+    if norm:
+        grad /= norm
+
+    return (np.concatenate([color, grad]) / np.sqrt(2)).astype(np.float16).tobytes()
+
+
+def as_vector(raw) -> np.ndarray | None:
+    if not raw or len(raw) != DIM * 2:
+        return None
+    return np.frombuffer(bytes(raw), dtype=np.float16).astype(np.float32)
+
+
+def bump_features(dataset_id: int) -> None:
+    """Mark the search matrix of the dataset stale; call in the write that stored vectors."""
+
+    Dataset.objects.filter(id=dataset_id).update(features_version=F("features_version") + 1)
+
+
+@dataclass
+class FeatureIndex:
+    version: int
+    ids: np.ndarray  # int64 item id per row, grouped by list with IVF
+    vectors: np.ndarray  # float16 (rows, DIM), memory mapped
+    centroids: np.ndarray | None = None  # float32 (lists, DIM)
+    offsets: np.ndarray | None = None  # row range of list i is offsets[i]:offsets[i + 1]
+
+    @property
+    def lists(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+
+
+def index_dir(dataset: Dataset) -> Path:
+    return Path(dataset.root_dir) / ".cache" / "features"
+
+
+def _kmeans(sample: np.ndarray, lists: int, rng: np.random.Generator) -> np.ndarray:
+    """Spherical k-means: centroids are kept unit length, assignment by dot product."""
+
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(IVF_ITERATIONS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        filled = norms[:, 0] > 0
+        centroids[filled] = sums[filled] / norms[filled]
+    return centroids
+
+
+def _write_array(path: Path, array: np.ndarray) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def build_index(dataset: Dataset) -> FeatureIndex:
+    """Copy the vectors of ``dataset`` into a fresh matrix file and return it."""
+
+    version = Dataset.objects.filter(id=dataset.id).values_list("features_version", flat=True)[0]
+    ids = np.array(
+        DatasetItem.objects.filter(dataset=dataset)
+        .exclude(features=b"")
+        .order_by("id")
+        .values_list("id", flat=True),
+        dtype=np.int64,
+    )
+    folder = index_dir(dataset)
+    folder.mkdir(parents=True, exist_ok=True)
+    stem = f"v{version}"
+    raw_path = folder / f"{stem}.{os.getpid()}.raw"
+    raw = np.lib.format.open_memmap(raw_path, mode="w+", dtype=np.float16, shape=(len(ids), DIM))
+    for start in range(0, len(ids), FETCH):
+        chunk = ids[start : start + FETCH]
+        rows = dict(DatasetItem.objects.filter(id__in=chunk.tolist()).values_list("id", "features"))
+        for offset, item_id in enumerate(chunk.tolist()):
+            vector = as_vector(rows.get(item_id))
+            if vector is None:
+                ids[start + offset] = -1  # deleted or cleared meanwhile
+            else:
+                raw[start + offset] = vector
+
+    meta = {"version": version, "dim": DIM, "rows": len(ids), "lists": 0}
+    if len(ids) >= IVF_MIN:
+        rng = np.random.default_rng(dataset.id)
+        lists = min(IVF_MAX_LISTS, int(np.sqrt(len(ids))))
+        sample_rows = np.sort(rng.choice(len(ids), min(len(ids), lists * 64), replace=False))
+        centroids = _kmeans(np.asarray(raw[sample_rows], dtype=np.float32), lists, rng)
+        assign = np.empty(len(ids), dtype=np.int32)
+        for start in range(0, len(ids), BLOCK):
+            block = np.asarray(raw[start : start + BLOCK], dtype=np.float32)
+            assign[start : start + BLOCK] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        vectors = np.lib.format.open_memmap(
+            folder / f"{stem}.{os.getpid()}.tmp", mode="w+", dtype=np.float16, shape=raw.shape
+        )
+        for start in range(0, len(ids), BLOCK):
+            vectors[start : start + BLOCK] = raw[order[start : start + BLOCK]]
+        vectors.flush()
+        del vectors, raw
+        os.replace(folder / f"{stem}.{os.getpid()}.tmp", folder / f"{stem}.vectors.npy")
+        raw_path.unlink(missing_ok=True)
+        ids = ids[order]
+        offsets = np.searchsorted(assign[order], np.arange(lists + 1)).astype(np.int64)
+        _write_array(folder / f"{stem}.centroids.npy", centroids)
+        _write_array(folder / f"{stem}.offsets.npy", offsets)
+        meta["lists"] = lists
+    else:
+        raw.flush()
+        del raw
+        os.replace(raw_path, folder / f"{stem}.vectors.npy")
+    _write_array(folder / f"{stem}.ids.npy", ids)
+
+    tmp = folder / f"meta.json.{os.getpid()}.tmp"
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, folder / "meta.json")
+    for old in folder.iterdir():
+        if old.name.startswith("v") and not old.name.startswith(stem + "."):
+            try:
+                old.unlink()
+            except OSError:
+                pass  # still mapped by another process (Windows); next build retries
+    return load_index(dataset, version)
+
+
+def load_index(dataset: Dataset, version: int) -> FeatureIndex | None:
+    """Map the matrix files of ``dataset`` if they were built for ``version``."""
+
+    folder = index_dir(dataset)
+    try:
+        meta = json.loads((folder / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("version") != version or meta.get("dim") != DIM:
+            return None
+        stem = f"v{version}"
+        index = FeatureIndex(
+            version=version,
+            ids=np.load(folder / f"{stem}.ids.npy"),
+            vectors=np.load(folder / f"{stem}.vectors.npy", mmap_mode="r"),
+        )
+        if meta.get("lists"):
+            index.centroids = np.load(folder / f"{stem}.centroids.npy")
+            index.offsets = np.load(folder / f"{stem}.offsets.npy")
+    except (OSError, ValueError, KeyError):
+        return None
+    return index
+
+
+_indexes: dict[int, FeatureIndex] = {}
+_build_lock = threading.Lock()
+
+
+def get_index(dataset: Dataset) -> FeatureIndex:
+    """Current matrix of ``dataset``: cached, mapped from disk or rebuilt."""
+
+    version = Dataset.objects.filter(id=dataset.id).values_list("features_version", flat=True)[0]
+    index = _indexes.get(dataset.id)
+    if index is not None and index.version == version:
+        return index
+    with _build_lock:
+        index = _indexes.get(dataset.id)
+        if index is None or index.version != version:
+            index = load_index(dataset, version) or build_index(dataset)
+            _indexes[dataset.id] = index
+    return index
+
+
+def _top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Best ``k`` columns of each row of ``scores`` (q x n), sorted by score.
+
+    ``ids`` is either one row shared by all queries or q x n.
+    """
+
+    ids = np.broadcast_to(ids, scores.shape)
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def search(
+    index: FeatureIndex, queries: np.ndarray, k: int, nprobe: int | None = DEFAULT_NPROBE
+) -> list[list[tuple[int, float]]]:
+    """Top ``k`` ``(item id, cosine)`` per row of ``queries`` (float32, q x DIM).
+
+    With an IVF index and ``nprobe`` only that many nearest clusters are
+    scored per query; ``nprobe=None`` forces an exact scan.
+    """
+
+    queries = np.asarray(queries, dtype=np.float32)
+    if not len(index.ids) or not len(queries):
+        return [[] for _ in range(len(queries))]
+
+    if index.lists and nprobe:
+        results = []
+        nearest = np.argsort(-(queries @ index.centroids.T), axis=1)[:, :nprobe]
+        for query, lists in zip(queries, nearest):
+            rows = np.concatenate(
+                [np.arange(index.offsets[i], index.offsets[i + 1]) for i in sorted(lists)]
+            )
+            scores = np.asarray(index.vectors[rows], dtype=np.float32) @ query
+            top_scores, top_ids = _top_k(scores[None, :], index.ids[rows], k)
+            results.append(list(zip(top_ids[0].tolist(), top_scores[0].tolist())))
+        return results
+
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    best_ids = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(index.ids), BLOCK):
+        block = np.asarray(index.vectors[start : start + BLOCK], dtype=np.float32)
+        scores, ids = _top_k(queries @ block.T, index.ids[start : start + BLOCK], k)
+        best_scores, best_ids = _top_k(
+            np.concatenate([best_scores, scores], axis=1),
+            np.concatenate([best_ids, ids], axis=1),
+            k,
+        )
+    return [list(zip(ids.tolist(), scores.tolist())) for ids, scores in zip(best_ids, best_scores)]
@@ -7,8 +7,15 @@
 
   if (!drop || !choose || !input || !queueEl) return;
 
-  const MAX_PARALLEL = 3;
+  // Файлы грузятся чанками через /uploads (см. uploads.py): до FILE_PARALLEL
+  // файлов одновременно, у каждого до CHUNK_PARALLEL чанков в полёте.
+  const FILE_PARALLEL = 3;
+  const CHUNK_PARALLEL = 3;
+  const CHUNK_RETRIES = 5;
   const accept = ['image/jpeg','image/png','image/webp'];
+  const base = `/api/datasets/${dsId}/uploads`;
+  // localStorage: файл -> {sid, index}, чтобы продолжить после перезагрузки страницы.
+  const storePrefix = `fluxlab-upload:${dsId}:`;
 
   function getCookie(name) {
     const m = document.cookie.match('(^|;)\\s*' + name + '\\s*=\\s*([^;]+)');
@@ -38,16 +45,141 @@
     enqueueFiles(files);
   });
 
-  function enqueueFiles(files) {
-    const filtered = files.filter(f => accept.includes(f.type || ''));
-    filtered.forEach(file => {
-      const item = makeItem(file);
+  async function api(method, url, body, signal) {
+    const headers = { 'X-CSRFToken': csrftoken || '' };
+    const init = { method, headers, signal, credentials: 'same-origin' };
+    if (body instanceof Blob) {
+      headers['Content-Type'] = 'application/octet-stream';
+      init.body = body;
+    } else if (body !== undefined) {
+      headers['Content-Type'] = 'application/json';
+      init.body = JSON.stringify(body);
+    }
+    const resp = await fetch(url, init);
+    if (!resp.ok) {
+      const err = new Error(`HTTP ${resp.status}`);
+      err.status = resp.status;
+      throw err;
+    }
+    return resp.status === 204 ? null : resp.json();
+  }
+
+  function fileKey(file) {
+    return storePrefix + [file.name, file.size, file.lastModified].join(':');
+  }
+
+  function remember(item) {
+    try {
+      localStorage.setItem(fileKey(item.file), JSON.stringify({ sid: item.batch.session.id, index: item.index }));
+    } catch {}
+  }
+
+  function forget(item) {
+    try { localStorage.removeItem(fileKey(item.file)); } catch {}
+  }
+
+  async function enqueueFiles(files) {
+    const items = files.filter(f => accept.includes(f.type || '')).map(makeItem);
+    items.forEach(item => queueEl.appendChild(item.el));
+    if (!items.length) return;
+
+    // Файлы с незаконченной сессией продолжают её, остальные получают новую.
+    const resumed = new Map();
+    const fresh = [];
+    for (const item of items) {
+      let saved = null;
+      try { saved = JSON.parse(localStorage.getItem(fileKey(item.file)) || 'null'); } catch {}
+      if (saved && !resumed.has(saved.sid)) {
+        resumed.set(saved.sid, { session: await api('GET', `${base}/${saved.sid}`).catch(() => null), items: [] });
+      }
+      const group = saved && resumed.get(saved.sid);
+      const entry = group && group.session && group.session.files[saved.index];
+      if (entry && entry.name === item.file.name && entry.size === item.file.size) {
+        item.index = saved.index;
+        item.received = new Set(entry.received);
+        group.items.push(item);
+      } else {
+        forget(item);
+        fresh.push(item);
+      }
+    }
+    for (const { session, items: group } of resumed.values()) {
+      if (session && group.length) startBatch(session, group);
+    }
+    if (fresh.length) await createBatch(fresh);
+  }
+
+  async function createBatch(items) {
+    items.forEach(item => item.setStatus('Подготовка…'));
+    let session;
+    try {
+      session = await api('POST', base, {
+        files: items.map(item => ({ name: item.file.name, size: item.file.size })),
+      });
+    } catch (e) {
+      items.forEach(item => item.fail(`Ошибка: ${e.status || 'сеть'}`));
+      return;
+    }
+    items.forEach((item, i) => { item.index = i; item.received = new Set(); });
+    startBatch(session, items);
+  }
+
+  function startBatch(session, items) {
+    const batch = { session, items, finalized: false };
+    items.forEach(item => {
+      item.batch = batch;
+      if (item.state === 'canceled') return;  // отменён, пока создавалась сессия
+      item.state = 'pending';
+      remember(item);
+      item.setStatus(item.received.size ? 'Продолжение…' : 'В очереди…');
       state.pending.push(item);
-      queueEl.appendChild(item.el);
     });
     pump();
   }
 
+  // Когда все файлы партии дошли (или отменены), они регистрируются одним запросом.
+  async function checkBatch(batch) {
+    if (batch.finalized || batch.items.some(i => i.state === 'pending' || i.state === 'active')) return;
+    const complete = batch.items.filter(i => i.state === 'complete');
+    if (!complete.length) {
+      if (batch.items.every(i => i.state === 'canceled')) {
+        batch.finalized = true;
+        api('DELETE', `${base}/${batch.session.id}`).catch(() => {});
+      }
+      return;
+    }
+    batch.finalized = true;
+    complete.forEach(item => item.setStatus('Регистрация…'));
+    try {
+      const result = await api('POST', `${base}/${batch.session.id}/finalize`, {
+        files: complete.map(item => item.index),
+      });
+      complete.forEach(item => { forget(item); item.succeed(); });
+      if (result.skipped) console.info(`upload: skipped ${result.skipped} duplicate or unreadable files`);
+      // сообщим grid перезагрузиться
+      if (typeof window.__reloadGrid === 'function') window.__reloadGrid();
+    } catch (e) {
+      batch.finalized = false;
+      complete.forEach(item => item.fail(`Ошибка регистрации: ${e.status || 'сеть'}`));
+    }
+  }
+
+  function sleep(ms) { return new Promise(resolve => setTimeout(resolve, ms)); }
+
+  async function putChunk(item, chunk, signal) {
+    const size = item.batch.session.chunk_size;
+    const url = `${base}/${item.batch.session.id}/files/${item.index}?offset=${chunk * size}`;
+    for (let attempt = 0; ; attempt++) {
+      try {
+        return await api('PUT', url, item.file.slice(chunk * size, (chunk + 1) * size), signal);
+      } catch (e) {
+        const retryable = !e.status || e.status >= 500 || e.status === 408 || e.status === 429;
+        if (signal.aborted || !retryable || attempt >= CHUNK_RETRIES) throw e;
+        await sleep(500 * 2 ** attempt);
+      }
+    }
+  }
+
   function makeItem(file) {
     const el = document.createElement('div');
     el.className = 'u-item';
@@ -68,80 +200,112 @@
     const btnCancel = el.querySelector('.u-cancel');
     const btnRetry = el.querySelector('.u-retry');
 
-    let xhr = null;
-    let canceled = false;
+    const item = {
+      el, file,
+      state: 'new',
+      batch: null,
+      index: 0,
+      received: new Set(),
+      controller: null,
+      setStatus(text) { status.textContent = text; },
+      fail(text) {
+        item.state = 'error';
+        status.textContent = text;
+        el.classList.add('error');
+        btnRetry.style.display = '';
+      },
+      succeed() {
+        item.state = 'done';
+        bar.style.width = '100%';
+        status.textContent = 'Готово';
+        el.classList.add('success');
+        btnCancel.style.display = 'none';
+      },
+      upload,
+    };
+
+    function progress() {
+      const chunks = Math.max(1, Math.ceil(file.size / item.batch.session.chunk_size));
+      const pct = Math.round((item.received.size / chunks) * 100);
+      bar.style.width = pct + '%';
+      status.textContent = `Загрузка… ${pct}%`;
+    }
 
-    function upload() {
-      status.textContent = 'Подготовка…';
+    async function upload() {
+      item.state = 'active';
       el.classList.remove('success','error');
       btnRetry.style.display = 'none';
       btnCancel.style.display = '';
+      const controller = item.controller = new AbortController();
+      const chunks = Math.ceil(file.size / item.batch.session.chunk_size);
+      const todo = [];
+      for (let i = 0; i < chunks; i++) if (!item.received.has(i)) todo.push(i);
+      progress();
 
-      const form = new FormData();
-      form.append('files', file); // сервер должен принимать files[]
-
-      xhr = new XMLHttpRequest();
-      xhr.open('POST', `/api/datasets/${dsId}/upload`);
-      xhr.setRequestHeader('X-CSRFToken', csrftoken || '');
-      xhr.upload.onprogress = (e) => {
-        if (!e.lengthComputable) return;
-        const pct = Math.round((e.loaded / e.total) * 100);
-        bar.style.width = pct + '%';
-        status.textContent = `Загрузка… ${pct}%`;
-      };
-      xhr.onreadystatechange = () => {
-        if (xhr.readyState !== 4) return;
-        if (xhr.status >= 200 && xhr.status < 300) {
-          bar.style.width = '100%';
-          status.textContent = 'Готово';
-          el.classList.add('success');
-          btnCancel.style.display = 'none';
-          // сообщим grid перезагрузиться
-          if (typeof window.__reloadGrid === 'function') window.__reloadGrid();
-        } else {
-          status.textContent = `Ошибка: ${xhr.status}`;
-          el.classList.add('error');
-          btnRetry.style.display = '';
+      async function worker() {
+        while (todo.length && !controller.signal.aborted) {
+          const chunk = todo.shift();
+          await putChunk(item, chunk, controller.signal);
+          item.received.add(chunk);
+          progress();
         }
-        state.active--;
-        pump();
-      };
-      xhr.onerror = () => {
-        status.textContent = 'Ошибка сети';
-        el.classList.add('error');
-        btnRetry.style.display = '';
-        state.active--;
-        pump();
-      };
-      xhr.send(form);
+      }
+      try {
+        await Promise.all(Array.from({ length: Math.min(CHUNK_PARALLEL, todo.length) }, worker));
+        if (controller.signal.aborted) return;
+        item.state = 'complete';
+        status.textContent = 'Загружено, ожидание партии…';
+      } catch (e) {
+        if (controller.signal.aborted) return;
+        if (e.status === 404) forget(item);  // сессия удалена: повтор начнёт новую
+        item.fail(e.status ? `Ошибка: ${e.status}` : 'Ошибка сети');
+      } finally {
+        if (item.controller === controller) {
+          state.active--;
+          pump();
+          checkBatch(item.batch);
+        }
+      }
     }
 
     btnCancel.addEventListener('click', () => {
-      canceled = true;
-      try { xhr && xhr.abort(); } catch {}
+      const wasActive = item.state === 'active';
+      item.state = 'canceled';
+      if (item.controller) { item.controller.abort(); item.controller = null; }
+      forget(item);
       status.textContent = 'Отменено';
       el.classList.add('error');
       btnCancel.style.display = 'none';
+      btnRetry.style.display = 'none';
       // Если был в активе — освободим слот
-      if (state.active > 0) { state.active--; pump(); }
+      if (wasActive) { state.active--; pump(); }
+      if (item.batch) checkBatch(item.batch);
     });
 
     btnRetry.addEventListener('click', () => {
-      canceled = false;
       bar.style.width = '0%';
       status.textContent = 'Повтор…';
       el.classList.remove('error');
-      state.pending.push({ el, file, upload, canceled });
+      btnRetry.style.display = 'none';
+      let stored = null;
+      try { stored = localStorage.getItem(fileKey(file)); } catch {}
+      if (!item.batch || item.batch.finalized || !stored) {
+        // Партия уже зарегистрирована или сессия пропала — новая сессия.
+        createBatch([item]);
+        return;
+      }
+      item.state = 'pending';
+      state.pending.push(item);
       pump();
     });
 
-    return { el, file, upload, get canceled(){return canceled;} };
+    return item;
   }
 
   function pump() {
-    while (state.active < MAX_PARALLEL && state.pending.length) {
+    while (state.active < FILE_PARALLEL && state.pending.length) {
       const next = state.pending.shift();
-      if (next.canceled) continue;
+      if (next.state !== 'pending') continue;
       state.active++;
       next.upload();
     }
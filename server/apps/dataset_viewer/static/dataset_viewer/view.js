@@ -10,6 +10,7 @@
   const meta = document.getElementById('ds-meta');
   const form = document.getElementById('filters-form');
   const resetBtn = document.getElementById('reset-btn');
+  const deleteSelectedBtn = document.getElementById('delete-selected-btn');
 
     // Modal elements
   const modal = document.getElementById('itemModal');
@@ -25,6 +26,44 @@
   let items = [];
   let currentIndex = 0;
   let modalOpen = false;
+  // id -> detail; the whole page is fetched with one batch request.
+  let details = new Map();
+  const selected = new Set();
+  const batchUrl = `/api/datasets/${dsId}/items/batch`;
+
+  async function loadDetails(id) {
+    if (!details.has(id)) {
+      const ids = items.map(it => it.id).filter(i => !details.has(i));
+      const r = await fetch(`${batchUrl}?ids=${ids.join(',')}`);
+      const data = await r.json();
+      (data.results || []).forEach(d => details.set(d.id, d));
+    }
+    return details.get(id);
+  }
+
+  async function deleteItems(ids) {
+    const r = await fetch(batchUrl, {
+      method: 'DELETE',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ ids }),
+    });
+    if (!r.ok) return 0;
+    const data = await r.json();
+    ids.forEach(id => {
+      const card = grid.querySelector(`.card[data-id="${id}"]`);
+      card && card.remove();
+      selected.delete(id);
+      details.delete(id);
+    });
+    items = items.filter(it => !ids.includes(it.id));
+    const m = meta.textContent.match(/элементов: (\d+)/);
+    if (m) {
+      const newCount = Math.max(0, parseInt(m[1]) - data.deleted);
+      meta.textContent = meta.textContent.replace(/элементов: \d+/, `элементов: ${newCount}`);
+    }
+    deleteSelectedBtn.disabled = selected.size === 0;
+    return data.deleted;
+  }
 
   function closeModal() {
     modal.hidden = true;
@@ -43,8 +82,7 @@
     modalImg.src = '';
     metaId.textContent = metaSize.textContent = metaPath.textContent = metaSha.textContent = '';
     try {
-      const r = await fetch(`/api/datasets/${dsId}/items/${item.id}/`);
-      const data = await r.json();
+      const data = (await loadDetails(item.id)) || item;
       modalImg.src = data.image_url || item.image_url;
       metaId.textContent = data.id;
       metaSize.textContent = `${data.width} × ${data.height}`;
@@ -94,6 +132,9 @@
     const data = await r.json();
 
     items = data.results || [];
+    details = new Map();
+    selected.clear();
+    deleteSelectedBtn.disabled = true;
     items.forEach(item => {
       const node = tpl.content.cloneNode(true);
       const img = node.querySelector('.thumb');
@@ -102,6 +143,7 @@
       const copyBtn = node.querySelector('.copy-btn');
       const openBtn = node.querySelector('.open-btn');
       const card = node.querySelector('.card');
+      const selectBox = node.querySelector('.select-box');
 
       img.src = item.thumb_url || item.image_url;
       img.alt = item.image_path;
@@ -112,6 +154,10 @@
       openBtn.href = item.image_url;
       openBtn.addEventListener('click', e => e.stopPropagation());
       card.dataset.id = item.id;
+      selectBox.addEventListener('change', () => {
+        selectBox.checked ? selected.add(item.id) : selected.delete(item.id);
+        deleteSelectedBtn.disabled = selected.size === 0;
+      });
       card.querySelector('.thumb-wrap').addEventListener('click', () => openModalById(item.id));
 
       grid.appendChild(node);
@@ -168,16 +214,7 @@
   deleteBtn.addEventListener('click', async () => {
     if (!confirm('Удалить этот элемент?')) return;
     const item = items[currentIndex];
-    const r = await fetch(`/api/datasets/${dsId}/items/${item.id}/`, { method: 'DELETE' });
-    if (r.ok) {
-      const card = grid.querySelector(`.card[data-id="${item.id}"]`);
-      card && card.remove();
-      const m = meta.textContent.match(/элементов: (\d+)/);
-      if (m) {
-        const newCount = Math.max(0, parseInt(m[1]) - 1);
-        meta.textContent = meta.textContent.replace(/элементов: \d+/, `элементов: ${newCount}`);
-      }
-      items.splice(currentIndex, 1);
+    if (await deleteItems([item.id])) {
       closeModal();
       if (items.length === 0) {
         load();
@@ -187,6 +224,12 @@
     }
   });
 
+  deleteSelectedBtn.addEventListener('click', async () => {
+    if (!selected.size || !confirm(`Удалить выбранные элементы (${selected.size})?`)) return;
+    await deleteItems([...selected]);
+    if (items.length === 0) load();
+  });
+
   // Инициал
   if (!qs.get('page')) { qs.set('page', '1'); history.replaceState({}, '', `?${qs.toString()}`); }
   load();
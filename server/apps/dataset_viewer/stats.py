@@ -0,0 +1,215 @@
+"""Denormalized per-dataset aggregates.
+
+The counters and histograms stored on :class:`Dataset` are kept in sync by
+every write path (scan, upload, import, mask edits, deletes) through
+:func:`record_added`, :func:`record_removed` and :func:`record_changed`, so
+listing datasets never has to join or count ``DatasetItem`` rows.
+:func:`recompute_stats` rebuilds them from scratch when they drift.
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Iterable, NamedTuple
+
+from django.db import transaction
+from django.db.models import Avg, Count, F, Q, Value
+from django.db.models.functions import Greatest
+
+from .models import Dataset, DatasetItem
+
+# Width/height histograms are bucketed by this many pixels.
+HIST_BIN = 256
+# Mask coverage histogram bins over [0, 1].
+COVERAGE_BINS = 10
+
+
+def hist_bin(value: int | None) -> str | None:
+    if not value:
+        return None
+    return str((value // HIST_BIN) * HIST_BIN)
+
+
+class ItemStats(NamedTuple):
+    """The fields of an item that contribute to dataset aggregates."""
+
+    has_caption: bool
+    has_mask: bool
+    file_size: int
+    width: int | None
+    height: int | None
+
+    @classmethod
+    def of(cls, item) -> "ItemStats":
+        return cls(
+            bool(item.has_caption),
+            bool(item.mask_path),
+            item.file_size or 0,
+            item.width,
+            item.height,
+        )
+
+
+@dataclass
+class StatsDelta:
+    items: int = 0
+    captioned: int = 0
+    masked: int = 0
+    bytes: int = 0
+    width_hist: Counter = field(default_factory=Counter)
+    height_hist: Counter = field(default_factory=Counter)
+
+    def add(self, stats: ItemStats, sign: int = 1) -> None:
+        self.items += sign
+        self.captioned += sign * stats.has_caption
+        self.masked += sign * stats.has_mask
+        self.bytes += sign * stats.file_size
+        w_bin, h_bin = hist_bin(stats.width), hist_bin(stats.height)
+        if w_bin:
+            self.width_hist[w_bin] += sign
+        if h_bin:
+            self.height_hist[h_bin] += sign
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.items
+            or self.captioned
+            or self.masked
+            or self.bytes
+            or any(self.width_hist.values())
+            or any(self.height_hist.values())
+        )
+
+
+def _merge_hist(current: dict, delta: Counter) -> dict:
+    merged = Counter({k: int(v) for k, v in (current or {}).items()})
+    merged.update(delta)
+    return {k: v for k, v in sorted(merged.items(), key=lambda kv: int(kv[0])) if v > 0}
+
+
+def bump_version(dataset_id: int) -> None:
+    Dataset.objects.filter(id=dataset_id).update(version=F("version") + 1)
+
+
+def apply_delta(dataset_id: int, delta: StatsDelta) -> None:
+    """Apply ``delta`` to the stored aggregates of a dataset.
+
+    Every write batch ends here, so this also bumps the dataset version,
+    even when the aggregates do not change (e.g. a rename).
+    """
+
+    if not delta:
+        bump_version(dataset_id)
+        return
+    with transaction.atomic():
+        hists = (
+            Dataset.objects.select_for_update()
+            .filter(id=dataset_id)
+            .values("width_hist", "height_hist")
+            .first()
+        )
+        if hists is None:
+            return
+        # Clamp at zero: rows created behind our back (admin, shell) must
+        # not make a later delete violate the unsigned columns.
+        Dataset.objects.filter(id=dataset_id).update(
+            items_count=Greatest(F("items_count") + delta.items, Value(0)),
+            captioned_count=Greatest(F("captioned_count") + delta.captioned, Value(0)),
+            masked_count=Greatest(F("masked_count") + delta.masked, Value(0)),
+            total_bytes=Greatest(F("total_bytes") + delta.bytes, Value(0)),
+            width_hist=_merge_hist(hists["width_hist"], delta.width_hist),
+            height_hist=_merge_hist(hists["height_hist"], delta.height_hist),
+            version=F("version") + 1,
+        )
+
+
+def record_added(dataset_id: int, items: Iterable) -> None:
+    delta = StatsDelta()
+    for item in items:
+        delta.add(ItemStats.of(item))
+    apply_delta(dataset_id, delta)
+
+
+def record_removed(dataset_id: int, items: Iterable) -> None:
+    delta = StatsDelta()
+    for item in items:
+        delta.add(ItemStats.of(item), -1)
+    apply_delta(dataset_id, delta)
+
+
+def record_changed(dataset_id: int, before: ItemStats, item) -> None:
+    """Record an in-place update of ``item`` whose old state was ``before``."""
+
+    delta = StatsDelta()
+    delta.add(before, -1)
+    delta.add(ItemStats.of(item))
+    apply_delta(dataset_id, delta)
+
+
+def recompute_stats(dataset: Dataset) -> Dataset:
+    """Rebuild the aggregates of ``dataset`` from its items."""
+
+    delta = StatsDelta()
+    rows = (
+        DatasetItem.objects.filter(dataset=dataset)
+        .values_list("has_caption", "mask_path", "file_size", "width", "height")
+        .iterator(chunk_size=2000)
+    )
+    for has_caption, mask_path, file_size, width, height in rows:
+        delta.add(ItemStats(has_caption, bool(mask_path), file_size, width, height))
+    dataset.items_count = delta.items
+    dataset.captioned_count = delta.captioned
+    dataset.masked_count = delta.masked
+    dataset.total_bytes = delta.bytes
+    dataset.width_hist = _merge_hist({}, delta.width_hist)
+    dataset.height_hist = _merge_hist({}, delta.height_hist)
+    Dataset.objects.filter(id=dataset.id).update(
+        items_count=dataset.items_count,
+        captioned_count=dataset.captioned_count,
+        masked_count=dataset.masked_count,
+        total_bytes=dataset.total_bytes,
+        width_hist=dataset.width_hist,
+        height_hist=dataset.height_hist,
+        version=F("version") + 1,
+    )
+    dataset.refresh_from_db(fields=["version"])
+    return dataset
+
+
+def mask_coverage_stats(dataset: Dataset) -> dict:
+    """Count, mean and histogram of the coverage of compact masks.
+
+    Aggregated on request rather than kept in the counters: only masks
+    stored in the database (``masks.py``) have a coverage.
+    """
+
+    qs = DatasetItem.objects.filter(dataset=dataset, mask_coverage__isnull=False)
+    bins = {
+        str(i): Count(
+            "id",
+            filter=Q(mask_coverage__gte=i / COVERAGE_BINS)
+            & (Q(mask_coverage__lt=(i + 1) / COVERAGE_BINS) if i < COVERAGE_BINS - 1 else Q()),
+        )
+        for i in range(COVERAGE_BINS)
+    }
+    row = qs.aggregate(measured=Count("id"), mean=Avg("mask_coverage"), **bins)
+    return {
+        "measured": row["measured"],
+        "mean": row["mean"],
+        "hist": [row[str(i)] for i in range(COVERAGE_BINS)],
+    }
+
+
+def stats_payload(dataset: Dataset) -> dict:
+    return {
+        "dataset_id": dataset.id,
+        "items_count": dataset.items_count,
+        "captioned_count": dataset.captioned_count,
+        "masked_count": dataset.masked_count,
+        "total_bytes": dataset.total_bytes,
+        "hist_bin": HIST_BIN,
+        "width_hist": dataset.width_hist,
+        "height_hist": dataset.height_hist,
+        "mask_coverage": mask_coverage_stats(dataset),
+    }
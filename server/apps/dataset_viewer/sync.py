@@ -0,0 +1,382 @@
+"""Incremental filesystem sync of dataset roots.
+
+Each dataset keeps a snapshot of the files under ``<root>/images``
+(:class:`FileSnapshot`: path -> size, mtime, inode, quick hash, sha256).  A sync pass
+walks the tree once, diffs it against the snapshot and applies only the
+delta to ``DatasetItem`` and the derived caches:
+
+* added    - new path, probed and registered;
+* modified - size or mtime changed, re-probed;
+* removed  - path gone, item and its thumbnail deleted;
+* renamed  - a removed path whose content reappears under a new path,
+  matched by inode+size or by quick hash (sha256 for snapshot rows from
+  before quick hashes); the item is moved, not recreated.
+
+Unchanged files cost one ``stat`` from the directory walk and are never
+opened.
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from .bucketing import assign_dataset_buckets
+from .captions import is_sidecar_name, keep_db_caption, reconcile_captions
+from .hashing import full_sha256, keep_full_hash, quick_fingerprint
+from .ingest import is_image_name, probe_entry
+from .masks import keep_compact_mask
+from .models import Dataset, DatasetItem, FileSnapshot
+from .similarity import bump_features
+from .stats import ItemStats, StatsDelta, apply_delta
+from .tags import retag_items, untag_items
+from .utils import (
+    derived_image_fields,
+    parallel_map,
+    thumbnail_path_for,
+)
+from .writequeue import run_write
+
+BATCH = 500
+
+
+@dataclass(frozen=True)
+class FileState:
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+@dataclass
+class SyncDiff:
+    added: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    renamed: list[tuple[str, str]] = field(default_factory=list)
+    # Paths already registered as items (e.g. by an older scan) whose
+    # snapshot row is simply missing.
+    adopted: list[str] = field(default_factory=list)
+    # path -> (quick hash, sha256) known for renamed and added paths.
+    hashes: dict[str, tuple[str, str]] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(
+            self.added or self.modified or self.removed or self.renamed or self.adopted
+        )
+
+
+def walk_images(
+    root_dir: str | Path, sidecars: dict[str, int] | None = None
+) -> dict[str, FileState]:
+    """Single ``scandir`` walk of ``<root>/images``; returns rel path -> state.
+
+    When ``sidecars`` is given it is filled with rel path -> mtime_ns of the
+    caption sidecars met on the way.
+    """
+
+    root = str(root_dir)
+    result: dict[str, FileState] = {}
+    stack = [os.path.join(root, "images")]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    if not is_image_name(entry.name):
+                        if sidecars is not None and is_sidecar_name(entry.name):
+                            rel = os.path.relpath(entry.path, root).replace("\\", "/")
+                            sidecars[rel] = entry.stat().st_mtime_ns
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                rel = os.path.relpath(entry.path, root).replace("\\", "/")
+                result[rel] = FileState(st.st_size, st.st_mtime_ns, st.st_ino)
+    return result
+
+
+def _chunks(seq, size=BATCH):
+    seq = list(seq)
+    for start in range(0, len(seq), size):
+        yield seq[start : start + size]
+
+
+def compute_diff(dataset: Dataset, current: dict[str, FileState], pmap=map) -> SyncDiff:
+    snapshot = {
+        row[0]: row
+        for row in FileSnapshot.objects.filter(dataset=dataset).values_list(
+            "path", "size", "mtime_ns", "inode", "quick_hash", "sha256"
+        )
+    }
+    diff = SyncDiff()
+    new_paths = [p for p in current if p not in snapshot]
+    gone = {p: snapshot[p] for p in snapshot if p not in current}
+    for path, state in current.items():
+        row = snapshot.get(path)
+        if row and (row[1], row[2]) != (state.size, state.mtime_ns):
+            diff.modified.append(path)
+
+    # Files registered before the snapshot existed.
+    known: dict[str, int] = {}
+    for chunk in _chunks(new_paths):
+        known.update(
+            DatasetItem.objects.filter(dataset=dataset, image_path__in=chunk).values_list(
+                "image_path", "file_size"
+            )
+        )
+    candidates: list[str] = []
+    for path in new_paths:
+        if path in known:
+            if known[path] == current[path].size:
+                diff.adopted.append(path)
+            else:
+                diff.modified.append(path)
+        else:
+            candidates.append(path)
+
+    # Renames: same inode and size first, then same content.
+    by_inode = {(row[3], row[1]): path for path, row in gone.items() if row[3]}
+    unmatched: list[str] = []
+    for path in candidates:
+        state = current[path]
+        old = by_inode.pop((state.inode, state.size), None)
+        if old and old in gone:
+            diff.renamed.append((old, path))
+            row = gone.pop(old)
+            diff.hashes[path] = (row[4], row[5])
+        else:
+            unmatched.append(path)
+
+    by_quick: dict[str, list[str]] = {}
+    by_sha: dict[str, list[str]] = {}
+    for path, row in gone.items():
+        if row[4]:
+            by_quick.setdefault(row[4], []).append(path)
+        elif row[5]:
+            by_sha.setdefault(row[5], []).append(path)
+    root = dataset.root_dir
+    quicks = pmap(quick_fingerprint, [os.path.join(root, p) for p in unmatched])
+    legacy: list[str] = []
+    legacy_sizes = {gone[p][1] for olds in by_sha.values() for p in olds}
+    for path, quick in zip(unmatched, quicks):
+        olds = by_quick.get(quick) if quick else None
+        if olds:
+            old = olds.pop()
+            diff.hashes[path] = (quick, gone.pop(old)[5])
+            diff.renamed.append((old, path))
+        elif current[path].size in legacy_sizes:
+            diff.hashes[path] = (quick, "")
+            legacy.append(path)
+        else:
+            diff.hashes[path] = (quick, "")
+            diff.added.append(path)
+
+    # Gone rows without a quick hash can only be matched by full content.
+    shas = pmap(full_sha256, [os.path.join(root, p) for p in legacy])
+    for path, sha in zip(legacy, shas):
+        olds = by_sha.get(sha) if sha else None
+        if olds:
+            old = olds.pop()
+            gone.pop(old, None)
+            diff.renamed.append((old, path))
+        else:
+            diff.added.append(path)
+        diff.hashes[path] = (diff.hashes[path][0], sha)
+
+    removed = set(gone)
+    if not snapshot:
+        # First pass: items whose file vanished before we ever saw it.
+        removed.update(
+            path
+            for path in DatasetItem.objects.filter(dataset=dataset)
+            .values_list("image_path", flat=True)
+            .iterator(chunk_size=2000)
+            if path not in current
+        )
+    diff.removed = sorted(removed)
+    return diff
+
+
+def drop_thumbnail(dataset_id: int, rel_path: str) -> None:
+    try:
+        thumbnail_path_for(dataset_id, rel_path).unlink()
+    except OSError:
+        pass
+
+
+def _move_thumbnail(dataset_id: int, old: str, new: str) -> None:
+    src = thumbnail_path_for(dataset_id, old)
+    if not src.exists():
+        return
+    dst = thumbnail_path_for(dataset_id, new)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(src, dst)
+    except OSError:
+        drop_thumbnail(dataset_id, old)
+
+
+def apply_diff(
+    dataset: Dataset, diff: SyncDiff, current: dict[str, FileState], pmap=map
+) -> dict:
+    root = dataset.root_dir
+    # Probe outside the transaction so the write lock is held briefly.
+    probed_modified = list(pmap(probe_entry, [(root, p) for p in diff.modified]))
+    probed_added = list(
+        pmap(probe_entry, [(root, p, diff.hashes.get(p, ("", ""))[0]) for p in diff.added])
+    )
+    delta = StatsDelta()
+    skipped = 0
+    snapshots: dict[str, tuple[str, str]] = {}  # path -> (quick hash, sha256) to (re)write
+
+    def write() -> list[DatasetItem]:
+        nonlocal skipped
+        for old, new in diff.renamed:
+            item = (
+                DatasetItem.objects.filter(dataset=dataset, image_path=old)
+                .defer("mask_rle")
+                .first()
+            )
+            if item is not None:
+                item.image_path = new
+                item.ext = derived_image_fields(new, item.width, item.height)["ext"]
+                item.save(update_fields=["image_path", "ext"])
+                _move_thumbnail(dataset.id, old, new)
+            quick, sha = diff.hashes.get(new, ("", ""))
+            if item is not None:
+                quick, sha = quick or item.quick_hash, sha or item.sha256
+            snapshots[new] = (quick, sha)
+        for chunk in _chunks(old for old, _ in diff.renamed):
+            FileSnapshot.objects.filter(dataset=dataset, path__in=chunk).delete()
+
+        for chunk in _chunks(diff.removed):
+            items = list(
+                DatasetItem.objects.filter(dataset=dataset, image_path__in=chunk).defer(
+                    "mask_rle"
+                )
+            )
+            for item in items:
+                delta.add(ItemStats.of(item), -1)
+                drop_thumbnail(dataset.id, item.image_path)
+            untag_items([i.id for i in items])
+            DatasetItem.objects.filter(id__in=[i.id for i in items]).delete()
+            FileSnapshot.objects.filter(dataset=dataset, path__in=chunk).delete()
+
+        for path, fields in zip(diff.modified, probed_modified):
+            item = DatasetItem.objects.filter(dataset=dataset, image_path=path).first()
+            drop_thumbnail(dataset.id, path)
+            if fields is None:
+                if item is not None:
+                    delta.add(ItemStats.of(item), -1)
+                    untag_items([item.id])
+                    item.delete()
+                skipped += 1
+                snapshots[path] = ("", "")
+                continue
+            fields = keep_full_hash(item, keep_db_caption(item, fields))
+            fields = keep_compact_mask(item, fields)
+            snapshots[path] = (fields["quick_hash"], fields["sha256"])
+            if item is None:
+                item = DatasetItem.objects.create(dataset=dataset, image_path=path, **fields)
+                delta.add(ItemStats.of(item))
+            else:
+                delta.add(ItemStats.of(item), -1)
+                for name, value in fields.items():
+                    setattr(item, name, value)
+                item.bucket = ""
+                item.save(update_fields=[*fields, "bucket"])
+                delta.add(ItemStats.of(item))
+            retag_items(dataset.id, [item])
+
+        new_items: list[DatasetItem] = []
+        for path, fields in zip(diff.added, probed_added):
+            snapshots[path] = diff.hashes.get(path, ("", ""))
+            if fields is None:
+                skipped += 1
+                continue
+            if snapshots[path][1]:
+                fields["sha256"] = snapshots[path][1]
+            new_items.append(DatasetItem(dataset=dataset, image_path=path, **fields))
+        DatasetItem.objects.bulk_create(new_items, batch_size=BATCH)
+        retag_items(dataset.id, new_items)
+        for item in new_items:
+            delta.add(ItemStats.of(item))
+
+        if diff.adopted:
+            for chunk in _chunks(diff.adopted):
+                for path, quick, sha in DatasetItem.objects.filter(
+                    dataset=dataset, image_path__in=chunk
+                ).values_list("image_path", "quick_hash", "sha256"):
+                    snapshots[path] = (quick, sha)
+
+        rows = [
+            FileSnapshot(
+                dataset=dataset,
+                path=path,
+                size=current[path].size,
+                mtime_ns=current[path].mtime_ns,
+                inode=current[path].inode,
+                quick_hash=quick,
+                sha256=sha,
+            )
+            for path, (quick, sha) in snapshots.items()
+        ]
+        FileSnapshot.objects.bulk_create(
+            rows,
+            batch_size=BATCH,
+            update_conflicts=True,
+            unique_fields=["dataset", "path"],
+            update_fields=["size", "mtime_ns", "inode", "quick_hash", "sha256"],
+        )
+        if new_items or diff.modified:
+            bump_features(dataset.id)
+        apply_delta(dataset.id, delta)
+        return new_items
+
+    new_items = run_write(write)
+    if new_items or diff.modified:
+        assign_dataset_buckets(dataset)
+    return {
+        "added": len(new_items),
+        "modified": len(diff.modified),
+        "removed": len(diff.removed),
+        "renamed": len(diff.renamed),
+        "adopted": len(diff.adopted),
+        "skipped": skipped,
+    }
+
+
+def sync_dataset(dataset: Dataset, workers: int = 1) -> dict:
+    """Run one sync pass over ``dataset`` and return per-kind counts.
+
+    Caption sidecars edited on disk are reconciled in the same pass.
+
+    ``workers`` processes fingerprint and probe the changed files; their full
+    hashes are left to ``hashing.fill_pending_hashes``.
+    """
+
+    if not os.path.isdir(dataset.root_dir):
+        raise FileNotFoundError(dataset.root_dir)
+    sidecars: dict[str, int] = {}
+    current = walk_images(dataset.root_dir, sidecars)
+    with parallel_map(workers) as pmap:
+        diff = compute_diff(dataset, current, pmap)
+        if not diff:
+            result = dict.fromkeys(
+                ("added", "modified", "removed", "renamed", "adopted", "skipped"), 0
+            )
+        else:
+            result = apply_diff(dataset, diff, current, pmap)
+    result["captions"] = reconcile_captions(dataset, sidecars)
+    result["files"] = len(current)
+    return result
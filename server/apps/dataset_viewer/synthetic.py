@@ -0,0 +1,107 @@
+"""Synthetic datasets for benchmarks and load tests.
+
+:func:`generate_dataset` writes ``n`` images under ``<root>/images`` in a
+mix of formats and sizes (sizes around the training buckets plus some
+odd ones), caption sidecars in both JSON and plain text, and masks under
+``<root>/masks`` for part of the items.  Everything is derived from
+``seed``, so two runs with the same arguments produce the same tree.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+FORMATS = (("jpg", "JPEG"), ("png", "PNG"), ("webp", "WEBP"))
+SIZES = (
+    (1024, 1024),
+    (1216, 832),
+    (832, 1216),
+    (1344, 768),
+    (768, 1344),
+    (640, 480),
+    (1920, 1080),
+    (512, 512),
+)
+TAGS = (
+    "portrait", "landscape", "red", "blue", "green", "night", "day", "close-up",
+    "outdoor", "indoor", "smile", "hat", "city", "forest", "sea", "studio",
+)  # fmt: skip
+WORDS = ("a", "photo", "of", "woman", "man", "dog", "cat", "street", "with", "light", "the")
+
+
+def _pixels(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    """Smooth gradient plus noise: compresses like a photo, unlike pure noise."""
+
+    base = rng.integers(0, 256, 3)
+    ramp_x = np.linspace(0, rng.integers(32, 128), width, dtype=np.float32)
+    ramp_y = np.linspace(0, rng.integers(32, 128), height, dtype=np.float32)
+    image = base + ramp_x[None, :, None] + ramp_y[:, None, None]
+    image = image + rng.normal(0, 6, (height, width, 1))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def synthetic_image(seed: int, width: int, height: int) -> Image.Image:
+    return Image.fromarray(_pixels(np.random.default_rng(seed), width, height))
+
+
+def generate_dataset(
+    root: str | Path,
+    n: int,
+    seed: int = 0,
+    scale: float = 1.0,
+    caption_ratio: float = 0.8,
+    mask_ratio: float = 0.3,
+    subdirs: int = 4,
+    progress=None,
+) -> dict:
+    """Write a synthetic dataset of ``n`` images to ``root``; return counts.
+
+    ``scale`` shrinks (or grows) every image size, e.g. ``0.25`` for quick
+    runs where decode cost should not dominate.
+    """
+
+    root = Path(root)
+    rng = random.Random(seed)
+    counts = {"images": 0, "captions": 0, "masks": 0, "bytes": 0}
+    for i in range(n):
+        ext, fmt = FORMATS[i % len(FORMATS)]
+        width, height = rng.choice(SIZES)
+        width, height = max(8, int(width * scale)), max(8, int(height * scale))
+        folder = root / "images" / f"part{i % subdirs:02d}" if subdirs else root / "images"
+        folder.mkdir(parents=True, exist_ok=True)
+        stem = f"img{i:07d}"
+        path = folder / f"{stem}.{ext}"
+        synthetic_image(seed * 1_000_003 + i, width, height).save(path, fmt, quality=90)
+        counts["images"] += 1
+        counts["bytes"] += path.stat().st_size
+
+        if rng.random() < caption_ratio:
+            caption = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 16)))
+            if rng.random() < 0.5:
+                sidecar = {
+                    "title": stem,
+                    "caption": caption,
+                    "tags": rng.sample(TAGS, rng.randint(1, 5)),
+                }
+                (folder / f"{stem}.json").write_text(json.dumps(sidecar), encoding="utf-8")
+            else:
+                (folder / f"{stem}.txt").write_text(caption, encoding="utf-8")
+            counts["captions"] += 1
+
+        if rng.random() < mask_ratio:
+            masks = root / "masks"
+            masks.mkdir(parents=True, exist_ok=True)
+            mask = np.zeros((height, width), dtype=np.uint8)
+            x0, y0 = rng.randrange(width // 2), rng.randrange(height // 2)
+            mask[y0 : y0 + height // 2, x0 : x0 + width // 2] = 255
+            Image.fromarray(mask, "L").save(masks / f"{stem}.png")
+            counts["masks"] += 1
+
+        if progress:
+            progress(i + 1, n)
+    return counts
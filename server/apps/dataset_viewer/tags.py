@@ -0,0 +1,192 @@
+"""Normalized tag index over the caption tags of dataset items.
+
+``Tag`` holds one row per distinct (normalized) tag of a dataset with its
+item count, ``ItemTag`` joins tags to items.  Both are maintained
+incrementally by every write path that changes ``caption_tags``
+(:func:`retag_items`) or deletes items (:func:`untag_items`), inside the
+same transaction, so frequencies, co-occurrence and tag filters are plain
+index lookups.
+"""
+
+from __future__ import annotations
+
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from django.db.models import Count, F, QuerySet, Value
+from django.db.models.functions import Greatest
+
+from .models import Dataset, DatasetItem, ItemTag, Tag
+
+BATCH = 500
+
+
+def normalize_tag(name: str) -> str:
+    return " ".join(str(name).lower().split())[:255]
+
+
+def parse_tag_list(raw: str | None) -> list[str]:
+    if not raw:
+        return []
+    return [t for t in (normalize_tag(part) for part in raw.split(",")) if t]
+
+
+def _chunks(seq, size=BATCH):
+    seq = list(seq)
+    for start in range(0, len(seq), size):
+        yield seq[start : start + size]
+
+
+def _apply_counts(delta: Counter) -> None:
+    by_amount: dict[int, list[int]] = defaultdict(list)
+    for tag_id, amount in delta.items():
+        if amount:
+            by_amount[amount].append(tag_id)
+    for amount, tag_ids in by_amount.items():
+        for chunk in _chunks(tag_ids):
+            Tag.objects.filter(id__in=chunk).update(
+                count=Greatest(F("count") + amount, Value(0))
+            )
+
+
+def _tag_ids(dataset_id: int, names: set[str]) -> dict[str, int]:
+    ids: dict[str, int] = {}
+    for chunk in _chunks(sorted(names)):
+        ids.update(
+            Tag.objects.filter(dataset_id=dataset_id, name__in=chunk).values_list("name", "id")
+        )
+    missing = names - ids.keys()
+    if missing:
+        Tag.objects.bulk_create(
+            [Tag(dataset_id=dataset_id, name=name) for name in missing],
+            batch_size=BATCH,
+            ignore_conflicts=True,
+        )
+        for chunk in _chunks(sorted(missing)):
+            ids.update(
+                Tag.objects.filter(dataset_id=dataset_id, name__in=chunk).values_list(
+                    "name", "id"
+                )
+            )
+    return ids
+
+
+def retag_items(dataset_id: int, items: Iterable) -> None:
+    """Make the ``ItemTag`` rows of ``items`` match their ``caption_tags``.
+
+    Call inside the transaction that saved the items.
+    """
+
+    wanted: dict[int, set[str]] = {}
+    for item in items:
+        names = {normalize_tag(t) for t in (item.caption_tags or [])}
+        wanted[item.id] = {n for n in names if n}
+    if not wanted:
+        return
+    tag_ids = _tag_ids(dataset_id, set().union(*wanted.values()))
+
+    existing: dict[int, dict[int, int]] = defaultdict(dict)  # item -> tag -> row id
+    for chunk in _chunks(wanted):
+        for row_id, item_id, tag_id in ItemTag.objects.filter(item_id__in=chunk).values_list(
+            "id", "item_id", "tag_id"
+        ):
+            existing[item_id][tag_id] = row_id
+
+    delta: Counter = Counter()
+    to_delete: list[int] = []
+    to_create: list[ItemTag] = []
+    for item_id, names in wanted.items():
+        target = {tag_ids[n] for n in names}
+        current = existing.get(item_id, {})
+        for tag_id, row_id in current.items():
+            if tag_id not in target:
+                to_delete.append(row_id)
+                delta[tag_id] -= 1
+        for tag_id in target - current.keys():
+            to_create.append(ItemTag(item_id=item_id, tag_id=tag_id))
+            delta[tag_id] += 1
+
+    for chunk in _chunks(to_delete):
+        ItemTag.objects.filter(id__in=chunk).delete()
+    ItemTag.objects.bulk_create(to_create, batch_size=BATCH)
+    _apply_counts(delta)
+
+
+def untag_items(item_ids: Iterable[int]) -> None:
+    """Drop the tags of items about to be deleted (call before deleting them)."""
+
+    delta: Counter = Counter()
+    for chunk in _chunks(item_ids):
+        rows = list(ItemTag.objects.filter(item_id__in=chunk).values_list("id", "tag_id"))
+        for _, tag_id in rows:
+            delta[tag_id] -= 1
+        for ids in _chunks([row_id for row_id, _ in rows]):
+            ItemTag.objects.filter(id__in=ids).delete()
+    _apply_counts(delta)
+
+
+def tag_counts(dataset: Dataset, prefix: str = "", limit: int = 100, offset: int = 0) -> dict:
+    qs = Tag.objects.filter(dataset=dataset, count__gt=0)
+    if prefix:
+        qs = qs.filter(name__startswith=normalize_tag(prefix))
+    rows = qs.order_by("-count", "name").values("name", "count")[offset : offset + limit]
+    return {"total": qs.count(), "results": list(rows)}
+
+
+def cooccurrence(dataset: Dataset, name: str, k: int = 20) -> dict:
+    """Top ``k`` tags on the items tagged ``name``, with their share of them."""
+
+    tag = Tag.objects.filter(dataset=dataset, name=normalize_tag(name)).first()
+    if tag is None or not tag.count:
+        return {"tag": normalize_tag(name), "count": 0, "results": []}
+    items = ItemTag.objects.filter(tag=tag).values("item_id")
+    rows = (
+        ItemTag.objects.filter(item_id__in=items)
+        .exclude(tag=tag)
+        .values("tag__name", "tag__count")
+        .annotate(n=Count("id"))
+        .order_by("-n", "tag__name")[:k]
+    )
+    return {
+        "tag": tag.name,
+        "count": tag.count,
+        "results": [
+            {
+                "name": row["tag__name"],
+                "count": row["n"],
+                "share": round(row["n"] / tag.count, 4),
+                "tag_count": row["tag__count"],
+            }
+            for row in rows
+        ],
+    }
+
+
+def filter_by_tags(qs: QuerySet, all_of: list[str], any_of: list[str], none_of: list[str]):
+    """Restrict items to those with every tag of ``all_of``, one of ``any_of``
+    and none of ``none_of`` (normalized names)."""
+
+    for name in all_of:
+        qs = qs.filter(id__in=ItemTag.objects.filter(tag__name=name).values("item_id"))
+    if any_of:
+        qs = qs.filter(id__in=ItemTag.objects.filter(tag__name__in=any_of).values("item_id"))
+    if none_of:
+        qs = qs.exclude(id__in=ItemTag.objects.filter(tag__name__in=none_of).values("item_id"))
+    return qs
+
+
+def rebuild_tags(dataset: Dataset) -> int:
+    """Rebuild the index of ``dataset`` from ``caption_tags``; returns tag count."""
+
+    ItemTag.objects.filter(item__dataset=dataset).delete()
+    Tag.objects.filter(dataset=dataset).delete()
+    qs = DatasetItem.objects.filter(dataset=dataset).only("id", "caption_tags")
+    batch = []
+    for item in qs.iterator(chunk_size=2000):
+        if item.caption_tags:
+            batch.append(item)
+        if len(batch) >= BATCH:
+            retag_items(dataset.id, batch)
+            batch = []
+    retag_items(dataset.id, batch)
+    return Tag.objects.filter(dataset=dataset).count()
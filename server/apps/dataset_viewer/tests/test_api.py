@@ -1,11 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from rest_framework.test import APIClient
+from dataset_viewer.captions import flush_captions
 from dataset_viewer.models import Dataset, DatasetItem
 import json
 import tempfile
 from pathlib import Path
 import shutil
 
+@override_settings(BACKGROUND_HASHING=False)
 class DatasetAPITests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -127,8 +129,350 @@ class DatasetAPITests(TestCase):
         item = DatasetItem.objects.get(dataset=ds2, image_path="images/1.jpg")
         self.assertEqual(item.caption_path, "images/1.json")
         self.assertEqual(item.mask_path, "images/1.mask.png")
+        self.assertEqual((item.caption_title, item.caption_text), ("t1", "c1"))
+        self.assertTrue(item.caption_dirty)
+        detail = self.client.get(f"/api/datasets/{ds2.id}/items/{item.id}/").json()
+        self.assertEqual((detail["caption"], detail["tags"]), ("c1", ["a"]))
+
+        # Sidecars are written back lazily.
         caption_file = Path(root2, "images/1.json")
+        self.assertFalse(caption_file.exists())
+        self.assertEqual(flush_captions(ds2), 2)
         self.assertTrue(caption_file.is_file())
         content = json.loads(caption_file.read_text(encoding="utf-8"))
         self.assertEqual(content["caption"], "c1")
-        self.assertEqual(content["title"], "t1")
\ No newline at end of file
+        self.assertEqual(content["title"], "t1")
+
+    def _make_scan_root(self, sizes):
+        from PIL import Image
+
+        root = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(root, ignore_errors=True))
+        images = Path(root, "images")
+        images.mkdir(parents=True, exist_ok=True)
+        for i, (w, h) in enumerate(sizes):
+            Image.new("RGB", (w, h), (i, 0, 0)).save(images / f"{i}.png")
+        return root
+
+    def test_scan_maintains_dataset_stats(self):
+        root = self._make_scan_root([(300, 200), (600, 520), (10, 10)])
+        Path(root, "images", "0.txt").write_text("cap", encoding="utf-8")
+        resp = self.client.post(
+            "/api/datasets/scan", {"name": "stats", "root_dir": root}, format="json"
+        )
+        self.assertEqual(resp.status_code, 200)
+        ds = Dataset.objects.get(name="stats")
+
+        listed = self.client.get("/api/datasets/").json()[0]
+        self.assertEqual(listed["items_count"], 3)
+        self.assertEqual(listed["captioned_count"], 1)
+        self.assertGreater(listed["total_bytes"], 0)
+
+        stats = self.client.get(f"/api/datasets/{ds.id}/stats").json()
+        self.assertEqual(stats["width_hist"], {"0": 1, "256": 1, "512": 1})
+        self.assertEqual(stats["height_hist"], {"0": 2, "512": 1})
+
+        # Re-scanning an unchanged tree must not double count.
+        self.client.post(
+            "/api/datasets/scan", {"name": "stats", "root_dir": root}, format="json"
+        )
+        item = DatasetItem.objects.get(dataset=ds, image_path="images/2.png")
+        self.client.delete(f"/api/datasets/{ds.id}/items/{item.id}/")
+
+        detail = self.client.get(f"/api/datasets/{ds.id}/").json()
+        self.assertEqual(detail["items_count"], 2)
+        stats = self.client.get(f"/api/datasets/{ds.id}/stats").json()
+        self.assertEqual(stats["width_hist"], {"256": 1, "512": 1})
+
+        before = stats
+        rebuilt = self.client.post(f"/api/datasets/{ds.id}/stats").json()
+        self.assertEqual(rebuilt, before)
+
+    def test_items_derived_column_filters(self):
+        from PIL import Image
+
+        root = self._make_scan_root([(1024, 1024), (1216, 832), (832, 1216)])
+        Image.new("RGB", (2048, 1024)).save(Path(root, "images", "wide.jpg"))
+        self.client.post(
+            "/api/datasets/scan", {"name": "derived", "root_dir": root}, format="json"
+        )
+        ds = Dataset.objects.get(name="derived")
+        url = f"/api/datasets/{ds.id}/items"
+
+        jpg = self.client.get(url, {"ext": ".JPG"}).json()
+        self.assertEqual([r["image_path"] for r in jpg["results"]], ["images/wide.jpg"])
+        self.assertEqual(jpg["results"][0]["ext"], "jpg")
+        self.assertEqual(jpg["results"][0]["megapixels"], 2.0972)
+
+        landscape = self.client.get(url, {"min_ar": "1.2", "order_by": "aspect_ratio"})
+        self.assertEqual(
+            [r["image_path"] for r in landscape.json()["results"]],
+            ["images/1.png", "images/wide.jpg"],
+        )
+
+        by_mp = self.client.get(url, {"max_mp": "1.04", "order_by": "megapixels", "order": "desc"})
+        self.assertEqual(by_mp.json()["count"], 2)
+
+        self.assertEqual(self.client.get(url, {"min_ar": "wide"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"order_by": "sha256"}).status_code, 400)
+
+    def test_bucket_assignment_and_histogram(self):
+        root = self._make_scan_root([(1000, 1000), (1300, 860), (700, 1100), (640, 640)])
+        self.client.post(
+            "/api/datasets/scan", {"name": "buckets", "root_dir": root}, format="json"
+        )
+        ds = Dataset.objects.get(name="buckets")
+        self.assertFalse(DatasetItem.objects.filter(dataset=ds, bucket="").exists())
+
+        hist = self.client.get(f"/api/datasets/{ds.id}/buckets").json()
+        counts = {b["bucket"]: b["count"] for b in hist["buckets"] if b["count"]}
+        self.assertEqual(counts, {"1024x1024": 2, "1216x832": 1, "832x1216": 1})
+
+        items = self.client.get(
+            f"/api/datasets/{ds.id}/items", {"bucket": "1024x1024"}
+        ).json()
+        self.assertEqual(items["count"], 2)
+
+        resp = self.client.post(
+            f"/api/datasets/{ds.id}/buckets",
+            {"resolutions": ["512x512", "768x512"]},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["resolutions"], [[512, 512], [768, 512]])
+        self.assertEqual(data["stale"], {})
+        self.assertEqual(
+            {b["bucket"]: b["count"] for b in data["buckets"]},
+            {"512x512": 3, "768x512": 1},
+        )
+
+        bad = self.client.post(
+            f"/api/datasets/{ds.id}/buckets", {"resolutions": ["0x5"]}, format="json"
+        )
+        self.assertEqual(bad.status_code, 400)
+
+        # Only a full pass fixes a bucket that is set but stale.
+        DatasetItem.objects.filter(dataset=ds).update(bucket="1x1")
+        url = f"/api/datasets/{ds.id}/buckets"
+        self.assertEqual(self.client.post(url, {"full": "false"}).json()["assigned"], 0)
+        self.assertEqual(self.client.post(url, {"full": "true"}).json()["assigned"], 4)
+        self.assertEqual(self.client.post(url, {"full": "maybe"}).status_code, 400)
+
+    def test_json_responses_use_version_etags(self):
+        root = self._make_scan_root([(64, 64), (32, 32)])
+        self.client.post(
+            "/api/datasets/scan", {"name": "etag", "root_dir": root}, format="json"
+        )
+        ds = Dataset.objects.get(name="etag")
+        url = f"/api/datasets/{ds.id}/items?sort=width&order=asc"
+
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+        self.assertTrue(etag)
+        # Same query in another parameter order: same cache key.
+        again = self.client.get(
+            f"/api/datasets/{ds.id}/items?order=asc&sort=width", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(again.status_code, 304)
+
+        item_id = first.json()["results"][0]["id"]
+        self.client.delete(f"/api/datasets/{ds.id}/items/{item_id}/")
+        after = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after["ETag"], etag)
+        self.assertEqual(after.json()["count"], 1)
+
+        detail = self.client.get(f"/api/datasets/{ds.id}/")
+        self.assertEqual(detail.json()["items_count"], 1)
+        listed = self.client.get("/api/datasets/")
+        self.assertEqual(
+            self.client.get("/api/datasets/", HTTP_IF_NONE_MATCH=listed["ETag"]).status_code,
+            304,
+        )
+
+    def test_batch_fetch_patch_and_delete(self):
+        from dataset_viewer import batch
+
+        root = self._make_scan_root([(64, 64), (32, 32), (16, 16)])
+        self.client.post(
+            "/api/datasets/scan", {"name": "batch", "root_dir": root}, format="json"
+        )
+        ds = Dataset.objects.get(name="batch")
+        items = DatasetItem.objects.filter(dataset=ds).order_by("image_path")
+        ids = list(items.values_list("id", flat=True))
+        url = f"/api/datasets/{ds.id}/items/batch"
+
+        resp = self.client.get(url, {"ids": f"{ids[2]},{ids[0]},999999"})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual([r["id"] for r in data["results"]], [ids[2], ids[0]])
+        self.assertEqual(data["missing"], [999999])
+
+        resp = self.client.patch(
+            url,
+            {
+                "items": [
+                    {"id": ids[0], "caption_path": "images/0.txt", "mask_path": "masks/0.png"}
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(resp.json(), {"updated": 1, "missing": []})
+        ds.refresh_from_db()
+        self.assertEqual((ds.captioned_count, ds.masked_count), (1, 1))
+        bad = self.client.patch(
+            url, {"items": [{"id": ids[1], "mask_path": "../../etc/passwd"}]}, format="json"
+        )
+        self.assertEqual(bad.status_code, 400)
+
+        resp = self.client.delete(
+            url, {"ids": [ids[0], ids[1]], "delete_files": True}, format="json"
+        )
+        self.assertEqual(resp.json(), {"deleted": 2, "missing": []})
+        batch._cleanup_pool.submit(int).result()
+        self.assertEqual(list(items.values_list("id", flat=True)), [ids[2]])
+        self.assertFalse(Path(root, "images", "0.png").exists())
+        self.assertTrue(Path(root, "images", "2.png").exists())
+        ds.refresh_from_db()
+        self.assertEqual((ds.items_count, ds.captioned_count, ds.masked_count), (1, 0, 0))
+
+    def test_sampling_and_split(self):
+        ds = Dataset.objects.create(name="sample", root_dir="/tmp")
+        DatasetItem.objects.bulk_create(
+            DatasetItem(
+                dataset=ds,
+                image_path=f"images/{i}.png",
+                width=10,
+                height=10,
+                bucket="1024x1024" if i % 3 else "832x1216",
+                has_caption=i < 10,
+            )
+            for i in range(60)
+        )
+        url = f"/api/datasets/{ds.id}/sample"
+
+        first = self.client.get(url, {"n": 12, "seed": 7}).json()["results"]
+        self.assertEqual(len({r["id"] for r in first}), 12)
+        again = self.client.get(url, {"n": 12, "seed": 7}).json()["results"]
+        self.assertEqual([r["id"] for r in first], [r["id"] for r in again])
+        self.assertEqual(len(self.client.get(url, {"n": 500}).json()["results"]), 60)
+        captioned = set(DatasetItem.objects.filter(has_caption=True).values_list("id", flat=True))
+        only = self.client.get(url, {"n": 5, "has_caption": "true"}).json()["results"]
+        self.assertLessEqual({r["id"] for r in only}, captioned)
+
+        strat = self.client.get(url, {"n": 9, "stratify": "bucket", "seed": 1}).json()
+        sizes = {g["key"]: len(g["results"]) for g in strat["strata"]}
+        self.assertEqual(sizes, {"1024x1024": 6, "832x1216": 3})
+        equal = self.client.get(
+            url, {"n": 10, "stratify": "has_caption", "allocation": "equal"}
+        ).json()
+        self.assertEqual([len(g["results"]) for g in equal["strata"]], [5, 5])
+        self.assertEqual(self.client.get(url, {"stratify": "nope"}).status_code, 400)
+
+        split_url = f"/api/datasets/{ds.id}/split"
+        body = {"val_fraction": 0.2, "seed": 3, "stratify": "bucket"}
+        counts = self.client.post(split_url, body, format="json").json()
+        self.assertEqual(counts, {"train": 48, "val": 12, "unassigned": 0})
+        val = set(DatasetItem.objects.filter(split="val").values_list("id", flat=True))
+        self.client.post(split_url, body, format="json")
+        self.assertEqual(
+            set(DatasetItem.objects.filter(split="val").values_list("id", flat=True)), val
+        )
+        listed = self.client.get(f"/api/datasets/{ds.id}/items", {"split": "val"}).json()
+        self.assertEqual(listed["count"], 12)
+
+    def test_tag_index_counts_cooccurrence_and_filters(self):
+        ds, root = self._create_dataset_with_items()
+        payload = [
+            {"filename": "images/1.jpg", "caption": "c1", "tags": ["Red", "square", "red "]},
+            {"filename": "images/2.jpg", "caption": "c2", "tags": ["red", "circle"]},
+        ]
+        self.client.post(f"/api/datasets/{ds.id}/import", payload, format="json")
+
+        tags = self.client.get(f"/api/datasets/{ds.id}/tags").json()
+        self.assertEqual(tags["results"][0], {"name": "red", "count": 2})
+        self.assertEqual(tags["total"], 3)
+        co = self.client.get(
+            f"/api/datasets/{ds.id}/tags/cooccurrence", {"tag": "RED"}
+        ).json()
+        self.assertEqual(
+            [(r["name"], r["count"], r["share"]) for r in co["results"]],
+            [("circle", 1, 0.5), ("square", 1, 0.5)],
+        )
+
+        def listed(**params):
+            resp = self.client.get(f"/api/datasets/{ds.id}/items", params)
+            return sorted(r["image_path"] for r in resp.json()["results"])
+
+        self.assertEqual(listed(tags="red,square"), ["images/1.jpg"])
+        self.assertEqual(listed(tags="red", not_tags="square"), ["images/2.jpg"])
+        self.assertEqual(listed(any_tags="circle,square"), ["images/1.jpg", "images/2.jpg"])
+
+        # Retagging and deleting keep the counts in step.
+        item2 = DatasetItem.objects.get(dataset=ds, image_path="images/2.jpg")
+        self.client.patch(
+            f"/api/datasets/{ds.id}/items/batch",
+            {"items": [{"id": item2.id, "tags": ["circle"]}]},
+            format="json",
+        )
+        item1 = DatasetItem.objects.get(dataset=ds, image_path="images/1.jpg")
+        self.client.delete(f"/api/datasets/{ds.id}/items/{item1.id}/")
+        tags = self.client.get(f"/api/datasets/{ds.id}/tags").json()
+        self.assertEqual(tags["results"], [{"name": "circle", "count": 1}])
+        rebuilt = self.client.post(f"/api/datasets/{ds.id}/tags").json()
+        self.assertEqual(rebuilt["results"], tags["results"])
+
+    def test_similarity_search(self):
+        from unittest import mock
+
+        import numpy as np
+        from PIL import Image
+
+        from dataset_viewer import similarity
+
+        root = self._make_scan_root([])
+        rng = np.random.default_rng(0)
+        for i in range(6):
+            base = (200, 40, 40) if i < 3 else (40, 40, 200)
+            noise = rng.integers(0, 30, (64, 64, 3))
+            pixels = np.clip(np.array(base) + noise, 0, 255).astype(np.uint8)
+            Image.fromarray(pixels).save(Path(root, "images", f"{i}.png"))
+        self.client.post(
+            "/api/datasets/scan", {"name": "similar", "root_dir": root}, format="json"
+        )
+        ds = Dataset.objects.get(name="similar")
+        ids = dict(DatasetItem.objects.filter(dataset=ds).values_list("image_path", "id"))
+        red, blue = ids["images/0.png"], ids["images/3.png"]
+
+        url = f"/api/datasets/{ds.id}/similar"
+        body = self.client.get(url, {"items": f"{red},{blue}", "k": 2}).json()
+        by_query = {
+            row["item"]: [match["image_path"] for match in row["results"]]
+            for row in body["results"]
+        }
+        self.assertEqual(sorted(by_query[red]), ["images/1.png", "images/2.png"])
+        self.assertEqual(sorted(by_query[blue]), ["images/4.png", "images/5.png"])
+        self.assertEqual(body["missing"], [])
+        self.assertEqual(self.client.get(url, {"items": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"items": red, "k": 0}).status_code, 400)
+
+        # IVF clustering gives the same neighbours on well separated data.
+        with mock.patch.object(similarity, "IVF_MIN", 4):
+            index = similarity.build_index(ds)
+        self.assertEqual(index.lists, 2)
+        query = similarity.as_vector(DatasetItem.objects.get(id=red).features)
+        approx = [i for i, _ in similarity.search(index, [query], 3, nprobe=1)[0]]
+        exact = [i for i, _ in similarity.search(index, [query], 3, nprobe=None)[0]]
+        self.assertEqual(sorted(approx), sorted(exact))
+        self.assertIn(red, exact)
+
+        # A new image moves the features version; the matrix is rebuilt.
+        version = Dataset.objects.get(id=ds.id).features_version
+        with Image.open(Path(root, "images", "0.png")) as img:
+            img.transpose(Image.FLIP_TOP_BOTTOM).save(Path(root, "images", "6.png"))
+        self.client.post(f"/api/datasets/{ds.id}/sync")
+        self.assertGreater(Dataset.objects.get(id=ds.id).features_version, version)
+        body = self.client.get(url, {"items": red, "k": 1}).json()
+        self.assertEqual(body["results"][0]["results"][0]["image_path"], "images/6.png")
@@ -0,0 +1,109 @@
+import io
+import json
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from pathlib import Path
+
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from dataset_viewer.models import Dataset, DatasetItem
+
+
+@override_settings(BACKGROUND_HASHING=False)
+class ArchiveDownloadTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.root, ignore_errors=True))
+        images = Path(self.root, "images")
+        images.mkdir()
+        Image.new("RGB", (64, 64), (200, 0, 0)).save(images / "0.png")
+        Image.new("RGB", (96, 64), (0, 200, 0)).save(images / "1.jpg")
+        Path(images, "0.json").write_text(
+            json.dumps({"title": "t", "caption": "a red square", "tags": ["red"]}),
+            encoding="utf-8",
+        )
+        Path(self.root, "masks").mkdir()
+        Image.new("L", (64, 64), 255).save(Path(self.root, "masks", "0.png"))
+        self.client.post(
+            "/api/datasets/scan", {"name": "arch", "root_dir": self.root}, format="json"
+        )
+        self.ds = Dataset.objects.get(name="arch")
+        self.url = f"/api/datasets/{self.ds.id}/archive"
+
+    def get(self, status=200, headers=None, fmt="zip", **params):
+        resp = self.client.get(f"{self.url}.{fmt}", params, headers=headers or {})
+        self.assertEqual(resp.status_code, status)
+        return resp, b"".join(resp.streaming_content) if resp.streaming else resp.content
+
+    def test_tar_contains_images_captions_and_masks(self):
+        resp, body = self.get(fmt="tar")
+        self.assertEqual(int(resp["Content-Length"]), len(body))
+        self.assertEqual(resp["Accept-Ranges"], "bytes")
+        with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+            names = tar.getnames()
+            caption = json.loads(tar.extractfile("images/0.json").read())
+            image = tar.extractfile("images/1.jpg").read()
+        self.assertEqual(
+            sorted(names), ["images/0.json", "images/0.png", "images/1.jpg", "masks/0.png"]
+        )
+        self.assertEqual(caption["caption"], "a red square")
+        self.assertEqual(image, Path(self.root, "images", "1.jpg").read_bytes())
+
+    def test_caption_edits_are_archived_before_write_back(self):
+        item = DatasetItem.objects.get(dataset=self.ds, image_path="images/0.png")
+        item.caption_text = "edited"
+        item.caption_dirty = True
+        item.save()
+        _resp, body = self.get(fmt="tar")
+        with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+            caption = json.loads(tar.extractfile("images/0.json").read())
+        self.assertEqual(caption["caption"], "edited")
+
+    def test_tar_range_requests(self):
+        resp, full = self.get(fmt="tar")
+        etag = resp["ETag"]
+
+        part, body = self.get(206, {"Range": "bytes=700-1999"}, fmt="tar")
+        self.assertEqual(body, full[700:2000])
+        self.assertEqual(part["Content-Range"], f"bytes 700-1999/{len(full)}")
+        self.assertEqual(int(part["Content-Length"]), 1300)
+
+        _part, tail = self.get(206, {"Range": "bytes=1000-", "If-Range": etag}, fmt="tar")
+        self.assertEqual(tail, full[1000:])
+        _part, suffix = self.get(206, {"Range": "bytes=-100"}, fmt="tar")
+        self.assertEqual(suffix, full[-100:])
+
+        # A changed archive is sent whole.
+        _resp, body = self.get(200, {"Range": "bytes=1000-", "If-Range": '"stale"'}, fmt="tar")
+        self.assertEqual(body, full)
+        bad, _body = self.get(416, {"Range": f"bytes={len(full)}-"}, fmt="tar")
+        self.assertEqual(bad["Content-Range"], f"bytes */{len(full)}")
+
+    def test_zip_stores_images_and_deflates_captions(self):
+        resp, body = self.get()
+        self.assertEqual(resp["Content-Type"], "application/zip")
+        with zipfile.ZipFile(io.BytesIO(body)) as zf:
+            self.assertIsNone(zf.testzip())
+            infos = {info.filename: info for info in zf.infolist()}
+            self.assertEqual(
+                zf.read("images/1.jpg"), Path(self.root, "images", "1.jpg").read_bytes()
+            )
+        self.assertEqual(infos["images/1.jpg"].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(infos["images/0.png"].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(infos["images/0.json"].compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_filters_and_options(self):
+        _resp, body = self.get(ext="jpg")
+        with zipfile.ZipFile(io.BytesIO(body)) as zf:
+            self.assertEqual(zf.namelist(), ["images/1.jpg"])
+        _resp, body = self.get(fmt="tar", captions="false", masks="false")
+        with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+            self.assertEqual(sorted(tar.getnames()), ["images/0.png", "images/1.jpg"])
+        self.get(404, fmt="rar")
+        self.get(400, captions="maybe")
+        self.assertEqual(self.client.get("/api/datasets/999/archive.zip").status_code, 404)
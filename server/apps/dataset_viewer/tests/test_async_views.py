@@ -0,0 +1,134 @@
+import asyncio
+import io
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.test import AsyncClient, AsyncRequestFactory, TestCase, override_settings
+from PIL import Image
+
+from dataset_viewer import async_views, imagepool, masks
+from dataset_viewer.metrics import registry
+from dataset_viewer.models import Dataset, DatasetItem
+from dataset_viewer.utils import ensure_thumbnail, sha256_file
+
+
+async def body(resp):
+    return b"".join([chunk async for chunk in resp.streaming_content])
+
+
+class AsyncServingTests(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.thumbs = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.thumbs, ignore_errors=True)
+        settings_override = override_settings(THUMBNAILS_ROOT=self.thumbs, FILE_CHUNK_SIZE=1024)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        (self.root / "images").mkdir()
+        (self.root / "masks").mkdir()
+        Image.effect_noise((96, 64), 64).convert("RGB").save(self.root / "images" / "a.png")
+        mask = Image.new("L", (96, 64))
+        mask.paste(255, (0, 0, 48, 64))
+        mask.save(self.root / "masks" / "a.png")
+        self.ds = Dataset.objects.create(name="async", root_dir=str(self.root))
+        self.item = DatasetItem.objects.create(
+            dataset=self.ds, image_path="images/a.png", mask_path="masks/a.png", width=96, height=64
+        )
+        self.factory = AsyncRequestFactory()
+
+    async def test_file_and_item_image_are_streamed(self):
+        original = (self.root / "images" / "a.png").read_bytes()
+        request = self.factory.get("/files", {"path": "images/a.png"})
+        resp = await async_views.dataset_file_serve(request, self.ds.id)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_async)
+        self.assertEqual(resp["Content-Type"], "image/png")
+        self.assertEqual(resp["Content-Length"], str(len(original)))
+        self.assertEqual(resp["ETag"], sha256_file(self.root / "images" / "a.png"))
+        self.assertEqual(await body(resp), original)
+
+        resp = await async_views.item_image(self.factory.get("/image"), self.item.id)
+        self.assertEqual(await body(resp), original)
+
+        for path, status in (("../etc/passwd", 404), ("images/missing.png", 404), ("", 400)):
+            request = self.factory.get("/files", {"path": path})
+            resp = await async_views.dataset_file_serve(request, self.ds.id)
+            self.assertEqual(resp.status_code, status, path)
+        resp = await async_views.item_image(self.factory.get("/image"), self.item.id + 1)
+        self.assertEqual(resp.status_code, 404)
+
+    # The counting wrapper cannot be pickled into a worker process.
+    @override_settings(IMAGE_POOL_WORKERS=0)
+    async def test_concurrent_thumbnail_requests_share_one_render(self):
+        calls = []
+
+        def counting(src, dst):
+            calls.append(dst)
+            return ensure_thumbnail(src, dst)
+
+        with mock.patch.object(async_views, "ensure_thumbnail", counting):
+            responses = await asyncio.gather(
+                *(
+                    async_views.dataset_thumb_serve(
+                        self.factory.get("/thumb", {"path": "images/a.png"}), self.ds.id
+                    )
+                    for _ in range(20)
+                )
+            )
+        self.assertLessEqual(len(calls), 2)
+        bodies = {await body(resp) for resp in responses}
+        self.assertEqual(len(bodies), 1)
+        with Image.open(self.thumbs / str(self.ds.id) / "images" / "a.jpg") as img:
+            self.assertEqual(img.size, (96, 64))
+
+    async def test_full_image_pool_answers_503(self):
+        with mock.patch.object(imagepool, "_pool", imagepool.ImagePool(1, 0)):
+            resp = await async_views.dataset_thumb_serve(
+                self.factory.get("/thumb", {"path": "images/a.png"}), self.ds.id
+            )
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp["Retry-After"], "1")
+
+    async def test_mask_and_preview(self):
+        resp = await async_views.dataset_item_mask(self.factory.get("/mask"), self.item.id)
+        self.assertEqual(await body(resp), (self.root / "masks" / "a.png").read_bytes())
+        request = self.factory.get("/mask/preview", {"size": "32"})
+        resp = await async_views.dataset_item_mask_preview(request, self.item.id)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue((self.root / ".cache" / "masks" / "32" / "masks" / "a.png").is_file())
+        request = self.factory.get("/mask/preview", {"size": "x"})
+        resp = await async_views.dataset_item_mask_preview(request, self.item.id)
+        self.assertEqual(resp.status_code, 400)
+
+        # Writes still go through the DRF view.
+        resp = await async_views.dataset_item_mask(
+            self.factory.delete("/mask?delete_file=0"), self.item.id
+        )
+        self.assertEqual(resp.status_code, 200)
+        item = await DatasetItem.objects.aget(id=self.item.id)
+        self.assertIsNone(item.mask_path)
+
+    async def test_compact_mask(self):
+        with Image.open(self.root / "masks" / "a.png") as img:
+            original = img.tobytes()
+            masks.set_compact(self.item, masks.encode_image(img.filename))
+        await self.item.asave()
+        (self.root / "masks" / "a.png").unlink()
+
+        resp = await async_views.dataset_item_mask(self.factory.get("/mask"), self.item.id)
+        with Image.open(io.BytesIO(resp.content)) as img:
+            self.assertEqual(img.tobytes(), original)
+        request = self.factory.get("/mask/preview", {"size": "48"})
+        resp = await async_views.dataset_item_mask_preview(request, self.item.id)
+        with Image.open(io.BytesIO(await body(resp))) as img:
+            self.assertEqual(img.size, (48, 32))
+
+    async def test_middleware_runs_async_under_asgi(self):
+        registry.reset()
+        resp = await AsyncClient().get("/api/health")
+        self.assertEqual(resp.status_code, 200)
+        text = registry.render()
+        self.assertIn('fluxlab_request_duration_seconds_count{route="api/health"', text)
@@ -0,0 +1,92 @@
+import json
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from dataset_viewer.models import Dataset, DatasetItem
+from dataset_viewer.utils import thumbnail_path_for
+
+
+@override_settings(BACKGROUND_HASHING=False)
+class ManagementCommandTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.root, ignore_errors=True))
+        self.addCleanup(lambda: shutil.rmtree(self.tmp, ignore_errors=True))
+        images = Path(self.root, "images")
+        images.mkdir()
+        for i in range(5):
+            Image.new("RGB", (20 + i, 20), (i, i, i)).save(images / f"{i}.png")
+        (images / "broken.png").write_bytes(b"not a png")
+
+    def call(self, *args):
+        out = StringIO()
+        call_command(*args, "--no-progress", stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_scan_is_parallel_and_resumable(self):
+        out = self.call("fluxlab_scan", "--name", "cmd", "--root", self.root, "--workers", "2")
+        self.assertIn("created=5", out)
+        self.assertIn("skipped=1", out)
+        ds = Dataset.objects.get(name="cmd")
+        self.assertEqual(ds.items_count, 5)
+
+        again = self.call("fluxlab_scan", "cmd", "--resume", "--workers", "1")
+        self.assertIn("created=0", again)
+        self.assertIn("unchanged=5", again)
+
+    def test_thumbs_export_import(self):
+        self.call("fluxlab_scan", "--name", "cmd", "--root", self.root, "--workers", "1")
+        ds = Dataset.objects.get(name="cmd")
+
+        with override_settings(THUMBNAILS_ROOT=Path(self.tmp, "thumbs")):
+            self.assertIn("rendered=5", self.call("fluxlab_thumbs", "cmd", "--workers", "2"))
+            self.assertTrue(thumbnail_path_for(ds.id, "images/0.png").is_file())
+            self.assertIn("existing=5", self.call("fluxlab_thumbs", "cmd"))
+
+        meta_file = Path(self.tmp, "meta.json")
+        self.call("fluxlab_export", "cmd", "--out", str(meta_file))
+        data = json.loads(meta_file.read_text(encoding="utf-8"))
+        for entry in data:
+            entry["caption"] = f"caption of {entry['filename']}"
+        meta_file.write_text(json.dumps(data), encoding="utf-8")
+
+        self.assertIn("updated=5", self.call("fluxlab_import", "cmd", str(meta_file)))
+        self.assertEqual(
+            DatasetItem.objects.filter(dataset=ds, has_caption=True).count(), 5
+        )
+        ds.refresh_from_db()
+        self.assertEqual(ds.captioned_count, 5)
+
+        out = self.call(
+            "fluxlab_export", "cmd", "--format", "tar", "--out", str(Path(self.tmp, "tar"))
+        )
+        self.assertEqual(json.loads(out)["samples"], 5)
+
+    def test_gen_dataset_and_bench_suite(self):
+        from dataset_viewer.benchmarks import compare, run_suite
+
+        root = Path(self.tmp, "synthetic")
+        out = self.call("fluxlab_gen_dataset", str(root), "--items", "9", "--scale", "0.05")
+        self.assertIn("images=9", out)
+        self.assertEqual(len(list(root.joinpath("images").rglob("*.webp"))), 3)
+
+        with override_settings(THUMBNAILS_ROOT=Path(self.tmp, "thumbs")):
+            results = run_suite(root, repeat=1)
+        self.assertEqual(results["dataset_scan"]["items"], 9)
+        self.assertEqual(results["dataset_upload"]["runs"], 1)
+        self.assertIn("dataset_thumb_serve_cold", results)
+        # Uploaded files are cleaned up so the root can be benchmarked again.
+        self.assertFalse(root.joinpath("images", "bench_uploads").exists())
+
+        slower = {name: {**r, "median": r["median"] * 2} for name, r in results.items()}
+        self.assertEqual(compare(results, slower), [])
+        self.assertEqual(
+            {r["case"] for r in compare(slower, results)}, set(results)
+        )
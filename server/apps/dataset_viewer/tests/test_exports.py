@@ -0,0 +1,175 @@
+import json
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from dataset_viewer.models import Dataset, DatasetItem
+
+
+@override_settings(BACKGROUND_HASHING=False)
+class PackedExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.root = tempfile.mkdtemp()
+        self.out = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.root, ignore_errors=True))
+        self.addCleanup(lambda: shutil.rmtree(self.out, ignore_errors=True))
+        images = Path(self.root, "images")
+        images.mkdir()
+        for i, (w, h) in enumerate([(64, 64), (96, 64), (64, 96)]):
+            Image.new("RGB", (w, h), (40 * i, 0, 0)).save(images / f"{i}.png")
+        Path(images, "0.json").write_text(
+            json.dumps({"title": "t", "caption": "a red square", "tags": ["red"]}),
+            encoding="utf-8",
+        )
+        Path(self.root, "masks").mkdir()
+        Image.new("L", (64, 64), 255).save(Path(self.root, "masks", "0.png"))
+        self.client.post(
+            "/api/datasets/scan", {"name": "packed", "root_dir": self.root}, format="json"
+        )
+        self.ds = Dataset.objects.get(name="packed")
+
+    def export(self, **body):
+        resp = self.client.post(
+            f"/api/datasets/{self.ds.id}/export/packed", body, format="json"
+        )
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def test_tar_shards_with_index_and_incremental_rewrite(self):
+        out = Path(self.out, "tar")
+        result = self.export(format="tar", shard_size=2, out_dir=str(out))
+        self.assertEqual((result["samples"], result["shards"], result["written"]), (3, 2, 2))
+
+        index = json.loads((out / "index.json").read_text(encoding="utf-8"))
+        first = index["shards"][0]["samples"][0]
+        with open(out / "shard-000000.tar", "rb") as f:
+            offset, size = first["members"]["txt"]
+            f.seek(offset)
+            self.assertEqual(f.read(size), b"a red square")
+        with tarfile.open(out / "shard-000000.tar") as tar:
+            names = tar.getnames()
+        self.assertIn(f"{first['key']}.mask.png", names)
+
+        again = self.export(format="tar", shard_size=2, out_dir=str(out))
+        self.assertEqual((again["written"], again["reused"]), (0, 2))
+
+        item = DatasetItem.objects.get(dataset=self.ds, image_path="images/2.png")
+        item.sha256 = "changed"
+        item.save()
+        changed = self.export(format="tar", shard_size=2, out_dir=str(out))
+        self.assertEqual((changed["written"], changed["reused"]), (1, 1))
+
+    def test_memmap_bucket_arrays(self):
+        self.client.post(
+            f"/api/datasets/{self.ds.id}/buckets",
+            {"resolutions": ["32x32", "48x32", "32x48"]},
+            format="json",
+        )
+        out = Path(self.out, "mm")
+        result = self.export(format="memmap", out_dir=str(out))
+        self.assertEqual((result["samples"], result["buckets"]), (3, 3))
+
+        square = np.load(out / "32x32.npy", mmap_mode="r")
+        self.assertEqual(square.shape, (1, 32, 32, 3))
+        self.assertEqual(square.dtype, np.uint8)
+        self.assertEqual(int(square[0, 0, 0, 0]), 0)
+        mask = np.load(out / "32x32.mask.npy", mmap_mode="r")
+        self.assertEqual(int(mask.min()), 255)
+        wide = np.load(out / "48x32.npy", mmap_mode="r")
+        self.assertEqual(int(wide[0, 5, 5, 0]), 40)
+
+        again = self.export(format="memmap", out_dir=str(out))
+        self.assertEqual((again["written"], again["reused"]), (0, 3))
+
+
+@override_settings(BACKGROUND_HASHING=False)
+class TrainerLayoutExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.root = tempfile.mkdtemp()
+        self.out = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.root, ignore_errors=True))
+        self.addCleanup(lambda: shutil.rmtree(self.out, ignore_errors=True))
+        images = Path(self.root, "images")
+        Path(images, "sub").mkdir(parents=True)
+        Image.new("RGB", (8, 8)).save(images / "a.png")
+        Image.new("RGB", (8, 8)).save(images / "sub" / "a.png")
+        Image.new("RGB", (16, 8)).save(images / "wide.jpg")
+        Path(images, "a.json").write_text(
+            json.dumps({"caption": "", "tags": ["x", "y"]}), encoding="utf-8"
+        )
+        self.client.post(
+            "/api/datasets/scan", {"name": "layout", "root_dir": self.root}, format="json"
+        )
+        self.ds = Dataset.objects.get(name="layout")
+
+    def export(self, query="", **body):
+        resp = self.client.post(
+            f"/api/datasets/{self.ds.id}/export/trainer{query}",
+            {"out_dir": self.out, "concept": "ohwx", "repeats": 10, **body},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def test_hardlinked_layout_is_incremental(self):
+        result = self.export()
+        self.assertEqual((result["items"], result["changed"], result["hardlinks"]), (3, 3, 3))
+        folder = Path(self.out, "10_ohwx")
+        self.assertEqual(
+            sorted(p.name for p in folder.iterdir()),
+            ["a.png", "a.txt", "sub__a.png", "sub__a.txt", "wide.jpg", "wide.txt"],
+        )
+        self.assertTrue(Path(self.root, "images", "a.png").samefile(folder / "a.png"))
+        self.assertEqual((folder / "a.txt").read_text(encoding="utf-8"), "x, y")
+
+        again = self.export()
+        self.assertEqual((again["changed"], again["unchanged"]), (0, 3))
+
+        subset = self.export(query="?ext=png")
+        self.assertEqual((subset["items"], subset["removed"]), (2, 1))
+        self.assertFalse((folder / "wide.jpg").exists())
+        self.assertFalse((folder / "wide.txt").exists())
+
+    def test_clashing_names_get_their_own_entries(self):
+        images = Path(self.root, "images")
+        Image.new("RGB", (8, 16)).save(images / "sub__a.png")
+        Image.new("RGB", (8, 24)).save(images / "wide.png")
+        self.client.post(
+            "/api/datasets/scan", {"name": "layout", "root_dir": self.root}, format="json"
+        )
+        ids = dict(DatasetItem.objects.filter(dataset=self.ds).values_list("image_path", "id"))
+
+        result = self.export()
+        self.assertEqual((result["items"], result["changed"], result["unchanged"]), (5, 5, 0))
+        folder = Path(self.out, "10_ohwx")
+        late = f"sub__a__{ids['images/sub__a.png']}"
+        wide = f"wide__{ids['images/wide.png']}"
+        self.assertEqual(
+            sorted(p.name for p in folder.iterdir()),
+            sorted(
+                ["a.png", "a.txt", "sub__a.png", "sub__a.txt", "wide.jpg", "wide.txt"]
+                + [f"{late}.png", f"{late}.txt", f"{wide}.png", f"{wide}.txt"]
+            ),
+        )
+        self.assertTrue(Path(images, "sub", "a.png").samefile(folder / "sub__a.png"))
+        self.assertTrue(Path(images, "sub__a.png").samefile(folder / f"{late}.png"))
+        self.assertTrue(Path(images, "wide.png").samefile(folder / f"{wide}.png"))
+
+        again = self.export()
+        self.assertEqual((again["items"], again["changed"]), (5, 0))
+        subset = self.export(query="?ext=jpg")
+        self.assertEqual((subset["items"], subset["removed"]), (1, 4))
+        self.assertTrue((folder / "wide.txt").is_file())
+
+    def test_symlink_mode(self):
+        result = self.export(mode="symlink")
+        self.assertEqual(result["symlinks"], 3)
+        self.assertTrue(Path(self.out, "10_ohwx", "wide.jpg").is_symlink())
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from dataset_viewer.hashing import QUICK_BLOCK, fill_pending_hashes, full_sha256, quick_fingerprint
+from dataset_viewer.models import Dataset, DatasetItem, FileSnapshot
+
+
+def png_bytes(size, color):
+    buf = BytesIO()
+    Image.new("RGB", size, color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class FingerprintTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.dir, ignore_errors=True))
+
+    def write(self, name, data):
+        path = Path(self.dir, name)
+        path.write_bytes(data)
+        return path
+
+    def test_quick_fingerprint_samples_large_files(self):
+        data = bytearray(os.urandom(5 * QUICK_BLOCK))
+        a = self.write("a", bytes(data))
+        data[QUICK_BLOCK + 10] ^= 0xFF  # outside the sampled blocks
+        b = self.write("b", bytes(data))
+        data[-1] ^= 0xFF
+        c = self.write("c", bytes(data))
+        self.assertTrue(quick_fingerprint(a).startswith(f"{5 * QUICK_BLOCK}:"))
+        self.assertEqual(quick_fingerprint(a), quick_fingerprint(b))
+        self.assertNotEqual(quick_fingerprint(a), quick_fingerprint(c))
+        self.assertLessEqual(len(quick_fingerprint(a)), 64)
+
+    def test_small_files_are_hashed_whole(self):
+        a = self.write("a", b"x" * 1000)
+        b = self.write("b", b"x" * 999 + b"y")
+        self.assertNotEqual(quick_fingerprint(a), quick_fingerprint(b))
+
+    def test_full_sha256(self):
+        data = os.urandom(3 * QUICK_BLOCK + 7)
+        self.assertEqual(full_sha256(self.write("a", data)), hashlib.sha256(data).hexdigest())
+        self.assertEqual(full_sha256(Path(self.dir, "missing")), "")
+        self.assertEqual(quick_fingerprint(Path(self.dir, "missing")), "")
+
+
+@override_settings(BACKGROUND_HASHING=False)
+class PendingHashTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.root, ignore_errors=True))
+        self.images = Path(self.root, "images")
+        self.images.mkdir()
+        for i in range(3):
+            (self.images / f"{i}.png").write_bytes(png_bytes((10 + i, 10), (i, 0, 0)))
+        self.client.post(
+            "/api/datasets/scan", {"name": "hash", "root_dir": self.root}, format="json"
+        )
+        self.ds = Dataset.objects.get(name="hash")
+
+    def items_url(self, **params):
+        return self.client.get(f"/api/datasets/{self.ds.id}/items", params).json()
+
+    def test_scan_leaves_full_hash_pending(self):
+        items = DatasetItem.objects.filter(dataset=self.ds)
+        self.assertEqual(items.count(), 3)
+        self.assertTrue(all(i.quick_hash and not i.sha256 for i in items))
+        self.assertEqual(self.items_url(hash_pending="true")["count"], 3)
+        self.assertTrue(all(r["hash_pending"] for r in self.items_url()["results"]))
+        detail = self.client.get(f"/api/datasets/{self.ds.id}/").json()
+        self.assertEqual(detail["pending_hashes"], 3)
+
+        self.assertEqual(fill_pending_hashes(self.ds), {"hashed": 3, "failed": 0})
+        for item in items.all():
+            data = (Path(self.root) / item.image_path).read_bytes()
+            self.assertEqual(item.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(self.items_url(hash_pending="true")["count"], 0)
+        self.assertEqual(self.items_url(hash_pending="false")["count"], 3)
+        self.assertEqual(
+            self.client.get(f"/api/datasets/{self.ds.id}/").json()["pending_hashes"], 0
+        )
+        self.assertEqual(
+            self.client.get(f"/api/datasets/{self.ds.id}/items", {"hash_pending": "x"}).status_code,
+            400,
+        )
+
+    def test_rescan_keeps_full_hash_of_unchanged_files(self):
+        fill_pending_hashes(self.ds)
+        (self.images / "0.png").write_bytes(png_bytes((30, 30), (9, 9, 9)))
+        self.client.post(
+            "/api/datasets/scan", {"name": "hash", "root_dir": self.root}, format="json"
+        )
+        pending = DatasetItem.objects.filter(dataset=self.ds, sha256="")
+        self.assertEqual(list(pending.values_list("image_path", flat=True)), ["images/0.png"])
+
+    def test_changed_file_stays_pending(self):
+        (self.images / "1.png").write_bytes(png_bytes((50, 10), (1, 2, 3)))
+        self.assertEqual(fill_pending_hashes(self.ds), {"hashed": 2, "failed": 1})
+        item = DatasetItem.objects.get(dataset=self.ds, image_path="images/1.png")
+        self.assertEqual(item.sha256, "")
+
+    def test_legacy_items_get_a_quick_hash(self):
+        DatasetItem.objects.filter(dataset=self.ds).update(quick_hash="", sha256="legacy")
+        self.assertEqual(fill_pending_hashes(self.ds)["hashed"], 3)
+        item = DatasetItem.objects.get(dataset=self.ds, image_path="images/0.png")
+        self.assertEqual(item.quick_hash, quick_fingerprint(self.images / "0.png"))
+        self.assertEqual(item.sha256, "legacy")
+
+    def test_sync_renames_by_quick_hash_and_snapshots_get_full_hash(self):
+        self.client.post(f"/api/datasets/{self.ds.id}/sync")
+        moved_id = DatasetItem.objects.get(dataset=self.ds, image_path="images/2.png").id
+        shutil.copy(self.images / "2.png", self.images / "copy.png")
+        (self.images / "2.png").unlink()
+        result = self.client.post(f"/api/datasets/{self.ds.id}/sync").json()
+        self.assertEqual((result["renamed"], result["added"]), (1, 0))
+        self.assertEqual(DatasetItem.objects.get(image_path="images/copy.png").id, moved_id)
+
+        fill_pending_hashes(self.ds)
+        snap = FileSnapshot.objects.get(dataset=self.ds, path="images/copy.png")
+        self.assertEqual(snap.sha256, full_sha256(self.images / "copy.png"))
+        self.assertEqual(snap.quick_hash, quick_fingerprint(self.images / "copy.png"))
+
+    def test_upload_dedupes_by_quick_hash_confirmed_with_sha256(self):
+        upload = Path(tempfile.mkdtemp())
+        self.addCleanup(lambda: shutil.rmtree(upload, ignore_errors=True))
+        dup = upload / "dup.png"
+        dup.write_bytes((self.images / "0.png").read_bytes())
+        new = upload / "new.png"
+        new.write_bytes(png_bytes((77, 7), (5, 5, 5)))
+        with open(dup, "rb") as f1, open(new, "rb") as f2:
+            resp = self.client.post(
+                f"/api/datasets/{self.ds.id}/upload", {"files": [f1, f2]}, format="multipart"
+            )
+        self.assertEqual(resp.json(), {"created": 1, "skipped": 1})
+        self.assertFalse(DatasetItem.objects.filter(image_path="images/dup.png").exists())
+
+    def test_commands_fill_hashes_unless_no_hash(self):
+        call_command(
+            "fluxlab_sync", str(self.ds.id), "--no-hash", "--workers", "1", stdout=StringIO()
+        )
+        self.assertEqual(DatasetItem.objects.filter(dataset=self.ds, sha256="").count(), 3)
+        out = StringIO()
+        call_command("fluxlab_scan", str(self.ds.id), "--workers", "1", "--no-progress", stdout=out)
+        self.assertIn("hashed=3", out.getvalue())
+        self.assertFalse(DatasetItem.objects.filter(dataset=self.ds, sha256="").exists())
@@ -0,0 +1,76 @@
+import io
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase
+from PIL import Image
+
+from dataset_viewer.imageheader import read_header
+from dataset_viewer.utils import open_image_size
+
+
+def exif(orientation):
+    data = Image.Exif()
+    data[0x0112] = orientation
+    return data.tobytes()
+
+
+class ImageHeaderTests(SimpleTestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def save(self, name, image, fmt, **params):
+        path = self.root / name
+        image.save(path, fmt, **params)
+        return path
+
+    def test_matches_pil_for_common_files(self):
+        rgb = Image.effect_noise((123, 77), 40).convert("RGB")
+        cases = [
+            ("rgb.jpg", rgb, "JPEG", {}),
+            ("gray.jpg", rgb.convert("L"), "JPEG", {}),
+            ("cmyk.jpg", rgb.convert("CMYK"), "JPEG", {}),
+            ("progressive.jpg", rgb, "JPEG", {"progressive": True}),
+            ("bilevel.png", rgb.convert("1"), "PNG", {}),
+            ("gray.png", rgb.convert("L"), "PNG", {}),
+            ("gray_alpha.png", rgb.convert("LA"), "PNG", {}),
+            ("rgb.png", rgb, "PNG", {}),
+            ("rgba.png", rgb.convert("RGBA"), "PNG", {}),
+            ("palette.png", rgb.convert("P"), "PNG", {}),
+            ("lossy.webp", rgb, "WEBP", {"quality": 80}),
+            ("lossy_alpha.webp", rgb.convert("RGBA"), "WEBP", {"quality": 80}),
+            ("lossless.webp", rgb, "WEBP", {"lossless": True}),
+            ("lossless_alpha.webp", rgb.convert("RGBA"), "WEBP", {"lossless": True}),
+        ]
+        for name, image, fmt, params in cases:
+            path = self.save(name, image, fmt, **params)
+            header = read_header(path)
+            with Image.open(path) as img:
+                self.assertEqual(
+                    (header.format, header.size, header.mode),
+                    (img.format, img.size, img.mode),
+                    name,
+                )
+            self.assertEqual(read_header(path.read_bytes()), header)
+
+    def test_exif_orientation(self):
+        image = Image.new("RGB", (40, 20))
+        for name, fmt in (("o.jpg", "JPEG"), ("o.webp", "WEBP")):
+            path = self.save(name, image, fmt, exif=exif(6))
+            header = read_header(path)
+            self.assertEqual((header.size, header.orientation), ((40, 20), 6), name)
+            self.assertEqual(header.display_size, (20, 40))
+        self.assertEqual(read_header(self.save("plain.jpg", image, "JPEG")).orientation, 1)
+
+    def test_unknown_files_fall_back_to_pil(self):
+        gif = self.save("a.png", Image.new("RGB", (9, 7)), "GIF")
+        self.assertIsNone(read_header(gif))
+        self.assertEqual(open_image_size(gif), (9, 7))
+        self.assertIsNone(read_header(b"\xff\xd8\xff\xe0\x00"))
+        self.assertIsNone(open_image_size(b"not an image"))
+        self.assertIsNone(read_header(self.root / "missing.jpg"))
+        buf = io.BytesIO()
+        Image.new("RGB", (5, 6)).save(buf, "PNG")
+        self.assertEqual(open_image_size(buf.getvalue()), (5, 6))
@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from PIL import Image
+from rest_framework.test import APIClient
+
+from dataset_viewer import imagepool
+from dataset_viewer.ingest import probe_entry
+from dataset_viewer.models import Dataset
+from dataset_viewer.utils import open_image_size
+
+
+class ImagePoolTests(SimpleTestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        (self.root / "images").mkdir()
+        for i in range(6):
+            Image.new("RGB", (40 + i, 30)).save(self.root / "images" / f"{i}.png")
+
+    def test_worker_processes_priorities_bound_and_cancel(self):
+        pool = imagepool.ImagePool(2, 3)
+        self.addCleanup(pool.shutdown)
+        entries = [(str(self.root), f"images/{i}.png") for i in range(6)]
+        self.assertEqual([f["width"] for f in pool.map(probe_entry, entries)], list(range(40, 46)))
+
+        # Both workers busy: queued work runs by priority, not arrival.
+        busy = [pool.submit(time.sleep, 0.3, priority=imagepool.BACKGROUND) for _ in range(2)]
+        order = []
+        scan = pool.submit(time.sleep, 0.05, priority=imagepool.BACKGROUND)
+        scan.add_done_callback(lambda _f: order.append("scan"))
+        thumb = pool.submit(open_image_size, str(self.root / "images" / "0.png"))
+        thumb.add_done_callback(lambda _f: order.append("thumb"))
+        dropped = pool.submit(time.sleep, 5, priority=imagepool.UPLOAD)
+        with self.assertRaises(imagepool.PoolBusy):
+            pool.submit(open_image_size, str(self.root / "images" / "1.png"))
+        self.assertTrue(dropped.cancel())
+        self.assertEqual(thumb.result(timeout=10), (40, 30))
+        scan.result(timeout=10)
+        for future in busy:
+            future.result(timeout=10)
+        self.assertEqual(order, ["thumb", "scan"])
+
+    def test_inline_pool_runs_in_the_caller(self):
+        pool = imagepool.ImagePool(0, 0)
+        self.assertEqual(pool.run(open_image_size, b"not an image"), None)
+        future = pool.submit(int, "x")
+        self.assertIsInstance(future.exception(), ValueError)
+
+
+class ImagePoolViewTests(TestCase):
+    def test_thumbnail_answers_503_when_the_pool_is_full(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        (root / "images").mkdir()
+        Image.new("RGB", (16, 16)).save(root / "images" / "a.png")
+        ds = Dataset.objects.create(name="pool", root_dir=str(root))
+        with mock.patch.object(imagepool, "_pool", imagepool.ImagePool(1, 0)):
+            resp = APIClient().get(
+                f"/api/datasets/{ds.id}/thumb", {"path": "images/a.png", "v": "503"}
+            )
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp["Retry-After"], "1")
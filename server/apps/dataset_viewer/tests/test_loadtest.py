@@ -0,0 +1,54 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test import LiveServerTestCase, SimpleTestCase, override_settings
+
+from dataset_viewer.loadtest import Options, ramp, saturation
+from dataset_viewer.models import Dataset
+from dataset_viewer.synthetic import generate_dataset
+
+
+def stage(users, throughput, error_rate=0.0):
+    return {
+        "users": users,
+        "throughput": throughput,
+        "error_rate": error_rate,
+        "latency": {"p95": 10.0},
+    }
+
+
+class SaturationTests(SimpleTestCase):
+    def test_knee_is_last_stage_that_still_added_throughput(self):
+        stages = [stage(1, 100), stage(2, 190), stage(4, 200), stage(8, 150)]
+        self.assertEqual(saturation(stages)["users"], 2)
+        self.assertTrue(saturation(stages)["reached"])
+
+    def test_errors_end_the_ramp_and_growth_means_not_saturated(self):
+        self.assertEqual(saturation([stage(1, 100), stage(2, 300, 0.5)])["users"], 1)
+        self.assertFalse(saturation([stage(1, 100), stage(2, 200)])["reached"])
+        self.assertIsNone(saturation([stage(1, 100, 0.5)]))
+
+
+@override_settings(BACKGROUND_HASHING=False)
+class LoadTestTests(LiveServerTestCase):
+    def test_ramp_against_live_server(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(tmp, ignore_errors=True))
+        generate_dataset(tmp, 6, scale=0.05, mask_ratio=1.0)
+        self.client.post(
+            "/api/datasets/scan", {"name": "load", "root_dir": tmp}, "application/json"
+        )
+        ds = Dataset.objects.get(name="load")
+
+        options = Options(self.live_server_url, ds.id, modal=1.0, mask=1.0, seed=1)
+        with override_settings(THUMBNAILS_ROOT=Path(tmp, "thumbs")):
+            report = ramp(options, [1, 2], 0.3)
+
+        self.assertEqual([s["users"] for s in report["stages"]], [1, 2])
+        first = report["stages"][0]
+        self.assertEqual(first["error_rate"], 0)
+        self.assertGreater(first["throughput"], 0)
+        for endpoint in ("dataset", "items", "thumb", "batch", "image", "mask_preview"):
+            self.assertIn(endpoint, first["endpoints"])
+        self.assertIsNotNone(first["endpoints"]["thumb"]["p99"])
@@ -0,0 +1,165 @@
+import io
+import shutil
+import tarfile
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient
+
+from dataset_viewer import masks
+from dataset_viewer.models import Dataset, DatasetItem
+
+
+def blocky_mask(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for _ in range(6):
+        x0, y0 = rng.integers(0, width), rng.integers(0, height)
+        mask[y0 : y0 + height // 3, x0 : x0 + width // 3] = rng.choice([128, 255])
+    return mask
+
+
+def png_bytes(mask):
+    buf = io.BytesIO()
+    Image.fromarray(mask, "L").save(buf, "PNG")
+    return buf.getvalue()
+
+
+class RleTests(SimpleTestCase):
+    def test_round_trip_and_coverage(self):
+        for mask in (
+            blocky_mask(317, 211),
+            np.full((1000, 3000), 255, dtype=np.uint8),  # one 4-byte varint run
+            np.zeros((1, 1), dtype=np.uint8),
+            np.arange(256, dtype=np.uint8).reshape(16, 16),
+        ):
+            blob = masks.encode(mask)
+            np.testing.assert_array_equal(masks.decode(blob), mask)
+            self.assertAlmostEqual(masks.coverage(blob), mask.mean() / 255)
+        mask = blocky_mask(1024, 1024)
+        self.assertLess(len(masks.encode(mask)) * 10, len(png_bytes(mask)))
+
+    def test_sample_matches_nearest_resize(self):
+        mask = blocky_mask(640, 480, seed=3)
+        blob = masks.encode(mask)
+        for size in ((128, 96), (77, 200), (640, 480)):
+            expected = np.asarray(Image.fromarray(mask, "L").resize(size, Image.NEAREST))
+            np.testing.assert_array_equal(masks.sample(blob, *size), expected)
+
+    def test_corrupt_blob(self):
+        blob = masks.encode(blocky_mask(64, 64))
+        with self.assertRaises(ValueError):
+            masks.decode(blob[:-1])
+        with self.assertRaises(ValueError):
+            masks.decode(b"NOPE" + blob[4:])
+
+
+@override_settings(MASK_STORE="compact", BACKGROUND_HASHING=False)
+class CompactMaskApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.root, ignore_errors=True))
+        images = Path(self.root, "images")
+        images.mkdir()
+        Image.new("RGB", (200, 100), (90, 90, 90)).save(images / "a.png")
+        Image.new("RGB", (64, 64), (0, 90, 0)).save(images / "b.png")
+        Path(self.root, "masks").mkdir()
+        Image.fromarray(blocky_mask(64, 64), "L").save(Path(self.root, "masks", "b.png"))
+        self.client.post("/api/datasets/scan", {"name": "m", "root_dir": self.root}, format="json")
+        self.ds = Dataset.objects.get(name="m")
+        self.item = DatasetItem.objects.get(dataset=self.ds, image_path="images/a.png")
+        self.mask = np.zeros((100, 200), dtype=np.uint8)
+        self.mask[:, :50] = 255
+
+    def upload(self):
+        resp = self.client.post(
+            f"/api/dataset-items/{self.item.id}/mask",
+            {"file": io.BytesIO(png_bytes(self.mask))},
+            format="multipart",
+        )
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def test_upload_is_stored_compact_and_served_as_png(self):
+        data = self.upload()
+        self.assertTrue(data["has_mask"])
+        self.assertAlmostEqual(data["mask_coverage"], 0.25)
+        self.assertFalse(Path(self.root, "masks", "a.png").exists())
+        self.item.refresh_from_db()
+        self.assertTrue(self.item.mask_rle)
+        self.assertEqual(self.item.mask_png_size, len(masks.to_png(self.item.mask_rle)))
+
+        resp = self.client.get(f"/api/dataset-items/{self.item.id}/mask")
+        self.assertEqual(resp["Content-Type"], "image/png")
+        with Image.open(io.BytesIO(resp.content)) as img:
+            np.testing.assert_array_equal(np.asarray(img), self.mask)
+
+        resp = self.client.get(f"/api/dataset-items/{self.item.id}/mask/preview?size=50")
+        with Image.open(io.BytesIO(b"".join(resp.streaming_content))) as img:
+            self.assertEqual((img.mode, img.size), ("RGBA", (50, 25)))
+            self.assertEqual(img.getpixel((0, 0)), (255, 255, 255, 255))
+            self.assertEqual(img.getpixel((49, 24)), (0, 0, 0, 0))
+
+        # A rescan finds no PNG but keeps the mask.
+        self.client.post("/api/datasets/scan", {"name": "m", "root_dir": self.root}, format="json")
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.mask_path, "masks/a.png")
+
+        stats = self.client.get(f"/api/datasets/{self.ds.id}/stats").json()
+        self.assertEqual(stats["masked_count"], 2)
+        self.assertEqual(stats["mask_coverage"]["measured"], 1)
+        self.assertEqual(stats["mask_coverage"]["hist"][2], 1)
+        with CaptureQueriesContext(connection) as queries:
+            found = self.client.get(
+                f"/api/datasets/{self.ds.id}/items", {"min_mask_coverage": "0.2"}
+            ).json()
+        self.assertFalse(any("mask_rle" in q["sql"] for q in queries.captured_queries))
+        self.assertEqual([i["image_path"] for i in found["results"]], ["images/a.png"])
+
+        resp = self.client.delete(f"/api/dataset-items/{self.item.id}/mask")
+        self.assertFalse(resp.json()["has_mask"])
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.mask_rle, self.item.mask_coverage), (b"", None))
+
+    def test_exports_read_compact_masks(self):
+        self.upload()
+        resp = self.client.get(f"/api/datasets/{self.ds.id}/archive.tar", {"q": "a.png"})
+        with tarfile.open(fileobj=io.BytesIO(b"".join(resp.streaming_content))) as tar:
+            with Image.open(tar.extractfile("masks/a.png")) as img:
+                np.testing.assert_array_equal(np.asarray(img), self.mask)
+
+        out = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(out, ignore_errors=True))
+        resp = self.client.post(
+            f"/api/datasets/{self.ds.id}/export/packed",
+            {"format": "memmap", "out_dir": out},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 200, resp.content)
+        item = DatasetItem.objects.get(id=self.item.id)
+        stacked = np.load(Path(out, f"{item.bucket}.mask.npy"))
+        self.assertEqual(stacked.shape[0], 1)
+        self.assertGreater(stacked.max(), 0)
+
+    def test_command_converts_both_ways(self):
+        png = Path(self.root, "masks", "b.png")
+        before = np.asarray(Image.open(png))
+        out = StringIO()
+        call_command("fluxlab_masks", "m", "--no-progress", stdout=out)
+        self.assertIn("converted=1", out.getvalue())
+        self.assertFalse(png.exists())
+        item = DatasetItem.objects.get(dataset=self.ds, image_path="images/b.png")
+        np.testing.assert_array_equal(masks.decode(item.mask_rle), before)
+
+        call_command("fluxlab_masks", "m", "--to", "png", "--no-progress", stdout=StringIO())
+        np.testing.assert_array_equal(np.asarray(Image.open(png)), before)
+        item.refresh_from_db()
+        self.assertEqual(item.mask_rle, b"")
@@ -0,0 +1,37 @@
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from dataset_viewer.metrics import registry
+from dataset_viewer.models import Dataset
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        registry.reset()
+
+    def test_metrics_endpoint_reports_requests_queries_and_caches(self):
+        ds = Dataset.objects.create(name="m", root_dir="/tmp")
+        self.client.get(f"/api/datasets/{ds.id}/items")
+        self.client.get(f"/api/datasets/{ds.id}/items")
+
+        resp = self.client.get("/api/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp["Content-Type"].startswith("text/plain"))
+        text = resp.content.decode()
+        route = 'route="api/datasets/<int:dataset_id>/items"'
+        self.assertIn(
+            "fluxlab_request_duration_seconds_count{" + route + ',method="GET",status="200"} 2',
+            text,
+        )
+        self.assertIn("fluxlab_request_db_queries_count{" + route + "} 2", text)
+        self.assertIn('fluxlab_cache_requests_total{cache="response",result="hit"} 1', text)
+        self.assertIn('fluxlab_cache_requests_total{cache="response",result="miss"} 1', text)
+        self.assertIn("# TYPE fluxlab_response_bytes_total counter", text)
+
+    @override_settings(SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_are_logged_with_query_params(self):
+        with self.assertLogs("fluxlab.slow", level="WARNING") as logs:
+            self.client.get("/api/datasets/", {"q": "needle"})
+        self.assertIn("/api/datasets/?q=needle", logs.output[0])
+        self.assertIn("queries=", logs.output[0])
@@ -0,0 +1,93 @@
+import json
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from dataset_viewer.models import Dataset
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.tmp, ignore_errors=True))
+        self.client = APIClient()
+        self.settings_override = override_settings(
+            PROFILING_ENABLED=True, PROFILES_ROOT=Path(self.tmp, "profiles")
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def admin(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user("admin", is_staff=True))
+        return client
+
+    def test_selected_requests_are_profiled_and_listed_for_staff(self):
+        ds = Dataset.objects.create(name="p", root_dir=self.tmp)
+        url = f"/api/datasets/{ds.id}/items"
+        self.assertNotIn("X-Fluxlab-Profile-Id", self.client.get(url))
+        resp = self.client.get(url, {"__profile": "cprofile,sample,memory"})
+        profile_id = resp["X-Fluxlab-Profile-Id"]
+        resp = self.client.get(url, HTTP_X_FLUXLAB_PROFILE="1")
+        self.assertIn("X-Fluxlab-Profile-Id", resp)
+
+        self.assertEqual(self.client.get("/api/profiles").status_code, 403)
+        admin = self.admin()
+        listed = admin.get("/api/profiles").json()["results"]
+        self.assertEqual(len(listed), 2)
+        meta = admin.get(f"/api/profiles/{profile_id}").json()
+        self.assertEqual(meta["route"], "api/datasets/<int:dataset_id>/items")
+        self.assertEqual(meta["query"], "__profile=cprofile%2Csample%2Cmemory")
+        self.assertEqual(meta["status"], 200)
+        self.assertEqual(meta["collectors"], ["cprofile", "sample", "memory"])
+        self.assertIn("memory_peak", meta)
+
+        resp = admin.get(f"/api/profiles/{profile_id}/pstats.txt")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b"function calls", b"".join(resp.streaming_content))
+        self.assertEqual(admin.get(f"/api/profiles/{profile_id}/nope").status_code, 404)
+        self.assertEqual(admin.delete(f"/api/profiles/{profile_id}").status_code, 204)
+        self.assertEqual(admin.get(f"/api/profiles/{profile_id}").status_code, 404)
+
+    @override_settings(PROFILING_RATE=1.0)
+    def test_random_rate_and_disabled(self):
+        resp = self.client.get("/api/datasets/")
+        self.assertIn("X-Fluxlab-Profile-Id", resp)
+        with override_settings(PROFILING_ENABLED=False):
+            resp = self.client.get("/api/datasets/", HTTP_X_FLUXLAB_PROFILE="1")
+        self.assertNotIn("X-Fluxlab-Profile-Id", resp)
+
+    def test_management_jobs_accept_profile(self):
+        images = Path(self.tmp, "ds", "images")
+        images.mkdir(parents=True)
+        Image.new("RGB", (8, 8)).save(images / "a.png")
+        err = StringIO()
+        call_command(
+            "fluxlab_scan",
+            "--name",
+            "job",
+            "--root",
+            str(images.parent),
+            "--workers",
+            "1",
+            "--no-progress",
+            "--profile",
+            "cprofile",
+            stdout=StringIO(),
+            stderr=err,
+        )
+        profile_id = err.getvalue().split("profile saved: ")[1].strip()
+        meta = json.loads(
+            Path(self.tmp, "profiles", f"{profile_id}.json").read_text(encoding="utf-8")
+        )
+        self.assertEqual(meta["kind"], "job")
+        self.assertEqual(meta["command"], "fluxlab_scan")
+        self.assertEqual(meta["options"]["name"], "job")
+        self.assertEqual(meta["files"], ["json", "prof", "pstats.txt"])
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from dataset_viewer.captions import flush_captions
+from dataset_viewer.models import Dataset, DatasetItem, FileSnapshot, Tag
+
+
+@override_settings(BACKGROUND_HASHING=False)
+class DatasetSyncTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.root, ignore_errors=True))
+        self.images = Path(self.root, "images")
+        self.images.mkdir()
+        for i in range(3):
+            self.make(f"{i}.png", (10 + i, 10))
+        self.client.post(
+            "/api/datasets/scan", {"name": "sync", "root_dir": self.root}, format="json"
+        )
+        self.ds = Dataset.objects.get(name="sync")
+
+    def make(self, name, size, color=None):
+        path = self.images / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", size, color or (size[0], 0, 0)).save(path)
+        return path
+
+    def sync(self):
+        resp = self.client.post(f"/api/datasets/{self.ds.id}/sync")
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def paths(self):
+        return sorted(
+            DatasetItem.objects.filter(dataset=self.ds).values_list("image_path", flat=True)
+        )
+
+    def test_first_pass_adopts_scanned_items(self):
+        result = self.sync()
+        self.assertEqual((result["adopted"], result["added"]), (3, 0))
+        self.assertEqual(FileSnapshot.objects.filter(dataset=self.ds).count(), 3)
+        self.assertEqual(self.sync()["adopted"], 0)
+
+    def test_delta_is_applied(self):
+        self.sync()
+        self.make("new.png", (64, 32))
+        (self.images / "0.png").unlink()
+        os.rename(self.images / "1.png", self.images / "moved.png")
+        modified = self.make("2.png", (40, 20))
+        os.utime(modified, ns=(1, 1))
+        (self.images / "notes.txt").write_text("not an image", encoding="utf-8")
+        moved_id = DatasetItem.objects.get(dataset=self.ds, image_path="images/1.png").id
+
+        result = self.sync()
+        self.assertEqual(
+            {k: result[k] for k in ("added", "modified", "removed", "renamed")},
+            {"added": 1, "modified": 1, "removed": 1, "renamed": 1},
+        )
+        self.assertEqual(self.paths(), ["images/2.png", "images/moved.png", "images/new.png"])
+        self.assertEqual(
+            DatasetItem.objects.get(dataset=self.ds, image_path="images/moved.png").id,
+            moved_id,
+        )
+        self.assertEqual(DatasetItem.objects.get(image_path="images/2.png").width, 40)
+        self.ds.refresh_from_db()
+        self.assertEqual(self.ds.items_count, 3)
+
+        unchanged = self.sync()
+        self.assertEqual(sum(v for k, v in unchanged.items() if k != "files"), 0)
+
+    def test_rename_matched_by_content(self):
+        self.sync()
+        src = self.images / "0.png"
+        data = src.read_bytes()
+        src.unlink()
+        (self.images / "sub").mkdir()
+        (self.images / "sub" / "copy.png").write_bytes(data)
+        result = self.sync()
+        self.assertEqual((result["renamed"], result["added"], result["removed"]), (1, 0, 0))
+        self.assertIn("images/sub/copy.png", self.paths())
+
+    def test_captions_are_ingested_and_reconciled(self):
+        sidecar = self.images / "0.txt"
+        sidecar.write_text("a red pixel", encoding="utf-8")
+        self.client.post(
+            "/api/datasets/scan", {"name": "sync", "root_dir": self.root}, format="json"
+        )
+        item = DatasetItem.objects.get(dataset=self.ds, image_path="images/0.png")
+        self.assertEqual((item.caption_path, item.caption_text), ("images/0.txt", "a red pixel"))
+        self.sync()
+
+        # Edited on disk: picked up by the next pass.
+        sidecar.write_text("a dark pixel", encoding="utf-8")
+        os.utime(sidecar, ns=(10**18, 10**18))
+        self.assertEqual(self.sync()["captions"], 1)
+        item.refresh_from_db()
+        self.assertEqual(item.caption_text, "a dark pixel")
+
+        # Edited through the API: the database wins until written back.
+        resp = self.client.patch(
+            f"/api/datasets/{self.ds.id}/items/batch",
+            {"items": [{"id": item.id, "caption": "edited"}]},
+            format="json",
+        )
+        self.assertEqual(resp.json()["updated"], 1)
+        self.assertEqual(self.sync()["captions"], 0)
+        listed = self.client.get(f"/api/datasets/{self.ds.id}/items").json()["results"]
+        self.assertIn("edited", [r["caption"] for r in listed])
+        self.assertEqual(flush_captions(self.ds), 1)
+        self.assertEqual(sidecar.read_text(encoding="utf-8"), "edited")
+        self.assertEqual(self.sync()["captions"], 0)
+
+    def test_title_and_tags_of_txt_captions_survive_rescan(self):
+        sidecar = self.images / "0.txt"
+        sidecar.write_text("a red pixel", encoding="utf-8")
+        self.client.post(
+            "/api/datasets/scan", {"name": "sync", "root_dir": self.root}, format="json"
+        )
+        item = DatasetItem.objects.get(dataset=self.ds, image_path="images/0.png")
+        resp = self.client.patch(
+            f"/api/datasets/{self.ds.id}/items/batch",
+            {"items": [{"id": item.id, "title": "T", "tags": ["cat", "pet"]}]},
+            format="json",
+        )
+        self.assertEqual(resp.json()["updated"], 1)
+        self.assertEqual(flush_captions(self.ds), 1)
+        self.assertEqual(sidecar.read_text(encoding="utf-8"), "a red pixel")
+
+        self.client.post(
+            "/api/datasets/scan", {"name": "sync", "root_dir": self.root}, format="json"
+        )
+        os.utime(sidecar, ns=(10**18, 10**18))
+        self.assertEqual(self.sync()["captions"], 1)
+        item.refresh_from_db()
+        self.assertEqual((item.caption_title, item.caption_tags), ("T", ["cat", "pet"]))
+        counts = dict(Tag.objects.filter(dataset=self.ds).values_list("name", "count"))
+        self.assertEqual(counts, {"cat": 1, "pet": 1})
+
+        # A caption rewritten on disk is a new caption: its old tags go with it.
+        sidecar.write_text("a dark pixel", encoding="utf-8")
+        os.utime(sidecar, ns=(2 * 10**18, 2 * 10**18))
+        self.sync()
+        item.refresh_from_db()
+        self.assertEqual((item.caption_text, item.caption_tags), ("a dark pixel", []))
+
+    def test_command(self):
+        self.make("cmd.png", (8, 8))
+        out = StringIO()
+        call_command("fluxlab_sync", "sync", stdout=out)
+        self.assertIn("added=1", out.getvalue())
+        self.assertIn("images/cmd.png", self.paths())
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from dataset_viewer import uploads
+from dataset_viewer.models import Dataset, DatasetItem
+
+CHUNK = 64 * 1024
+
+
+def image_bytes(size):
+    # Noise so the PNG spans several chunks.
+    img = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@override_settings(UPLOAD_CHUNK_SIZE=CHUNK, BACKGROUND_HASHING=False)
+class ChunkedUploadTests(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.root, ignore_errors=True))
+        Path(self.root, "images").mkdir()
+        self.ds = Dataset.objects.create(name="up", root_dir=self.root)
+        self.base = f"/api/datasets/{self.ds.id}/uploads"
+        self.data = image_bytes((300, 300))
+        self.assertGreater(len(self.data), 3 * CHUNK)
+
+    def start(self, *files, **extra):
+        resp = self.client.post(
+            self.base,
+            {"files": [{"name": n, "size": len(d)} for n, d in files], **extra},
+            format="json",
+        )
+        self.assertEqual(resp.status_code, 201, resp.content)
+        return resp.json()
+
+    def put(self, session, index, data, offset):
+        return self.client.put(
+            f"{self.base}/{session['id']}/files/{index}?offset={offset}",
+            data[offset : offset + CHUNK],
+            content_type="application/octet-stream",
+        )
+
+    def finalize(self, session, **body):
+        return self.client.post(f"{self.base}/{session['id']}/finalize", body, format="json")
+
+    def test_chunks_in_any_order_are_hashed_and_registered(self):
+        session = self.start(("a.png", self.data))
+        self.assertEqual(session["chunk_size"], CHUNK)
+        offsets = list(range(0, len(self.data), CHUNK))
+        for offset in [offsets[1], *offsets[2:][::-1], offsets[0]]:
+            self.assertEqual(self.put(session, 0, self.data, offset).status_code, 200)
+
+        resp = self.finalize(session)
+        self.assertEqual(resp.json(), {"created": 1, "skipped": 0})
+        item = DatasetItem.objects.get(dataset=self.ds)
+        self.assertEqual(item.image_path, "images/a.png")
+        self.assertEqual(item.sha256, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(Path(self.root, "images", "a.png").read_bytes(), self.data)
+        self.assertEqual(os.listdir(Path(self.root, ".cache", "uploads")), [])
+        self.assertEqual(self.finalize(session).status_code, 404)
+
+    def test_parallel_chunks_and_files(self):
+        other = image_bytes((200, 320))
+        session = self.start(("a.png", self.data), ("b.png", other), subdir="batch")
+        jobs = [
+            (index, data, offset)
+            for index, data in enumerate((self.data, other))
+            for offset in range(0, len(data), CHUNK)
+        ]
+        with ThreadPoolExecutor(4) as pool:
+            statuses = list(pool.map(lambda job: self.put(session, *job).status_code, jobs))
+        self.assertEqual(set(statuses), {200})
+        self.assertEqual(self.finalize(session).json(), {"created": 2, "skipped": 0})
+        items = DatasetItem.objects.filter(dataset=self.ds).order_by("image_path")
+        self.assertEqual(
+            [i.image_path for i in items], ["images/batch/a.png", "images/batch/b.png"]
+        )
+        for item, data in zip(items, (self.data, other)):
+            # Threads may leave the hash to the background pass, never a wrong one.
+            self.assertIn(item.sha256, ("", hashlib.sha256(data).hexdigest()))
+
+    def test_resume_sends_only_missing_chunks(self):
+        session = self.start(("a.png", self.data))
+        self.put(session, 0, self.data, 0)
+        self.put(session, 0, self.data, 2 * CHUNK)
+
+        resp = self.finalize(session)
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()["incomplete"], [0])
+
+        state = self.client.get(f"{self.base}/{session['id']}").json()
+        received = state["files"][0]["received"]
+        self.assertEqual(received, [0, 2])
+        for chunk in range(state["files"][0]["chunks"]):
+            if chunk not in received:
+                self.put(session, 0, self.data, chunk * CHUNK)
+        self.assertTrue(
+            self.client.get(f"{self.base}/{session['id']}").json()["files"][0]["complete"]
+        )
+        self.assertEqual(self.finalize(session).json()["created"], 1)
+
+    def test_invalid_requests(self):
+        session = self.start(("a.png", self.data))
+        url = f"{self.base}/{session['id']}/files/0"
+        short = self.client.put(
+            f"{url}?offset=0", b"x" * 10, content_type="application/octet-stream"
+        )
+        self.assertEqual(short.status_code, 400)
+        self.assertEqual(short.json()["expected"], CHUNK)
+        self.assertEqual(self.put(session, 0, self.data, 100).status_code, 400)
+        self.assertEqual(self.put(session, 5, self.data, 0).status_code, 404)
+        self.assertEqual(
+            self.client.get(f"{self.base}/{session['id']}").json()["files"][0]["received"], []
+        )
+        bad = self.client.post(
+            self.base, {"files": [{"name": "a.png", "size": 1}], "subdir": "../x"}, format="json"
+        )
+        self.assertEqual(bad.status_code, 400)
+        bad = self.client.post(
+            self.base, {"files": [{"name": "../a.png", "size": 1}]}, format="json"
+        )
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(self.client.get(f"{self.base}/nope").status_code, 404)
+
+    def test_partial_finalize_abort_and_dedupe(self):
+        session = self.start(("a.png", self.data), ("b.png", b"\x89PNG broken"))
+        for offset in range(0, len(self.data), CHUNK):
+            self.put(session, 0, self.data, offset)
+        self.assertEqual(self.finalize(session, files=[0]).json(), {"created": 1, "skipped": 0})
+        self.assertFalse(Path(self.root, "images", "b.png").exists())
+
+        again = self.start(("copy.png", self.data))
+        for offset in range(0, len(self.data), CHUNK):
+            self.put(again, 0, self.data, offset)
+        self.assertEqual(self.finalize(again).json(), {"created": 0, "skipped": 1})
+
+        aborted = self.start(("c.png", self.data))
+        self.assertEqual(self.client.delete(f"{self.base}/{aborted['id']}").status_code, 204)
+        self.assertEqual(self.client.get(f"{self.base}/{aborted['id']}").status_code, 404)
+
+    def test_existing_names_are_never_replaced(self):
+        def upload(name, data):
+            session = self.start((name, data))
+            for offset in range(0, len(data), CHUNK):
+                self.put(session, 0, data, offset)
+            return session
+
+        self.assertEqual(self.finalize(upload("a.png", self.data)).json()["created"], 1)
+        clash = self.client.post(
+            self.base, {"files": [{"name": "a.png", "size": 10}]}, format="json"
+        )
+        self.assertEqual((clash.status_code, clash.json()["existing"]), (409, ["a.png"]))
+        twice = self.client.post(
+            self.base,
+            {"files": [{"name": "b.png", "size": 10}, {"name": "B.png", "size": 10}]},
+            format="json",
+        )
+        self.assertEqual(twice.status_code, 400)
+
+        # Taken between session start and finalize: refused, session kept.
+        other = image_bytes((16, 16))
+        session = upload("c.png", other)
+        target = Path(self.root, "images", "c.png")
+        Image.new("RGB", (8, 8)).save(target)
+        original = target.read_bytes()
+        resp = self.finalize(session)
+        self.assertEqual((resp.status_code, resp.json()["existing"]), (409, ["c.png"]))
+        self.assertEqual(target.read_bytes(), original)
+        target.unlink()
+
+        # A failed registration puts the file back for another try.
+        with mock.patch.object(uploads, "register_files", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                self.finalize(session)
+        self.assertFalse(target.exists())
+        self.assertTrue(
+            self.client.get(f"{self.base}/{session['id']}").json()["files"][0]["complete"]
+        )
+        self.assertEqual(self.finalize(session).json(), {"created": 1, "skipped": 0})
+        self.assertEqual(target.read_bytes(), other)
@@ -0,0 +1,55 @@
+import threading
+
+from django.test import TransactionTestCase, override_settings
+
+from dataset_viewer.models import Dataset, DatasetItem
+from dataset_viewer.writequeue import run_write, write_queue
+
+
+def _create_item(dataset_id, name):
+    return DatasetItem.objects.create(
+        dataset_id=dataset_id, image_path=name, width=1, height=1, sha256=name
+    ).id
+
+
+def _fail():
+    raise ValueError("boom")
+
+
+@override_settings(DB_WRITE_QUEUE=True)
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.ds = Dataset.objects.create(name="wq", root_dir="/tmp/wq")
+
+    def test_concurrent_writes_are_serialized(self):
+        errors = []
+
+        def worker(n):
+            try:
+                for i in range(5):
+                    run_write(_create_item, self.ds.id, f"images/{n}_{i}.png")
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(DatasetItem.objects.filter(dataset=self.ds).count(), 20)
+        self.assertTrue(write_queue.thread.is_alive())
+
+    def test_failing_job_does_not_affect_others(self):
+        bad = write_queue.submit(_fail)
+        good = write_queue.submit(_create_item, self.ds.id, "images/ok.png")
+        with self.assertRaises(ValueError):
+            bad.result()
+        self.assertTrue(DatasetItem.objects.filter(id=good.result()).exists())
+
+    def test_inline_inside_transaction(self):
+        from django.db import transaction
+
+        with transaction.atomic():
+            item_id = run_write(_create_item, self.ds.id, "images/inline.png")
+        self.assertTrue(DatasetItem.objects.filter(id=item_id).exists())
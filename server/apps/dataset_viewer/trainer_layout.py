@@ -0,0 +1,211 @@
+"""Zero-copy trainer directory layout (kohya / ai-toolkit style).
+
+Materializes::
+
+    <out_dir>/<repeats>_<concept>/<name>.<ext>   # link to the original image
+    <out_dir>/<repeats>_<concept>/<name>.txt     # caption text
+
+Images are hardlinked, falling back to a symlink when a hardlink is not
+possible (different filesystem, unsupported FS), so no image bytes are
+copied.  A manifest in ``out_dir`` records what was created; reruns only
+touch entries whose source or caption changed and remove entries that no
+longer belong to the export.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from hashlib import sha256
+from pathlib import Path, PurePosixPath
+
+from .captions import item_caption
+from .models import Dataset, DatasetItem
+
+LINK_MODES = ("hardlink", "symlink")
+MANIFEST_NAME = ".fluxlab_layout.json"
+
+
+@dataclass(frozen=True)
+class LayoutEntry:
+    image_src: str
+    image_dst: str
+    caption_dst: str
+    caption_text: str
+    stamp: str
+
+    @property
+    def caption_digest(self) -> str:
+        return sha256(self.caption_text.encode("utf-8")).hexdigest()
+
+
+def concept_dir_name(repeats: int, concept: str) -> str:
+    concept = re.sub(r"[^\w\- ]+", "_", concept).strip() or "concept"
+    return f"{repeats}_{concept}"
+
+
+def flat_name(image_path: str) -> str:
+    """``images/a/b.png`` -> ``a__b``; :func:`plan_layout` settles the rare clashes."""
+
+    parts = PurePosixPath(image_path.replace("\\", "/")).parts
+    if parts and parts[0] == "images":
+        parts = parts[1:]
+    return "__".join(parts[:-1] + (PurePosixPath(parts[-1]).stem,))
+
+
+def caption_text(meta: dict) -> str:
+    text = (meta.get("caption") or "").strip()
+    if not text and meta.get("tags"):
+        text = ", ".join(t.strip() for t in meta["tags"] if t.strip())
+    return text
+
+
+def plan_layout(dataset: Dataset, subdir: str, qs=None) -> list[LayoutEntry]:
+    if qs is None:
+        qs = DatasetItem.objects.filter(dataset=dataset)
+    qs = qs.defer("mask_rle")
+    root = Path(dataset.root_dir)
+    entries: list[LayoutEntry] = []
+    # Image and caption share the stem, so a stem is only used once; the
+    # case-insensitive key keeps it that way on Windows and macOS too.
+    taken: set[str] = set()
+    for item in qs.order_by("id").iterator(chunk_size=2000):
+        meta = item_caption(item, root)
+        name = flat_name(item.image_path)
+        # ``images/a/b.png`` vs ``images/a__b.png``, ``x.png`` vs ``x.jpg``:
+        # the lower id keeps the plain name, so reruns keep their names.
+        while name.casefold() in taken:
+            name = f"{name}__{item.id}"
+        taken.add(name.casefold())
+        ext = item.ext or PurePosixPath(item.image_path).suffix.lstrip(".").lower()
+        entries.append(
+            LayoutEntry(
+                image_src=str(root / item.image_path),
+                image_dst=f"{subdir}/{name}.{ext}",
+                caption_dst=f"{subdir}/{name}.txt",
+                caption_text=caption_text(meta),
+                stamp=item.sha256 or str(item.file_size),
+            )
+        )
+    return entries
+
+
+def _link(src: str, dst: Path, mode: str) -> str:
+    if dst.is_symlink() or dst.exists():
+        dst.unlink()
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    os.symlink(src, dst)
+    return "symlink"
+
+
+def _is_current(entry: LayoutEntry, dst: Path, previous: dict | None) -> bool:
+    if not previous or previous.get("stamp") != entry.stamp:
+        return False
+    if previous.get("src") != entry.image_src:
+        return False
+    try:
+        return os.path.samefile(entry.image_src, dst)
+    except OSError:
+        return False
+
+
+def _materialize(out_dir: Path, entry: LayoutEntry, previous: dict | None, mode: str) -> dict:
+    image_dst = out_dir / entry.image_dst
+    caption_dst = out_dir / entry.caption_dst
+    record = {
+        "src": entry.image_src,
+        "stamp": entry.stamp,
+        "caption": entry.caption_digest,
+        "link": (previous or {}).get("link", mode),
+    }
+    changed = False
+    if not _is_current(entry, image_dst, previous):
+        if not os.path.isfile(entry.image_src):
+            return {**record, "missing": True}
+        record["link"] = _link(entry.image_src, image_dst, mode)
+        changed = True
+    if (
+        not previous
+        or previous.get("caption") != entry.caption_digest
+        or not caption_dst.is_file()
+    ):
+        tmp = caption_dst.with_name(caption_dst.name + ".tmp")
+        tmp.write_text(entry.caption_text, encoding="utf-8")
+        os.replace(tmp, caption_dst)
+        changed = True
+    return {**record, "changed": changed}
+
+
+def export_trainer_layout(
+    dataset: Dataset,
+    out_dir: str | Path,
+    concept: str | None = None,
+    repeats: int = 1,
+    mode: str = "hardlink",
+    workers: int = 8,
+    qs=None,
+) -> dict:
+    if mode not in LINK_MODES:
+        raise ValueError(f"mode must be one of {list(LINK_MODES)}")
+    out = Path(out_dir)
+    subdir = concept_dir_name(repeats, concept or dataset.name)
+    (out / subdir).mkdir(parents=True, exist_ok=True)
+
+    manifest_path = out / MANIFEST_NAME
+    try:
+        previous = json.loads(manifest_path.read_text(encoding="utf-8"))["entries"]
+    except (OSError, ValueError, KeyError):
+        previous = {}
+
+    entries = plan_layout(dataset, subdir, qs)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        records = list(
+            pool.map(
+                lambda e: _materialize(out, e, previous.get(e.image_dst), mode),
+                entries,
+            )
+        )
+
+    manifest: dict[str, dict] = {}
+    changed = missing = 0
+    for entry, record in zip(entries, records):
+        if record.pop("missing", False):
+            missing += 1
+            continue
+        changed += record.pop("changed")
+        record["caption_dst"] = entry.caption_dst
+        manifest[entry.image_dst] = record
+
+    removed = 0
+    for image_dst in set(previous) - set(manifest):
+        for rel in (image_dst, previous[image_dst].get("caption_dst")):
+            if rel:
+                path = out / rel
+                if path.is_symlink() or path.exists():
+                    path.unlink()
+        removed += 1
+
+    tmp = manifest_path.with_name(MANIFEST_NAME + ".tmp")
+    tmp.write_text(json.dumps({"entries": manifest}), encoding="utf-8")
+    os.replace(tmp, manifest_path)
+
+    links = [r["link"] for r in manifest.values()]
+    return {
+        "out_dir": str(out),
+        "subdir": subdir,
+        "items": len(manifest),
+        "changed": changed,
+        "unchanged": len(manifest) - changed,
+        "removed": removed,
+        "missing": missing,
+        "hardlinks": links.count("hardlink"),
+        "symlinks": links.count("symlink"),
+    }
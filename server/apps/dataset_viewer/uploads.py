@@ -0,0 +1,490 @@
+"""Resumable chunked uploads and the registration of uploaded files.
+
+A client creates a session listing its files (name and size), PUTs every
+file in ``chunk_size`` pieces at ``?offset=`` - in any order, several at
+once - and finalizes the session, which moves the files under
+``<root>/images/<subdir>`` and registers them with one write.  A transfer
+that broke off is resumed by asking the session which chunks arrived and
+sending only the others.
+
+Sessions live on disk next to the dataset, so finalizing is a rename::
+
+    <root>/.cache/uploads/<id>/session.json   files, subdir, chunk size
+    <root>/.cache/uploads/<id>/<n>.part       file n, written in place
+    <root>/.cache/uploads/<id>/<n>.chunks/<i> marker: chunk i is complete
+
+Request bodies are streamed to the part file, never buffered whole.  The
+sha256 of each file is computed as chunks arrive: the process keeps a
+hasher per file that consumes the received prefix, hashing a chunk while
+it is written when it is next in line and reading later chunks back once
+the gap before them closes.  When the finalizing process did not see the
+whole prefix (restart, another worker) the sha256 is left to
+``hashing.fill_pending_hashes``.  Sessions idle for
+``UPLOAD_SESSION_TTL`` seconds are removed.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+
+from . import hashing, imagepool
+from .bucketing import assign_dataset_buckets
+from .ingest import probe_image
+from .models import Dataset, DatasetItem
+from .similarity import bump_features
+from .stats import record_added
+from .tags import retag_items
+from .writequeue import run_write
+
+READ_SIZE = 64 * 1024
+MAX_FILES = 1000
+
+
+class UploadError(Exception):
+    """Invalid session or chunk request; ``status`` is the HTTP status to answer."""
+
+    def __init__(self, message: str, status: int = 400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+# === Registration ===
+
+
+def _rel_path(dataset: Dataset, abs_path: str | Path) -> str:
+    return os.path.relpath(abs_path, dataset.root_dir).replace("\\", "/")
+
+
+def _register_uploads(dataset_id: int, items: list[DatasetItem]) -> list[DatasetItem]:
+    DatasetItem.objects.bulk_create(items)
+    retag_items(dataset_id, items)
+    bump_features(dataset_id)
+    record_added(dataset_id, items)
+    return items
+
+
+def _is_duplicate(dataset: Dataset, item: DatasetItem, others: list[DatasetItem]) -> bool:
+    """Whether ``item`` has the content of one of ``others`` (same quick hash)."""
+
+    if not item.sha256:
+        item.sha256 = hashing.full_sha256(os.path.join(dataset.root_dir, item.image_path))
+    for other in others:
+        if not other.sha256:
+            other.sha256 = hashing.full_sha256(os.path.join(dataset.root_dir, other.image_path))
+        if other.sha256 and other.sha256 == item.sha256:
+            return True
+    return False
+
+
+def register_files(dataset: Dataset, files: list[tuple[str, str]]) -> dict:
+    """Register ``(abs path, sha256 or "")`` files already under the dataset root.
+
+    Files are probed on the image pool all at once; unreadable ones are
+    deleted and duplicates (quick hash, confirmed with sha256) skipped.
+    """
+
+    # Probe (decode, quick hash, features) on the image pool, all files at once.
+    probes = []
+    for abs_path, sha in files:
+        rel_path = _rel_path(dataset, abs_path)
+        future = imagepool.submit(
+            probe_image, dataset.root_dir, rel_path, priority=imagepool.UPLOAD
+        )
+        probes.append((abs_path, rel_path, sha, future))
+
+    pending: list[DatasetItem] = []
+    skipped = 0
+    for abs_path, rel_path, sha, future in probes:
+        fields = future.result()
+        if not fields:
+            os.remove(abs_path)
+            skipped += 1
+            continue
+        if sha:
+            fields["sha256"] = sha
+
+        item = DatasetItem(dataset=dataset, image_path=rel_path, **fields)
+        others = [i for i in pending if i.quick_hash == item.quick_hash]
+        others += DatasetItem.objects.filter(dataset=dataset, quick_hash=item.quick_hash)
+        if others and _is_duplicate(dataset, item, others):
+            skipped += 1
+            continue
+        pending.append(item)
+
+    # One write for all files instead of a commit per file.
+    created_items = []
+    if pending:
+        created_items = run_write(_register_uploads, dataset.id, pending)
+    assign_dataset_buckets(dataset)
+    hashing.schedule(dataset.id)
+    return {"created": len(created_items), "skipped": skipped}
+
+
+def images_dir(dataset: Dataset, subdir: str) -> Path:
+    """``<root>/images/<subdir>``; raises :class:`UploadError` if it escapes."""
+
+    base = (Path(dataset.root_dir) / "images").resolve()
+    target = (base / subdir.strip().strip("/\\")).resolve()
+    if target != base and base not in target.parents:
+        raise UploadError("invalid subdir")
+    return target
+
+
+def _taken(dataset: Dataset, save_dir: Path, names: list[str]) -> list[str]:
+    """Those of ``names`` already used under ``save_dir``, on disk or by an item."""
+
+    rel = {name: _rel_path(dataset, save_dir / name) for name in names}
+    registered = set(
+        DatasetItem.objects.filter(dataset=dataset, image_path__in=rel.values()).values_list(
+            "image_path", flat=True
+        )
+    )
+    return [name for name in names if rel[name] in registered or (save_dir / name).exists()]
+
+
+# === Sessions ===
+
+
+def uploads_root(dataset: Dataset) -> Path:
+    return Path(dataset.root_dir) / ".cache" / "uploads"
+
+
+def _session_dir(dataset: Dataset, session_id: str) -> Path:
+    if not session_id.isalnum():
+        raise UploadError("Upload session not found", 404)
+    path = uploads_root(dataset) / session_id
+    if not path.is_dir():
+        raise UploadError("Upload session not found", 404)
+    return path
+
+
+def _load(dataset: Dataset, session_id: str) -> tuple[Path, dict]:
+    path = _session_dir(dataset, session_id)
+    try:
+        return path, json.loads((path / "session.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        raise UploadError("Upload session not found", 404)
+
+
+def _chunk_count(size: int, chunk_size: int) -> int:
+    return -(-size // chunk_size)
+
+
+def _received(path: Path, index: int) -> list[int]:
+    try:
+        return sorted(int(name) for name in os.listdir(path / f"{index}.chunks"))
+    except OSError:
+        return []
+
+
+def describe(dataset: Dataset, session_id: str) -> dict:
+    """Session state for resuming: per file the chunk indexes already received."""
+
+    path, session = _load(dataset, session_id)
+    files = []
+    for index, entry in enumerate(session["files"]):
+        received = _received(path, index)
+        chunks = _chunk_count(entry["size"], session["chunk_size"])
+        files.append(
+            {
+                "index": index,
+                **entry,
+                "chunks": chunks,
+                "received": received,
+                "complete": len(received) == chunks,
+            }
+        )
+    return {
+        "id": session["id"],
+        "subdir": session["subdir"],
+        "chunk_size": session["chunk_size"],
+        "created": session["created"],
+        "files": files,
+    }
+
+
+def prune_sessions(dataset: Dataset) -> None:
+    cutoff = time.time() - settings.UPLOAD_SESSION_TTL
+    try:
+        entries = list(os.scandir(uploads_root(dataset)))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            stale = entry.stat().st_mtime < cutoff
+        except OSError:
+            continue
+        if stale:
+            _forget_session(entry.name)
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def create_session(dataset: Dataset, files: list[dict], subdir: str = "", chunk_size=None) -> dict:
+    """Start a session for ``files`` (``{"name", "size"}``) and return its state.
+
+    Names must be unique within the session (case-insensitively) and not
+    yet taken in the target directory; existing images are never replaced.
+    """
+
+    save_dir = images_dir(dataset, subdir)
+    if not files or len(files) > MAX_FILES:
+        raise UploadError(f"files must list 1..{MAX_FILES} files")
+    seen: set[str] = set()
+    for entry in files:
+        name = entry["name"]
+        if not name or name in (".", "..") or "/" in name or "\\" in name:
+            raise UploadError(f"invalid file name: {name!r}")
+        if name.casefold() in seen:
+            raise UploadError(f"file name listed twice: {name!r}")
+        seen.add(name.casefold())
+    existing = _taken(dataset, save_dir, [entry["name"] for entry in files])
+    if existing:
+        raise UploadError("files already exist", 409, existing=existing)
+    chunk_size = min(chunk_size or settings.UPLOAD_CHUNK_SIZE, settings.UPLOAD_MAX_CHUNK_SIZE)
+
+    prune_sessions(dataset)
+    session_id = uuid.uuid4().hex
+    path = uploads_root(dataset) / session_id
+    path.mkdir(parents=True)
+    session = {
+        "id": session_id,
+        "subdir": subdir.strip().strip("/\\"),
+        "chunk_size": chunk_size,
+        "created": time.time(),
+        "files": [{"name": e["name"], "size": e["size"]} for e in files],
+    }
+    for index, entry in enumerate(session["files"]):
+        (path / f"{index}.chunks").mkdir()
+        with open(path / f"{index}.part", "wb") as f:
+            f.truncate(entry["size"])
+    (path / "session.json").write_text(json.dumps(session), encoding="utf-8")
+    return describe(dataset, session_id)
+
+
+def abort_session(dataset: Dataset, session_id: str) -> None:
+    path = _session_dir(dataset, session_id)
+    _forget_session(session_id)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+# === Chunks and incremental hashing ===
+
+
+@dataclass
+class _FileHash:
+    """sha256 of the first ``hashed`` bytes of one upload file."""
+
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    hasher: object = field(default_factory=hashlib.sha256)
+    hashed: int = 0
+    broken: bool = False
+
+
+_hashes: dict[tuple[str, int], _FileHash] = {}
+_hashes_lock = threading.Lock()
+
+
+def _file_hash(session_id: str, index: int, create: bool) -> _FileHash | None:
+    with _hashes_lock:
+        state = _hashes.get((session_id, index))
+        if state is None and create:
+            state = _hashes[(session_id, index)] = _FileHash()
+        return state
+
+
+def _forget_session(session_id: str) -> None:
+    with _hashes_lock:
+        for key in [k for k in _hashes if k[0] == session_id]:
+            del _hashes[key]
+
+
+def _catch_up(path: Path, index: int, state: _FileHash, size: int, chunk_size: int) -> None:
+    """Hash the chunks already on disk right after the hashed prefix (lock held)."""
+
+    with open(path / f"{index}.part", "rb") as f:
+        while not state.broken and state.hashed < size:
+            if not (path / f"{index}.chunks" / str(state.hashed // chunk_size)).exists():
+                break
+            f.seek(state.hashed)
+            length = min(chunk_size, size - state.hashed)
+            while length:
+                data = f.read(min(READ_SIZE, length))
+                if not data:
+                    state.broken = True
+                    break
+                state.hasher.update(data)
+                state.hashed += len(data)
+                length -= len(data)
+
+
+def _advance(path: Path, index: int, state: _FileHash, size: int, chunk_size: int) -> None:
+    # Whoever holds the lock hashes; a writer that finds it taken relies on
+    # the holder re-checking for its chunk after releasing.
+    while state.lock.acquire(blocking=False):
+        try:
+            _catch_up(path, index, state, size, chunk_size)
+        finally:
+            state.lock.release()
+        next_marker = path / f"{index}.chunks" / str(state.hashed // chunk_size)
+        if state.broken or state.hashed >= size or not next_marker.exists():
+            return
+
+
+def write_chunk(dataset: Dataset, session_id: str, index: int, offset: int, stream, length: int):
+    """Store ``length`` bytes of ``stream`` at ``offset`` of file ``index``."""
+
+    path, session = _load(dataset, session_id)
+    if not 0 <= index < len(session["files"]):
+        raise UploadError("File not found", 404)
+    size = session["files"][index]["size"]
+    chunk_size = session["chunk_size"]
+    if offset < 0 or offset >= size or offset % chunk_size:
+        raise UploadError(f"offset must be a multiple of {chunk_size} below {size}")
+    expected = min(chunk_size, size - offset)
+    if length != expected:
+        raise UploadError(f"chunk at {offset} must be {expected} bytes", 400, expected=expected)
+    marker = path / f"{index}.chunks" / str(offset // chunk_size)
+    if marker.exists():
+        return describe_file(path, session, index)
+
+    state = _file_hash(session_id, index, create=offset == 0)
+    # Next in line: hash the bytes on their way to disk.
+    inline = state is not None and state.lock.acquire(blocking=False)
+    if inline and (state.broken or state.hashed != offset):
+        state.lock.release()
+        inline = False
+    try:
+        # Each writer has its own handle and position, so chunks can land at once.
+        with open(path / f"{index}.part", "r+b") as f:
+            f.seek(offset)
+            remaining = length
+            while remaining:
+                data = stream.read(min(READ_SIZE, remaining))
+                if not data:
+                    raise UploadError(f"chunk at {offset} ended after {length - remaining} bytes")
+                f.write(data)
+                if inline:
+                    state.hasher.update(data)
+                remaining -= len(data)
+        if inline:
+            state.hashed = offset + length
+    except BaseException:
+        if inline:
+            # Part of the chunk went into the hasher; the sha256 is deferred.
+            state.broken = True
+        raise
+    finally:
+        if inline:
+            state.lock.release()
+    marker.touch()
+    os.utime(path)  # keeps the session from being pruned while in use
+    # Looked up again: chunk 0 may have started the hasher meanwhile.
+    state = _file_hash(session_id, index, create=False)
+    if state is not None:
+        _advance(path, index, state, size, chunk_size)
+    return describe_file(path, session, index)
+
+
+def describe_file(path: Path, session: dict, index: int) -> dict:
+    received = _received(path, index)
+    chunks = _chunk_count(session["files"][index]["size"], session["chunk_size"])
+    return {
+        "index": index,
+        "received": len(received),
+        "chunks": chunks,
+        "complete": len(received) == chunks,
+    }
+
+
+def _digest(session_id: str, index: int, size: int) -> str:
+    state = _file_hash(session_id, index, create=False)
+    if state is None or state.broken or state.hashed != size:
+        return ""
+    return state.hasher.hexdigest()
+
+
+def finalize_session(dataset: Dataset, session_id: str, indexes: list[int] | None = None) -> dict:
+    """Move the complete files of a session into place and register them.
+
+    ``indexes`` limits it to some files (the others are dropped); every
+    file finalized must be complete and its name still free.  If the
+    registration fails the files go back and the session can be retried.
+    """
+
+    path, session = _load(dataset, session_id)
+    count = len(session["files"])
+    indexes = list(range(count)) if indexes is None else sorted(set(indexes))
+    if any(not 0 <= i < count for i in indexes):
+        raise UploadError("File not found", 404)
+    chunk_size = session["chunk_size"]
+    incomplete = [
+        i
+        for i in indexes
+        if len(_received(path, i)) != _chunk_count(session["files"][i]["size"], chunk_size)
+    ]
+    if incomplete:
+        raise UploadError("files are incomplete", 409, incomplete=incomplete)
+    save_dir = images_dir(dataset, session["subdir"])
+    existing = _taken(dataset, save_dir, [session["files"][i]["name"] for i in indexes])
+    if existing:
+        raise UploadError("files already exist", 409, existing=existing)
+
+    # Claim the session so a repeated finalize cannot move the files twice.
+    claimed = path.with_name(f"{session_id}.finalizing")
+    try:
+        os.rename(path, claimed)
+    except OSError:
+        raise UploadError("Upload session not found", 404)
+    moved: list[tuple[int, Path]] = []
+    try:
+        save_dir.mkdir(parents=True, exist_ok=True)
+        files = []
+        for index in indexes:
+            entry = session["files"][index]
+            target = save_dir / entry["name"]
+            os.replace(claimed / f"{index}.part", target)
+            moved.append((index, target))
+            files.append((str(target), _digest(session_id, index, entry["size"])))
+        result = register_files(dataset, files)
+    except BaseException:
+        _restore(dataset, claimed, session, moved)
+        os.rename(claimed, path)
+        raise
+    _forget_session(session_id)
+    shutil.rmtree(claimed, ignore_errors=True)
+    return result
+
+
+def _restore(dataset: Dataset, path: Path, session: dict, moved: list[tuple[int, Path]]) -> None:
+    """Put moved files back into the session; a file that is gone is re-sent.
+
+    Files the failed registration already committed stay where they are.
+    """
+
+    rel = {index: _rel_path(dataset, target) for index, target in moved}
+    registered = set(
+        DatasetItem.objects.filter(dataset=dataset, image_path__in=rel.values()).values_list(
+            "image_path", flat=True
+        )
+    )
+    for index, target in moved:
+        if rel[index] in registered:
+            continue
+        try:
+            os.replace(target, path / f"{index}.part")
+        except OSError:
+            shutil.rmtree(path / f"{index}.chunks", ignore_errors=True)
+            (path / f"{index}.chunks").mkdir()
+            with open(path / f"{index}.part", "wb") as f:
+                f.truncate(session["files"][index]["size"])
@@ -1,19 +1,42 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 from .views import dataset_view_page
 
+# Serving views: async under ASGI, see async_views.py.
+serving = async_views if settings.ASGI_SERVING else views
+
 urlpatterns = [
     path("", views.datasets_list),
     path("scan", views.dataset_scan),
+    path("<int:dataset_id>/sync", views.dataset_sync),
     path("<int:dataset_id>/", views.dataset_detail),
+    path("<int:dataset_id>/stats", views.dataset_stats),
+    path("<int:dataset_id>/buckets", views.dataset_buckets),
+    path("<int:dataset_id>/tags", views.dataset_tags),
+    path("<int:dataset_id>/tags/cooccurrence", views.dataset_tag_cooccurrence),
+    path("<int:dataset_id>/sample", views.dataset_sample),
+    path("<int:dataset_id>/similar", views.dataset_similar),
+    path("<int:dataset_id>/split", views.dataset_split),
     path("<int:dataset_id>/items", views.dataset_items_list, name="dataset_items_list"),
+    path("<int:dataset_id>/items/batch", views.dataset_items_batch, name="dataset_items_batch"),
     path("<int:dataset_id>/items/<int:item_id>/", views.dataset_item_detail, name="dataset_item_detail"),
-    path("<int:dataset_id>/files", views.dataset_file_serve, name="dataset_file_serve"),
-    path("<int:dataset_id>/thumb", views.dataset_thumb_serve, name="dataset_thumb_serve"),
+    path("<int:dataset_id>/files", serving.dataset_file_serve, name="dataset_file_serve"),
+    path("<int:dataset_id>/thumb", serving.dataset_thumb_serve, name="dataset_thumb_serve"),
     path("<int:dataset_id>/upload", views.dataset_upload),
+    path("<int:dataset_id>/uploads", views.upload_sessions),
+    path("<int:dataset_id>/uploads/<str:session_id>", views.upload_session_detail),
+    path(
+        "<int:dataset_id>/uploads/<str:session_id>/files/<int:index>",
+        views.upload_session_chunk,
+    ),
+    path("<int:dataset_id>/uploads/<str:session_id>/finalize", views.upload_session_finalize),
     path("<int:dataset_id>/export", views.dataset_export),
+    path("<int:dataset_id>/export/packed", views.dataset_export_packed),
+    path("<int:dataset_id>/export/trainer", views.dataset_export_trainer),
+    path("<int:dataset_id>/archive.<str:fmt>", views.dataset_archive),
     path("<int:dataset_id>/import", views.dataset_import),
-    path("item/<int:item_id>/image", views.item_image),
+    path("item/<int:item_id>/image", serving.item_image),
 
     # NEW: dataset view page
     path("<int:dataset_id>/view", dataset_view_page, name="dataset_view_page"),
@@ -1,22 +1,52 @@
 from __future__ import annotations
 
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from hashlib import sha256
+import io
+import json
 from pathlib import Path
-from typing import Iterator, Optional
+from typing import Callable, Iterator, Optional
 import pathlib
 
 from django.conf import settings
 from PIL import Image
 
+from .imageheader import read_header
 
-def open_image_size(path: str | Path) -> Optional[tuple[int, int]]:
+
+def open_image_size(path: str | Path | bytes) -> Optional[tuple[int, int]]:
+    """``(width, height)`` of an image file (or its bytes), ``None`` if unreadable.
+
+    The header parser handles JPEG/PNG/WebP; anything else goes through PIL.
+    """
+
+    header = read_header(path)
+    if header is not None:
+        return header.size
+    return pil_image_size(path)
+
+
+def pil_image_size(path: str | Path | bytes) -> Optional[tuple[int, int]]:
     try:
-        with Image.open(path) as img:
+        with Image.open(io.BytesIO(path) if isinstance(path, bytes) else path) as img:
             return img.width, img.height
     except Exception:
         return None
 
 
+def derived_image_fields(rel_path: str, width: int | None, height: int | None) -> dict:
+    """Return the indexed columns derived from an item's path and size."""
+
+    ext = Path(rel_path).suffix.lower().lstrip(".")
+    if width and height:
+        aspect_ratio = round(width / height, 4)
+        megapixels = round(width * height / 1_000_000, 4)
+    else:
+        aspect_ratio = megapixels = None
+    return {"ext": ext, "aspect_ratio": aspect_ratio, "megapixels": megapixels}
+
+
 def sha256_file(path: str | Path) -> str:
     h = sha256()
     try:
@@ -28,6 +58,44 @@ def sha256_file(path: str | Path) -> str:
         return ""
 
 
+def read_caption_file(path: str | Path) -> dict:
+    """Parse a caption sidecar: JSON ``{title, caption, tags}`` or plain text."""
+
+    result = {"title": "", "caption": "", "tags": []}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = f.read().strip()
+    except OSError:
+        return result
+    try:
+        obj = json.loads(data)
+    except json.JSONDecodeError:
+        result["caption"] = data
+        return result
+    if not isinstance(obj, dict):
+        result["caption"] = data
+        return result
+    result["title"] = obj.get("title", "") or ""
+    result["caption"] = obj.get("caption", "") or ""
+    result["tags"] = obj.get("tags", []) or []
+    return result
+
+
+def find_caption_file(root_dir: str | Path, image_path: str, caption_path: str = "") -> Optional[Path]:
+    """Return the caption sidecar of an item: ``caption_path`` or a sibling .json/.txt."""
+
+    root = Path(root_dir)
+    if caption_path:
+        candidate = root / caption_path
+        return candidate if candidate.is_file() else None
+    base = (root / image_path).with_suffix("")
+    for suffix in (".json", ".txt"):
+        candidate = base.with_name(base.name + suffix)
+        if candidate.is_file():
+            return candidate
+    return None
+
+
 def iter_images(root_dir: str | Path) -> Iterator[str]:
     base = Path(root_dir) / "images"
     patterns = ("*.jpg", "*.jpeg", "*.png", "*.webp")
@@ -37,6 +105,34 @@ def iter_images(root_dir: str | Path) -> Iterator[str]:
                 yield str(path)
 
 
+@contextmanager
+def parallel_map(workers: int, chunksize: int = 8) -> Iterator[Callable]:
+    """Yield an order-preserving ``map`` backed by a process pool.
+
+    ``workers=imagepool.SHARED`` (0) maps on the server's shared image pool
+    at background priority, which is what the API views use; ``workers == 1``
+    runs inline, which is what tests and small jobs use.  Larger counts
+    (the commands' ``--workers``) get a private pool started the same way
+    as the shared one, never forked.  Mapped functions must be module-level
+    and take picklable arguments.
+    """
+
+    from . import imagepool
+
+    if workers == imagepool.SHARED:
+        yield imagepool.map
+        return
+    if workers <= 1:
+        yield map
+        return
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=imagepool.worker_context(),
+        initializer=imagepool.init_worker,
+    ) as pool:
+        yield lambda fn, items: pool.map(fn, items, chunksize=chunksize)
+
+
 def ensure_thumb_cache_dir(base: Path) -> Path:
     path = base / "cache" / "thumbnails"
     path.mkdir(parents=True, exist_ok=True)
@@ -58,6 +154,34 @@ def make_thumbnail(src_path: Path, dst_path: Path, size: int = 256) -> None:
         img.save(dst_path, "JPEG", quality=85)
 
 
+def ensure_thumbnail(src_path: str | Path, thumb_path: str | Path) -> bool:
+    """Render the grid thumbnail of ``src_path`` unless it exists; True if rendered."""
+
+    thumb_path = Path(thumb_path)
+    if thumb_path.exists():
+        return False
+    thumb_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = thumb_path.with_name(thumb_path.name + ".tmp")
+    with Image.open(src_path) as img:
+        img = img.convert("RGB")
+        img.thumbnail(settings.THUMBNAIL_SIZE, Image.LANCZOS)
+        img.save(tmp, "JPEG", quality=85)
+    tmp.replace(thumb_path)
+    return True
+
+
+def render_mask_preview(mask_path: str | Path, cache_path: str | Path, size: int) -> None:
+    """Write the white-on-transparent PNG preview of a mask, at most ``size`` px."""
+
+    with Image.open(mask_path) as img:
+        mask = img.convert("L")
+        preview = Image.new("RGBA", mask.size, (0, 0, 0, 0))
+        white = Image.new("RGBA", mask.size, (255, 255, 255, 255))
+        preview.paste(white, mask=mask)
+        preview.thumbnail((size, size), Image.NEAREST)
+        preview.save(cache_path, "PNG")
+
+
 def resolve_dataset_image_abs_path(dataset, rel_path: str) -> pathlib.Path:
     root = pathlib.Path(dataset.root_dir).resolve()
     candidate = (root / rel_path).resolve()
@@ -86,15 +210,20 @@ def default_mask_relpath(item) -> str:
 
 
 def validate_mask_image(mask_file, target_w: int, target_h: int) -> None:
-    try:
-        with Image.open(mask_file) as img:
-            w, h = img.size
-    except Exception as exc:  # pragma: no cover - simple validation
-        raise ValueError("invalid image") from exc
-    if w != target_w or h != target_h:
-        raise ValueError("mask size mismatch")
-    if hasattr(mask_file, "seek"):
+    """Check a mask (path or uploaded file) has the item's size; decoded on the image pool."""
+
+    from . import imagepool
+
+    if hasattr(mask_file, "read"):
+        source = mask_file.read()
         mask_file.seek(0)
+    else:
+        source = str(mask_file)
+    size = imagepool.run(open_image_size, source, priority=imagepool.UPLOAD)
+    if size is None:
+        raise ValueError("invalid image")
+    if size != (target_w, target_h):
+        raise ValueError("mask size mismatch")
 
 
 def write_mask_file(dst_path: Path, fileobj) -> None:
@@ -1,16 +1,27 @@
-import hashlib
 import os
 import json
+import random
+import time
 
-from django.db.models import Count, Q
-from django.http import FileResponse, Http404, JsonResponse
-from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from rest_framework.decorators import api_view, parser_classes
 from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from django.shortcuts import render
-from pathlib import Path
 
+from rest_framework import serializers
+
+from .batch import MAX_BATCH, delete_items, fetch_items, patch_items
+from .bucketing import (
+    assign_dataset_buckets,
+    bucket_histogram,
+    get_resolutions,
+    parse_resolutions,
+)
+from .filters import filter_items, order_items, parse_bool
+from . import hashing, imagepool, masks, uploads
+from .ingest import scan_dataset
+from .metrics import observe_decode, record_cache
 from .models import Dataset, DatasetItem
 from .serializers import (
     DatasetListSerializer,
@@ -18,9 +29,37 @@ from .serializers import (
     DatasetItemListSerializer,
     DatasetItemDetailSerializer,
 )
+from .sampling import (
+    ALLOCATIONS,
+    MAX_SAMPLE,
+    STRATIFY_BY,
+    assign_split,
+    sample_stratified,
+    sample_uniform,
+    split_counts,
+)
+from .similarity import (
+    DEFAULT_NPROBE,
+    MAX_K,
+    MAX_QUERIES,
+    as_vector,
+    get_index,
+    search,
+)
+from .response_cache import cached_json, dataset_version, datasets_version
+from .sync import sync_dataset
+from .tags import cooccurrence, rebuild_tags, tag_counts, untag_items
+from .stats import (
+    ItemStats,
+    bump_version,
+    recompute_stats,
+    record_changed,
+    record_removed,
+    stats_payload,
+)
 from .utils import (
-    iter_images,
-    open_image_size,
+    ensure_thumbnail,
+    render_mask_preview,
     sha256_file,
     resolve_dataset_image_abs_path,
     thumbnail_path_for,
@@ -30,99 +69,258 @@ from .utils import (
     validate_mask_image,
     write_mask_file,
 )
+from .writequeue import run_write
 
 
 # === List/Detail Datasets ===
 
 @api_view(["GET"])
+@cached_json(datasets_version)
 def datasets_list(_request):
-    qs = Dataset.objects.annotate(items_count=Count("items"))
+    qs = Dataset.objects.defer("width_hist", "height_hist")
     return Response(DatasetListSerializer(qs, many=True).data)
 
 
 @api_view(["GET"])
+@cached_json(dataset_version)
 def dataset_detail(_request, dataset_id: int):
-    qs = Dataset.objects.filter(id=dataset_id).annotate(items_count=Count("items"))
-    dataset = qs.first()
+    dataset = Dataset.objects.filter(id=dataset_id).first()
     if not dataset:
         raise Http404("Dataset not found")
     return Response(DatasetDetailSerializer(dataset).data)
 
 
-# === Items ===
+@api_view(["GET", "POST"])
+def dataset_stats(request, dataset_id: int):
+    """Return the stored aggregates; POST rebuilds them from the items."""
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    if request.method == "POST":
+        dataset = recompute_stats(dataset)
+    return Response(stats_payload(dataset))
+
+
+class BucketAssignSerializer(serializers.Serializer):
+    full = serializers.BooleanField(default=False)
+
+
+@api_view(["GET", "POST"])
+def dataset_buckets(request, dataset_id: int):
+    """Bucket histogram; POST (re)assigns buckets.
+
+    POST body: ``{"resolutions": [[w, h], ...] | null, "full": bool}``.
+    Changing the resolutions always triggers a full reassignment.
+    """
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+
+    assigned = None
+    if request.method == "POST":
+        ser = BucketAssignSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        full = ser.validated_data["full"]
+        if "resolutions" in request.data:
+            raw = request.data.get("resolutions")
+            try:
+                resolutions = parse_resolutions(raw) if raw else []
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=400)
+            stored = [list(r) for r in resolutions]
+            if stored != dataset.bucket_resolutions:
+                dataset.bucket_resolutions = stored
+                dataset.save(update_fields=["bucket_resolutions"])
+                bump_version(dataset.id)
+                full = True
+        assigned = assign_dataset_buckets(dataset, full=full)
+
+    data = {
+        "resolutions": [list(r) for r in get_resolutions(dataset)],
+        **bucket_histogram(dataset),
+    }
+    if assigned is not None:
+        data["assigned"] = assigned
+    return Response(data)
+
+
+class SplitSerializer(serializers.Serializer):
+    val_fraction = serializers.FloatField(min_value=0, max_value=1)
+    seed = serializers.IntegerField(default=0)
+    stratify = serializers.ChoiceField(choices=STRATIFY_BY, required=False, allow_null=True)
+
+
+@api_view(["GET"])
+def dataset_sample(request, dataset_id: int):
+    """Random items: ``?n=20&seed=1&stratify=bucket&allocation=equal``.
+
+    Accepts the item-list filters.  Without ``seed`` every call differs.
+    """
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    try:
+        n = int(request.GET.get("n", 20))
+        seed = request.GET.get("seed")
+        rng = random.Random(int(seed)) if seed not in (None, "") else random.Random()
+    except ValueError:
+        return Response({"detail": "n and seed must be int"}, status=400)
+    if not 1 <= n <= MAX_SAMPLE:
+        return Response({"detail": f"n must be in [1..{MAX_SAMPLE}]"}, status=400)
+    allocation = request.GET.get("allocation", "proportional")
+    if allocation not in ALLOCATIONS:
+        return Response({"detail": f"allocation must be one of {list(ALLOCATIONS)}"}, status=400)
+
+    try:
+        qs = filter_items(
+            DatasetItem.objects.filter(dataset=dataset).defer("mask_rle"), request.GET
+        )
+        stratify = request.GET.get("stratify")
+        if stratify:
+            groups = sample_stratified(qs, n, stratify, rng, allocation)
+        else:
+            groups = [{"key": None, "items": sample_uniform(qs, n, rng)}]
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+
+    for group in groups:
+        group["results"] = DatasetItemListSerializer(group.pop("items"), many=True).data
+    if not stratify:
+        return Response({"results": groups[0]["results"]})
+    return Response({"stratify": stratify, "strata": groups})
+
+
+@api_view(["GET"])
+@cached_json(dataset_version)
+def dataset_similar(request, dataset_id: int):
+    """Items that look like the given ones: ``?items=1,2&k=20&nprobe=8&exact=1``.
+
+    Each query item gets its ``k`` nearest items by cosine similarity of
+    the feature vectors, itself excluded.  ``exact=1`` scans the whole
+    matrix even when the dataset has an IVF index.
+    """
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    try:
+        ids = [int(part) for part in request.GET.get("items", "").split(",") if part.strip()]
+        k = int(request.GET.get("k", 20))
+        nprobe = int(request.GET.get("nprobe", DEFAULT_NPROBE))
+    except ValueError:
+        return Response({"detail": "items, k and nprobe must be int"}, status=400)
+    if not 1 <= len(ids) <= MAX_QUERIES:
+        return Response({"detail": f"items must list 1..{MAX_QUERIES} ids"}, status=400)
+    if not 1 <= k <= MAX_K:
+        return Response({"detail": f"k must be in [1..{MAX_K}]"}, status=400)
+    if nprobe < 1:
+        return Response({"detail": "nprobe must be >= 1"}, status=400)
+    exact = request.GET.get("exact") in ("1", "true")
+
+    vectors = dict(
+        DatasetItem.objects.filter(dataset=dataset, id__in=ids).values_list("id", "features")
+    )
+    queries = [(i, as_vector(vectors.get(i))) for i in ids]
+    missing = [i for i, vector in queries if vector is None]
+    queries = [(i, vector) for i, vector in queries if vector is not None]
+    # Over-fetch: the query itself and rows of items deleted since the
+    # matrix was built are dropped below.
+    found = search(
+        get_index(dataset),
+        [vector for _, vector in queries],
+        2 * k + 1,
+        None if exact else nprobe,
+    )
+    wanted = {item_id for matches in found for item_id, _ in matches}
+    items = DatasetItem.objects.filter(dataset=dataset, id__in=wanted).defer("mask_rle")
+    by_id = {row["id"]: row for row in DatasetItemListSerializer(items, many=True).data}
+
+    results = []
+    for (query_id, _), matches in zip(queries, found):
+        rows = [
+            {**by_id[item_id], "score": round(score, 4)}
+            for item_id, score in matches
+            if item_id != query_id and item_id in by_id
+        ]
+        results.append({"item": query_id, "results": rows[:k]})
+    return Response({"results": results, "missing": missing})
+
+
+@api_view(["GET", "POST"])
+def dataset_split(request, dataset_id: int):
+    """Train/val counts; POST ``{val_fraction, seed, stratify}`` reassigns them."""
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    if request.method == "POST":
+        ser = SplitSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        assign_split(dataset, **ser.validated_data)
+    return Response(split_counts(dataset))
+
+
+@api_view(["GET", "POST"])
+@cached_json(dataset_version)
+def dataset_tags(request, dataset_id: int):
+    """Tag frequencies: ``?q=<prefix>&limit=100&offset=0``; POST rebuilds the index."""
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    if request.method == "POST":
+        run_write(rebuild_tags, dataset)
+        bump_version(dataset.id)
+    try:
+        limit = int(request.GET.get("limit", 100))
+        offset = int(request.GET.get("offset", 0))
+    except ValueError:
+        return Response({"detail": "limit and offset must be int"}, status=400)
+    if not 1 <= limit <= 1000 or offset < 0:
+        return Response({"detail": "limit must be in [1..1000]"}, status=400)
+    return Response(tag_counts(dataset, request.GET.get("q", ""), limit, offset))
+
+
+@api_view(["GET"])
+@cached_json(dataset_version)
+def dataset_tag_cooccurrence(request, dataset_id: int):
+    """Tags most often found together with ``?tag=<name>``, top ``k``."""
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    name = request.GET.get("tag", "").strip()
+    if not name:
+        return Response({"detail": "tag is required"}, status=400)
+    try:
+        k = int(request.GET.get("k", 20))
+    except ValueError:
+        return Response({"detail": "k must be int"}, status=400)
+    if not 1 <= k <= 500:
+        return Response({"detail": "k must be in [1..500]"}, status=400)
+    return Response(cooccurrence(dataset, name, k))
+
 
-ALLOWED_SORT = {"created_at", "width", "height", "image_path"}
+# === Items ===
 
 
 @api_view(["GET"])
+@cached_json(dataset_version)
 def dataset_items_list(request, dataset_id: int):
     try:
         dataset = Dataset.objects.get(id=dataset_id)
     except Dataset.DoesNotExist:
         return JsonResponse({"detail": "dataset not found"}, status=404)
 
-    qs = DatasetItem.objects.filter(dataset=dataset)
-
-    # filters
-    q = request.GET.get("q")
-    if q:
-        qs = qs.filter(image_path__icontains=q)
-
-    def to_int(name):
-        v = request.GET.get(name)
-        if v is None:
-            return None
-        try:
-            return int(v)
-        except Exception:  # noqa: BLE001
-            raise ValueError(f"{name} must be int")
-
+    qs = DatasetItem.objects.filter(dataset=dataset).defer("mask_rle")
     try:
-        min_w, max_w = to_int("min_w"), to_int("max_w")
-        min_h, max_h = to_int("min_h"), to_int("max_h")
-    except ValueError as e:  # pragma: no cover - trivial
+        qs = order_items(filter_items(qs, request.GET), request.GET)
+    except ValueError as e:
         return JsonResponse({"detail": str(e)}, status=400)
 
-    if min_w is not None:
-        qs = qs.filter(width__gte=min_w)
-    if max_w is not None:
-        qs = qs.filter(width__lte=max_w)
-    if min_h is not None:
-        qs = qs.filter(height__gte=min_h)
-    if max_h is not None:
-        qs = qs.filter(height__lte=max_h)
-
-    has_caption = request.GET.get("has_caption")
-    if has_caption:
-        if has_caption.lower() not in ("true", "false"):
-            return JsonResponse(
-                {"detail": "has_caption must be true|false"}, status=400
-            )
-        qs = qs.filter(has_caption=(has_caption.lower() == "true"))
-
-    exts = request.GET.get("ext")
-    if exts:
-        exts_set = {
-            ("." + e.strip().lstrip(".")).lower()
-            for e in exts.split(",")
-            if e.strip()
-        }
-        if exts_set:
-            q_or = Q()
-            for ext in exts_set:
-                q_or |= Q(image_path__iendswith=ext)
-            qs = qs.filter(q_or)
-
-    order_by = request.GET.get("order_by", "image_path")
-    order = request.GET.get("order", "asc")
-    if order_by not in ALLOWED_SORT:
-        return JsonResponse(
-            {"detail": f"order_by must be one of {sorted(ALLOWED_SORT)}"},
-            status=400,
-        )
-    prefix = "" if order == "asc" else "-"
-    qs = qs.order_by(prefix + order_by)
-
     def to_pg(name, default):
         v = request.GET.get(name, default)
         try:
@@ -150,6 +348,67 @@ def dataset_items_list(request, dataset_id: int):
         status=200,
     )
 
+class BatchDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=MAX_BATCH
+    )
+    delete_files = serializers.BooleanField(default=False)
+
+
+class ItemPatchSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    caption_path = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    mask_path = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    title = serializers.CharField(required=False, allow_blank=True)
+    caption = serializers.CharField(required=False, allow_blank=True)
+    tags = serializers.ListField(child=serializers.CharField(), required=False)
+
+
+class BatchPatchSerializer(serializers.Serializer):
+    items = serializers.ListField(
+        child=ItemPatchSerializer(), allow_empty=False, max_length=MAX_BATCH
+    )
+
+
+@api_view(["GET", "PATCH", "DELETE"])
+def dataset_items_batch(request, dataset_id: int):
+    """Many items in one request.
+
+    GET ``?ids=1,2,3`` returns their details; PATCH ``{"items": [{"id",
+    "caption_path"?, "mask_path"?, "title"?, "caption"?, "tags"?}]}`` edits
+    them; DELETE ``{"ids": [...], "delete_files": bool}`` removes them.
+    Mutations are one transaction.
+    """
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+
+    if request.method == "GET":
+        try:
+            ids = [int(v) for v in request.GET.get("ids", "").split(",") if v.strip()]
+        except ValueError:
+            return Response({"detail": "ids must be comma-separated integers"}, status=400)
+        if len(ids) > MAX_BATCH:
+            return Response({"detail": f"at most {MAX_BATCH} ids"}, status=400)
+        items, missing = fetch_items(dataset, ids)
+        return Response(
+            {"results": DatasetItemDetailSerializer(items, many=True).data, "missing": missing}
+        )
+
+    if request.method == "DELETE":
+        ser = BatchDeleteSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        return Response(delete_items(dataset, **ser.validated_data))
+
+    ser = BatchPatchSerializer(data=request.data)
+    ser.is_valid(raise_exception=True)
+    try:
+        return Response(patch_items(dataset, ser.validated_data["items"]))
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+
+
 @api_view(["GET", "DELETE"])
 def dataset_item_detail(request, dataset_id: int, item_id: int):
     """Retrieve or delete a single dataset item."""
@@ -157,13 +416,20 @@ def dataset_item_detail(request, dataset_id: int, item_id: int):
     item = (
         DatasetItem.objects.filter(id=item_id, dataset_id=dataset_id)
         .select_related("dataset")
+        .defer("mask_rle")
         .first()
     )
     if not item:
         raise Http404("Item not found")
 
     if request.method == "DELETE":
-        item.delete()
+
+        def delete():
+            untag_items([item.id])
+            item.delete()
+            record_removed(dataset_id, [item])
+
+        run_write(delete)
         return Response(status=204)
 
     return Response(DatasetItemDetailSerializer(item).data)
@@ -188,10 +454,17 @@ def dataset_item_mask(request, item_id: int):
         raise Http404("Item not found")
     dataset = item.dataset
     root = get_dataset_root(dataset)
+    before = ItemStats.of(item)
 
     if request.method == "GET":
         if not item.mask_path:
             raise Http404("Mask not found")
+        if item.mask_rle:
+            try:
+                png = imagepool.run(masks.to_png, item.mask_rle)
+            except imagepool.PoolBusy:
+                return _pool_busy()
+            return HttpResponse(png, content_type="image/png")
         abs_mask = (root / item.mask_path).resolve()
         if not abs_mask.is_file():
             raise Http404("Mask not found")
@@ -206,21 +479,29 @@ def dataset_item_mask(request, item_id: int):
                     abs_mask.unlink()
                 except OSError:
                     pass
-            item.mask_path = None
-            item.save(update_fields=["mask_path"])
+            masks.drop_previews(root, item.mask_path)
+            masks.set_mask_path(item, None)
+            item.save(update_fields=["mask_path", *masks.COMPACT_FIELDS])
+            record_changed(dataset.id, before, item)
         return Response(DatasetItemDetailSerializer(item).data)
 
     # POST
+    rel_path = default_mask_relpath(item)
+    abs_path = root / rel_path
+    compact = None
     if "file" in request.FILES:
         file_obj = request.FILES["file"]
         try:
             validate_mask_image(file_obj, item.width or 0, item.height or 0)
         except ValueError as e:
             return Response({"detail": str(e)}, status=400)
-        rel_path = default_mask_relpath(item)
-        abs_path = get_dataset_root(dataset) / rel_path
-        get_masks_dir(dataset)
-        write_mask_file(abs_path, file_obj)
+        if masks.compact_enabled():
+            compact = imagepool.run(
+                masks.encode_image, file_obj.read(), priority=imagepool.UPLOAD
+            )
+        else:
+            get_masks_dir(dataset)
+            write_mask_file(abs_path, file_obj)
     else:
         existing_path = request.data.get("existing_path")
         if not existing_path:
@@ -235,17 +516,33 @@ def dataset_item_mask(request, item_id: int):
             validate_mask_image(src_path, item.width or 0, item.height or 0)
         except ValueError as e:
             return Response({"detail": str(e)}, status=400)
-        rel_path = default_mask_relpath(item)
-        abs_path = get_dataset_root(dataset) / rel_path
-        get_masks_dir(dataset)
-        with open(src_path, "rb") as fsrc:
-            write_mask_file(abs_path, fsrc)
-
-    item.mask_path = rel_path
-    item.save(update_fields=["mask_path"])
+        if masks.compact_enabled():
+            compact = imagepool.run(masks.encode_image, str(src_path), priority=imagepool.UPLOAD)
+        else:
+            get_masks_dir(dataset)
+            with open(src_path, "rb") as fsrc:
+                write_mask_file(abs_path, fsrc)
+
+    if masks.compact_enabled() and compact is None:
+        return Response({"detail": "invalid image"}, status=400)
+    if item.mask_path:
+        masks.drop_previews(root, item.mask_path)
+    masks.set_mask_path(item, rel_path)
+    masks.set_compact(item, compact)
+    if compact:
+        # The database copy is the mask now; a PNG left here would be stale.
+        abs_path.unlink(missing_ok=True)
+    item.save(update_fields=["mask_path", *masks.COMPACT_FIELDS])
+    record_changed(dataset.id, before, item)
     return Response(DatasetItemDetailSerializer(item).data)
 
 
+def _pool_busy() -> Response:
+    return Response(
+        {"detail": "image workers busy, retry later"}, status=503, headers={"Retry-After": "1"}
+    )
+
+
 @api_view(["GET"])
 def dataset_item_mask_preview(request, item_id: int):
     item = DatasetItem.objects.select_related("dataset").filter(id=item_id).first()
@@ -259,22 +556,23 @@ def dataset_item_mask_preview(request, item_id: int):
     size = max(1, size)
 
     root = get_dataset_root(item.dataset)
-    mask_abs = (root / item.mask_path).resolve()
-    if not mask_abs.is_file():
-        raise Http404("Mask not found")
+    if item.mask_rle:
+        render, source = masks.render_preview, item.mask_rle
+    else:
+        render, source = render_mask_preview, (root / item.mask_path).resolve()
+        if not source.is_file():
+            raise Http404("Mask not found")
 
     cache_path = root / ".cache" / "masks" / str(size) / item.mask_path
     cache_path.parent.mkdir(parents=True, exist_ok=True)
+    record_cache("mask_preview", hit=cache_path.exists())
     if not cache_path.exists():
-        from PIL import Image
-
-        with Image.open(mask_abs) as img:
-            mask = img.convert("L")
-            preview = Image.new("RGBA", mask.size, (0, 0, 0, 0))
-            white = Image.new("RGBA", mask.size, (255, 255, 255, 255))
-            preview.paste(white, mask=mask)
-            preview.thumbnail((size, size), Image.NEAREST)
-            preview.save(cache_path, "PNG")
+        started = time.perf_counter()
+        try:
+            imagepool.run(render, source, cache_path, size)
+        except imagepool.PoolBusy:
+            return _pool_busy()
+        observe_decode("mask_preview", time.perf_counter() - started)
 
     return FileResponse(open(cache_path, "rb"), content_type="image/png")
 
@@ -332,15 +630,17 @@ def dataset_thumb_serve(request, dataset_id: int):
         return Response({"detail": "unsupported media type"}, status=415)
 
     thumb_path = thumbnail_path_for(dataset_id, rel_path)
-    thumb_path.parent.mkdir(parents=True, exist_ok=True)
-
-    if not thumb_path.exists():
-        from PIL import Image
-
-        with Image.open(src_path) as img:
-            img = img.convert("RGB")
-            img.thumbnail(settings.THUMBNAIL_SIZE, Image.LANCZOS)
-            img.save(thumb_path, "JPEG", quality=85)
+    started = time.perf_counter()
+    if thumb_path.exists():
+        rendered = False
+    else:
+        try:
+            rendered = imagepool.run(ensure_thumbnail, src_path, thumb_path)
+        except imagepool.PoolBusy:
+            return _pool_busy()
+    record_cache("thumbnail", hit=not rendered)
+    if rendered:
+        observe_decode("thumbnail", time.perf_counter() - started)
 
     resp = FileResponse(open(thumb_path, "rb"), content_type="image/jpeg")
     resp["Cache-Control"] = "public, max-age=86400"
@@ -349,181 +649,305 @@ def dataset_thumb_serve(request, dataset_id: int):
         resp["ETag"] = etag
     return resp
 
+
 @api_view(["POST"])
 @parser_classes([MultiPartParser])
 def dataset_upload(request, dataset_id: int):
+    """Upload files in one multipart request; see ``upload_sessions`` for large batches."""
+
     dataset = Dataset.objects.filter(id=dataset_id).first()
     if not dataset:
         raise Http404("Dataset not found")
 
-    files = request.FILES.getlist("files")
-    subdir = request.POST.get("subdir", "").strip().strip("/\\")
-    base_images = os.path.join(dataset.root_dir, "images")
-    save_dir = os.path.join(base_images, subdir) if subdir else base_images
-    os.makedirs(save_dir, exist_ok=True)
-
-    created = 0
-    skipped = 0
-    for f in files:
-        filename = f.name
-        target_path = os.path.join(save_dir, filename)
+    try:
+        save_dir = uploads.images_dir(dataset, request.POST.get("subdir", ""))
+    except uploads.UploadError as e:
+        return Response({"detail": str(e)}, status=e.status)
+    save_dir.mkdir(parents=True, exist_ok=True)
+
+    saved = []
+    for f in request.FILES.getlist("files"):
+        target_path = os.path.join(save_dir, os.path.basename(f.name))
         with open(target_path, "wb") as out:
             for chunk in f.chunks():
                 out.write(chunk)
+        saved.append((target_path, ""))
+    return Response(uploads.register_files(dataset, saved))
 
-        try:
-            from PIL import Image
-
-            with Image.open(target_path) as img:
-                w, h = img.size
-        except Exception:
-            os.remove(target_path)
-            skipped += 1
-            continue
-
-        with open(target_path, "rb") as inf:
-            sha256 = hashlib.sha256(inf.read()).hexdigest()
-
-        rel_path = os.path.relpath(target_path, dataset.root_dir)
-
-        if DatasetItem.objects.filter(dataset=dataset, sha256=sha256).exists():
-            skipped += 1
-            continue
-
-        DatasetItem.objects.create(
-            dataset=dataset,
-            image_path=rel_path,
-            width=w,
-            height=h,
-            sha256=sha256,
+
+# === Chunked uploads ===
+
+
+class UploadFileSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    size = serializers.IntegerField(min_value=1)
+
+
+class UploadSessionSerializer(serializers.Serializer):
+    files = serializers.ListField(
+        child=UploadFileSerializer(), allow_empty=False, max_length=uploads.MAX_FILES
+    )
+    subdir = serializers.CharField(required=False, allow_blank=True, default="")
+    chunk_size = serializers.IntegerField(min_value=64 * 1024, required=False)
+
+
+class UploadFinalizeSerializer(serializers.Serializer):
+    files = serializers.ListField(child=serializers.IntegerField(min_value=0), required=False)
+
+
+def _upload_error(e: uploads.UploadError) -> Response:
+    return Response({"detail": str(e), **e.extra}, status=e.status)
+
+
+@api_view(["POST"])
+def upload_sessions(request, dataset_id: int):
+    """Start a chunked upload: ``{"files": [{"name", "size"}], "subdir", "chunk_size"}``.
+
+    Then ``PUT .../files/<n>?offset=`` each chunk (raw bytes, in any order)
+    and ``POST .../finalize``.  ``GET`` on the session lists the chunks
+    already received, for resuming.
+    """
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    ser = UploadSessionSerializer(data=request.data)
+    ser.is_valid(raise_exception=True)
+    try:
+        session = uploads.create_session(
+            dataset,
+            ser.validated_data["files"],
+            ser.validated_data["subdir"],
+            ser.validated_data.get("chunk_size"),
         )
-        created += 1
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return Response(session, status=201)
 
-    return Response({"created": created, "skipped": skipped})
 
-# === Import / Export Metadata ===
+@api_view(["GET", "DELETE"])
+def upload_session_detail(request, dataset_id: int, session_id: str):
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    try:
+        if request.method == "DELETE":
+            uploads.abort_session(dataset, session_id)
+            return Response(status=204)
+        return Response(uploads.describe(dataset, session_id))
+    except uploads.UploadError as e:
+        return _upload_error(e)
+
 
-from pydantic import BaseModel, ValidationError
+@api_view(["PUT"])
+def upload_session_chunk(request, dataset_id: int, session_id: str, index: int):
+    """One chunk of file ``index`` as the raw body, at ``?offset=``."""
 
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    try:
+        offset = int(request.GET.get("offset", ""))
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        return Response({"detail": "offset must be int"}, status=400)
+    try:
+        # request.stream: the body is read as it is written, never parsed.
+        state = uploads.write_chunk(dataset, session_id, index, offset, request.stream, length)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return Response(state)
 
-class MetadataItem(BaseModel):
-    filename: str
-    title: str | None = ""
-    caption: str | None = ""
-    tags: list[str] | None = []
-    mask: str | None = ""
+
+@api_view(["POST"])
+def upload_session_finalize(request, dataset_id: int, session_id: str):
+    """Register the uploaded files: all of them, or ``{"files": [n, ...]}``."""
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    ser = UploadFinalizeSerializer(data=request.data)
+    ser.is_valid(raise_exception=True)
+    try:
+        result = uploads.finalize_session(dataset, session_id, ser.validated_data.get("files"))
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return Response(result)
+
+# === Import / Export Metadata ===
+
+from .archive import (
+    ARCHIVE_FORMATS,
+    CONTENT_TYPES,
+    TarLayout,
+    archive_etag,
+    iter_zip,
+    parse_range,
+    plan_members,
+)
+from .metadata import MetadataError, export_metadata, import_metadata, parse_metadata
+from .shards import EXPORT_FORMATS, export_packed
+from .trainer_layout import LINK_MODES, export_trainer_layout
 
 
 @api_view(["GET"])
+@cached_json(dataset_version)
 def dataset_export(request, dataset_id: int):
     dataset = Dataset.objects.filter(id=dataset_id).first()
     if not dataset:
         raise Http404("Dataset not found")
 
-    items = DatasetItem.objects.filter(dataset_id=dataset_id).order_by("image_path")
-    results: list[dict] = []
-    for item in items:
-        title = ""
-        caption = ""
-        tags: list[str] = []
-        if item.caption_path:
-            abs_caption = os.path.join(dataset.root_dir, item.caption_path)
-            if os.path.isfile(abs_caption):
-                try:
-                    with open(abs_caption, "r", encoding="utf-8") as f:
-                        data = f.read().strip()
-                    try:
-                        obj = json.loads(data)
-                        title = obj.get("title", "") or ""
-                        caption = obj.get("caption", "") or ""
-                        tags = obj.get("tags", []) or []
-                    except json.JSONDecodeError:
-                        caption = data
-                except OSError:
-                    pass
-        results.append(
-            {
-                "filename": item.image_path,
-                "title": title,
-                "caption": caption,
-                "tags": tags,
-                "mask": item.mask_path or "",
-            }
-        )
-
+    results = export_metadata(dataset)
     return Response(results)
 
 
+class PackedExportSerializer(serializers.Serializer):
+    format = serializers.ChoiceField(choices=EXPORT_FORMATS, default="tar")
+    shard_size = serializers.IntegerField(min_value=1, default=1000)
+    out_dir = serializers.CharField(required=False, allow_blank=True)
+
+
 @api_view(["POST"])
-def dataset_import(request, dataset_id: int):
+def dataset_export_packed(request, dataset_id: int):
+    """Write tar shards or bucket memmaps for the items matching the filters."""
+
     dataset = Dataset.objects.filter(id=dataset_id).first()
     if not dataset:
         raise Http404("Dataset not found")
+    ser = PackedExportSerializer(data=request.data)
+    ser.is_valid(raise_exception=True)
+    opts = ser.validated_data
 
     try:
-        payload = json.loads(request.body.decode("utf-8"))
-    except Exception:
-        return Response({"detail": "invalid json"}, status=400)
+        qs = filter_items(DatasetItem.objects.filter(dataset=dataset), request.GET)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+
+    result = export_packed(
+        dataset,
+        opts["format"],
+        out_dir=opts.get("out_dir") or None,
+        shard_size=opts["shard_size"],
+        workers=imagepool.SHARED,
+        qs=qs,
+    )
+    return Response(result)
 
-    if not isinstance(payload, list):
-        return Response({"detail": "invalid format"}, status=400)
 
-    items: list[MetadataItem] = []
-    filenames: set[str] = set()
-    for raw in payload:
-        try:
-            meta = MetadataItem(**raw)
-        except ValidationError as e:  # pragma: no cover - validation is trivial
-            return Response({"detail": e.errors()}, status=400)
-        if meta.filename in filenames:
-            return Response({"detail": f"duplicate filename: {meta.filename}"}, status=400)
-        filenames.add(meta.filename)
-        items.append(meta)
-
-    qs = DatasetItem.objects.filter(dataset_id=dataset_id)
-    db_map = {obj.image_path: obj for obj in qs}
-    db_names = set(db_map.keys())
-
-    if filenames != db_names:
-        missing = sorted(db_names - filenames)
-        extra = sorted(filenames - db_names)
-        return Response(
-            {"detail": "filenames mismatch", "missing": missing, "extra": extra},
-            status=400,
+class TrainerLayoutSerializer(serializers.Serializer):
+    out_dir = serializers.CharField()
+    concept = serializers.CharField(required=False, allow_blank=True)
+    repeats = serializers.IntegerField(min_value=1, default=1)
+    mode = serializers.ChoiceField(choices=LINK_MODES, default="hardlink")
+    workers = serializers.IntegerField(min_value=1, max_value=64, default=8)
+
+
+@api_view(["POST"])
+def dataset_export_trainer(request, dataset_id: int):
+    """Link the items matching the filters into a trainer folder layout."""
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    ser = TrainerLayoutSerializer(data=request.data)
+    ser.is_valid(raise_exception=True)
+    opts = ser.validated_data
+
+    try:
+        qs = filter_items(DatasetItem.objects.filter(dataset=dataset), request.GET)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+
+    result = export_trainer_layout(
+        dataset,
+        opts["out_dir"],
+        concept=opts.get("concept") or None,
+        repeats=opts["repeats"],
+        mode=opts["mode"],
+        workers=opts["workers"],
+        qs=qs,
+    )
+    return Response(result)
+
+
+@api_view(["GET"])
+def dataset_archive(request, dataset_id: int, fmt: str):
+    """Stream ``archive.zip`` or ``archive.tar`` of the items matching the filters.
+
+    ``?captions=false&masks=false`` plus the ``dataset_items_list`` filters
+    and ordering.  tar downloads honour ``Range``/``If-Range``.  The format is
+    part of the path because DRF reserves ``?format=`` for renderers.
+    """
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    if fmt not in ARCHIVE_FORMATS:
+        raise Http404("Unknown archive format")
+    try:
+        qs = order_items(
+            filter_items(DatasetItem.objects.filter(dataset=dataset), request.GET), request.GET
         )
+        captions = parse_bool(request.GET, "captions")
+        masks = parse_bool(request.GET, "masks")
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+    members = plan_members(dataset, qs, captions is not False, masks is not False)
+    filename = f"{dataset.name}.{fmt}".replace('"', "")
+
+    if fmt == "zip":
+        resp = StreamingHttpResponse(iter_zip(members), content_type=CONTENT_TYPES[fmt])
+        resp["Accept-Ranges"] = "none"
+        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return resp
+
+    layout = TarLayout(members)
+    etag = archive_etag(members, fmt)
+    byte_range = None
+    if_range = request.headers.get("If-Range")
+    if not if_range or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get("Range"), layout.size)
+        except ValueError:
+            resp = Response({"detail": "range not satisfiable"}, status=416)
+            resp["Content-Range"] = f"bytes */{layout.size}"
+            return resp
+    start, end = byte_range or (0, layout.size - 1)
+    resp = StreamingHttpResponse(
+        layout.iter_bytes(start, end),
+        status=206 if byte_range else 200,
+        content_type=CONTENT_TYPES[fmt],
+    )
+    if byte_range:
+        resp["Content-Range"] = f"bytes {start}-{end}/{layout.size}"
+    resp["Content-Length"] = str(end - start + 1)
+    resp["Accept-Ranges"] = "bytes"
+    resp["ETag"] = etag
+    resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return resp
 
-    for meta in items:
-        item = db_map[meta.filename]
-        # determine caption path
-        caption_rel = item.caption_path
-        if not caption_rel:
-            base, _ = os.path.splitext(meta.filename)
-            caption_rel = base + ".json"
-            item.caption_path = caption_rel
-
-        abs_caption = os.path.join(dataset.root_dir, caption_rel)
-        os.makedirs(os.path.dirname(abs_caption), exist_ok=True)
-        with open(abs_caption, "w", encoding="utf-8") as f:
-            json.dump(
-                {
-                    "title": meta.title or "",
-                    "caption": meta.caption or "",
-                    "tags": meta.tags or [],
-                },
-                f,
-                ensure_ascii=False,
-            )
 
-        item.has_caption = bool(meta.caption)
-        item.mask_path = meta.mask or None
-        item.save(update_fields=["caption_path", "mask_path", "has_caption"])
+@api_view(["POST"])
+def dataset_import(request, dataset_id: int):
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+    except Exception:
+        return Response({"detail": "invalid json"}, status=400)
+
+    try:
+        items = parse_metadata(payload)
+        import_metadata(dataset, items)
+    except MetadataError as e:
+        return Response(e.payload, status=400)
 
     return Response({"updated": len(items)})
 
 # === Scan ===
 
-from rest_framework import serializers
-
 
 class DatasetScanSerializer(serializers.Serializer):
     name = serializers.CharField()
@@ -548,52 +972,29 @@ def dataset_scan(request):
     if dataset.root_dir != root_dir:
         dataset.root_dir = root_dir
         dataset.save(update_fields=["root_dir"])
+        bump_version(dataset.id)
+
+    result = scan_dataset(dataset, workers=imagepool.SHARED)
+    hashing.schedule(dataset.id)
+    return Response(result)
+
+
+@api_view(["POST"])
+def dataset_sync(_request, dataset_id: int):
+    """Apply the filesystem changes since the last pass to the dataset."""
+
+    dataset = Dataset.objects.filter(id=dataset_id).first()
+    if not dataset:
+        raise Http404("Dataset not found")
+    try:
+        result = sync_dataset(dataset, workers=imagepool.SHARED)
+    except FileNotFoundError:
+        return Response({"detail": "root_dir does not exist"}, status=400)
+    hashing.schedule(dataset.id)
+    return Response(result)
+
+
+def dataset_view_page(request, dataset_id: int):
+    """Render the dataset browser page."""
+    return render(request, "dataset_viewer/detail.html", {"dataset_id": dataset_id})
 
-    created = 0
-    skipped = 0
-    for file_path in iter_images(root_dir):
-        rel_path = os.path.relpath(file_path, root_dir).replace("\\", "/")
-        size = open_image_size(file_path)
-        if not size:
-            skipped += 1
-            continue
-        width, height = size
-        sha = sha256_file(file_path)
-        base, _ = os.path.splitext(file_path)
-        has_caption = os.path.exists(base + ".txt") or os.path.exists(base + ".json")
-        mask_rel = default_mask_relpath(
-            type("X", (), {"image_path": rel_path})()
-        )
-        mask_abs = Path(root_dir) / mask_rel
-        has_mask = mask_abs.is_file()
-        defaults = {
-            "width": width,
-            "height": height,
-            "sha256": sha,
-            "has_caption": has_caption,
-            "mask_path": mask_rel if has_mask else None,
-        }
-        obj, was_created = DatasetItem.objects.get_or_create(
-            dataset=dataset,
-            image_path=rel_path,
-            defaults=defaults,
-        )
-        if was_created:
-            created += 1
-        else:
-            updated_fields: list[str] = []
-            if obj.has_caption != has_caption:
-                obj.has_caption = has_caption
-                updated_fields.append("has_caption")
-            expected_mask = mask_rel if has_mask else None
-            if obj.mask_path != expected_mask:
-                obj.mask_path = expected_mask
-                updated_fields.append("mask_path")
-            if updated_fields:
-                obj.save(update_fields=updated_fields)
-
-    return Response({"created": created, "skipped": skipped})
-
-    def dataset_view_page(request, dataset_id: int):
-        """Render the dataset browser page."""
-        return render(request, "dataset_viewer/detail.html", {"dataset_id": dataset_id})
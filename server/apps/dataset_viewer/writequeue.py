@@ -0,0 +1,113 @@
+"""Serialized write queue for bulk database writes.
+
+SQLite allows one writer at a time.  With several request threads and
+commands writing concurrently, each one waits on the database lock and
+sometimes gives up with "database is locked".  When
+``settings.DB_WRITE_QUEUE`` is enabled, bulk writes from scan, sync, import
+and upload are handed to a single writer thread instead, which groups the
+jobs that queued up meanwhile into one transaction (each job in its own
+savepoint, so a failing job does not take the others down).
+
+Callers use :func:`run_write`, which blocks until the job is committed and
+returns its result.  Without the queue (the default for development and
+tests) the job simply runs inline in a transaction.
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class WriteQueue:
+    def __init__(self, max_batch: int = 32, max_pending: int = 256):
+        self.max_batch = max_batch
+        self.jobs: queue.Queue = queue.Queue(maxsize=max_pending)
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def in_writer(self) -> bool:
+        return self.thread is not None and threading.current_thread() is self.thread
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        # Blocks when the writer is behind: producers slow down instead of
+        # piling up unbounded work in memory.
+        self.jobs.put((future, fn, args, kwargs))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _ensure_started(self) -> None:
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._loop, name="fluxlab-db-writer", daemon=True
+                )
+                self.thread.start()
+
+    def _take_batch(self) -> list:
+        batch = [self.jobs.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._take_batch()
+            close_old_connections()
+            outcomes = []
+            try:
+                with transaction.atomic():
+                    for future, fn, args, kwargs in batch:
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        try:
+                            with transaction.atomic():
+                                outcomes.append((future, fn(*args, **kwargs), None))
+                        except Exception as exc:  # noqa: BLE001 - reported to caller
+                            outcomes.append((future, None, exc))
+            except Exception as exc:  # commit failed: every job failed
+                logger.exception("write batch failed")
+                for future, *_ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for future, result, exc in outcomes:
+                if exc is not None:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+
+
+write_queue = WriteQueue()
+
+
+def run_write(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` in a write transaction and return its result.
+
+    Goes through the writer thread when ``settings.DB_WRITE_QUEUE`` is on,
+    except from inside an open transaction (the writer would wait on our
+    own lock) or from the writer thread itself.
+    """
+
+    if (
+        getattr(settings, "DB_WRITE_QUEUE", False)
+        and not connection.in_atomic_block
+        and not write_queue.in_writer()
+    ):
+        return write_queue.run(fn, *args, **kwargs)
+    with transaction.atomic():
+        return fn(*args, **kwargs)
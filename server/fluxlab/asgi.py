@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+from django.core.asgi import get_asgi_application
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'apps'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fluxlab.settings')
+# Serve files, thumbnails and masks with the async views, see dataset_viewer/async_views.py.
+os.environ.setdefault('FLUXLAB_ASGI', '1')
+application = get_asgi_application()
@@ -15,10 +15,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+'dataset_viewer.metrics.MetricsMiddleware',
 'django.middleware.security.SecurityMiddleware','django.contrib.sessions.middleware.SessionMiddleware',
 'corsheaders.middleware.CorsMiddleware','django.middleware.common.CommonMiddleware',
 'django.middleware.csrf.CsrfViewMiddleware','django.contrib.auth.middleware.AuthenticationMiddleware',
 'django.contrib.messages.middleware.MessageMiddleware','django.middleware.clickjacking.XFrameOptionsMiddleware',
+'dataset_viewer.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'fluxlab.urls'
@@ -31,14 +33,86 @@ TEMPLATES = [{
 ]},
 }]
 WSGI_APPLICATION = 'fluxlab.wsgi.application'
+ASGI_APPLICATION = 'fluxlab.asgi.application'
+
+# ASGI mode (fluxlab.asgi sets FLUXLAB_ASGI=1): files, thumbnails, item
+# images and masks are served by the async views in
+# dataset_viewer/async_views.py.
+ASGI_SERVING = os.environ.get("FLUXLAB_ASGI", "") == "1"
+FILE_IO_THREADS = 16
+FILE_CHUNK_SIZE = 256 * 1024
+
+# Shared process pool for thumbnail/mask/upload/scan image work, see
+# dataset_viewer/imagepool.py.  0 workers runs it inline;
+# at most IMAGE_POOL_MAX_PENDING tasks wait, thumbnails beyond that get 503.
+IMAGE_POOL_WORKERS = int(os.environ.get("FLUXLAB_IMAGE_POOL_WORKERS", min(4, os.cpu_count() or 1)))
+IMAGE_POOL_MAX_PENDING = int(os.environ.get("FLUXLAB_IMAGE_POOL_MAX_PENDING", "256"))
+
+# Full sha256 of scanned/synced/uploaded files is computed after the fact by
+# HASH_WORKERS threads, see dataset_viewer/hashing.py.  Without
+# BACKGROUND_HASHING only the commands fill it in.
+HASH_WORKERS = int(os.environ.get("FLUXLAB_HASH_WORKERS", "4"))
+BACKGROUND_HASHING = os.environ.get("FLUXLAB_BACKGROUND_HASHING", "1") == "1"
+
+# Chunked upload sessions, see dataset_viewer/uploads.py.  Clients may ask
+# for another chunk size up to UPLOAD_MAX_CHUNK_SIZE; sessions idle for
+# UPLOAD_SESSION_TTL seconds are removed.
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 32 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 3600
+
+# "compact" keeps uploaded masks run-length encoded in the database instead
+# of PNG files under masks/, see dataset_viewer/masks.py.
+MASK_STORE = os.environ.get("FLUXLAB_MASK_STORE", "png")
 
 DATABASES = {'default':{'ENGINE':'django.db.backends.sqlite3','NAME': BASE_DIR / 'db.sqlite3'}}
+
+# FLUXLAB_DB_PROFILE=production: SQLite tuned for several concurrent
+# workers.  WAL lets readers proceed while a writer commits, IMMEDIATE
+# transactions take the write lock up front (no deadlocking lock upgrades),
+# and bulk writes go through one writer thread (DB_WRITE_QUEUE).
+DB_PROFILE = os.environ.get("FLUXLAB_DB_PROFILE", "default")
+DB_WRITE_QUEUE = False
+if DB_PROFILE == "production":
+    DATABASES["default"].update({
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "timeout": 30,
+            "transaction_mode": "IMMEDIATE",
+            "init_command": (
+                "PRAGMA journal_mode=WAL;"
+                "PRAGMA synchronous=NORMAL;"
+                "PRAGMA busy_timeout=30000;"
+                "PRAGMA mmap_size=268435456;"
+                "PRAGMA cache_size=-65536;"
+                "PRAGMA temp_store=MEMORY"
+            ),
+        },
+    })
+    DB_WRITE_QUEUE = True
+
+# Per-process LRU of rendered JSON responses, see dataset_viewer/response_cache.py.
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Requests at least this slow are logged on "fluxlab.slow", see dataset_viewer/metrics.py.
+SLOW_REQUEST_SECONDS = float(os.environ.get("FLUXLAB_SLOW_REQUEST_SECONDS", "1.0"))
+
+# Opt-in request profiling, see dataset_viewer/profiling.py.  When enabled,
+# requests with an X-Fluxlab-Profile header or ?__profile=... are profiled,
+# plus a random PROFILING_RATE share of all requests.
+PROFILING_ENABLED = os.environ.get("FLUXLAB_PROFILING", "") == "1"
+PROFILING_RATE = float(os.environ.get("FLUXLAB_PROFILING_RATE", "0"))
+PROFILING_INTERVAL = 0.005
+PROFILING_KEEP = 200
+PROFILES_ROOT = BASE_DIR / "storage" / "profiles"
 AUTH_PASSWORD_VALIDATORS = []
 LANGUAGE_CODE = 'ru-ru'
 TIME_ZONE = 'Europe/Moscow'
 USE_I18N = True
 
 MEDIA_ROOT = BASE_DIR / "media"
+STATIC_URL = "/static/"
 
 REST_FRAMEWORK = {
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
@@ -49,3 +123,19 @@ REST_FRAMEWORK = {
 THUMBNAILS_ROOT = BASE_DIR / "storage" / "thumbnails"
 THUMBNAIL_SIZE = (512, 512)
 FILE_SERVE_PREFIX = "/api/datasets"
+
+# Default output location of packed training exports
+EXPORTS_ROOT = BASE_DIR / "storage" / "exports"
+
+# Target resolutions for aspect-ratio bucketing (Flux LoRA training).
+BUCKET_RESOLUTIONS = [
+    (1024, 1024),
+    (1152, 896),
+    (896, 1152),
+    (1216, 832),
+    (832, 1216),
+    (1344, 768),
+    (768, 1344),
+    (1536, 640),
+    (640, 1536),
+]
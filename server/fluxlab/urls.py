@@ -1,17 +1,26 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
 from dataset_viewer import views as ds_views
+from dataset_viewer.metrics import metrics_view
+from dataset_viewer import async_views, profiling
+
+serving = async_views if settings.ASGI_SERVING else ds_views
 
 def health(_): return JsonResponse({"ok": True})
 
 urlpatterns = [
 path('admin/', admin.site.urls),
 path('api/health', health),
+path('api/metrics', metrics_view),
+path('api/profiles', profiling.profiles_list),
+path('api/profiles/<str:profile_id>', profiling.profile_detail),
+path('api/profiles/<str:profile_id>/<str:name>', profiling.profile_download),
 path('api/datasets/', include('dataset_viewer.urls')),
 path('datasets/', include('dataset_viewer.urls')),
-path('api/dataset-items/<int:item_id>/mask', ds_views.dataset_item_mask),
-path('api/dataset-items/<int:item_id>/mask/preview', ds_views.dataset_item_mask_preview),
+path('api/dataset-items/<int:item_id>/mask', serving.dataset_item_mask),
+path('api/dataset-items/<int:item_id>/mask/preview', serving.dataset_item_mask_preview),
 path('api/enhance/', include('enhance.urls')),
 path('', include('webui.urls')),
 ]
\ No newline at end of file